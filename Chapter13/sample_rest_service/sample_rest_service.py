@@ -9,10 +9,31 @@ for ABQ Data Entry.  It provides 3 endpoints:
 - /files for downloading a file
 
 /files can respond to HEAD requests to simply check the file's
-existence and size.
+existence and size.  GET /files streams the file, compressed
+with zstd or gzip if the client's Accept-Encoding allows it.
+
+It also supports chunked, resumable uploads:
+
+- POST /uploads with a filename and size starts an upload
+- PATCH /uploads/<id> appends a chunk at the Upload-Offset header
+- HEAD /uploads/<id> reports the Upload-Offset and ETag so far
+
+The ETag is the SHA-256 of the data received so far.  A PATCH
+with an If-Match header that doesn't match it is refused, and
+so is one whose Upload-Offset isn't the current offset.
+
+Chunks may be compressed with any encoding listed in the
+Accept-Encoding header of the /uploads responses; offsets and the
+ETag count the decompressed bytes.
+
+zstd support requires the zstandard library.
 """
 
 import sys
+import gzip
+import zlib
+import hashlib
+import uuid
 from pathlib import Path
 
 try:
@@ -24,6 +45,14 @@ except ImportError:
   )
   sys.exit()
 
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# Content encodings we can send and receive, most preferred first
+encodings = ['zstd', 'gzip'] if zstandard else ['gzip']
+
 app = f.Flask(__name__)
 app.secret_key = '12345'
 
@@ -65,6 +94,125 @@ def upload():
 
   return f.jsonify({'message': 'Success'})
 
+##################
+# Chunked upload #
+##################
+
+# upload id -> filename, size, offset, running hash of the data,
+# and whether it is complete
+uploads = dict()
+upload_dir = Path('uploads')
+
+
+def decode(data, encoding):
+  """Decompress a request body sent with Content-Encoding"""
+  if encoding == 'gzip':
+    return gzip.decompress(data)
+  if encoding == 'zstd':
+    return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+  return data
+
+
+def encode(path, encoding, chunk_size=2**16):
+  """Generate the file at path, compressed with encoding"""
+  if encoding == 'zstd':
+    compressor = zstandard.ZstdCompressor().compressobj()
+  else:
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(wbits=31)
+  with open(path, 'rb') as fh:
+    for chunk in iter(lambda: fh.read(chunk_size), b''):
+      yield compressor.compress(chunk)
+  yield compressor.flush()
+
+
+def upload_headers(response, upload):
+  response.headers['Accept-Encoding'] = ', '.join(encodings)
+  response.headers['Upload-Offset'] = str(upload['offset'])
+  response.headers['ETag'] = f'"{upload["hash"].hexdigest()}"'
+  return response
+
+
+@app.route('/uploads', methods=['POST'])
+def start_upload():
+  """Start a chunked upload"""
+  if not f.session.get('authenticated'):
+    return make_error(403, 'Access is forbidden')
+  filename = Path(f.request.form.get('filename', '')).name
+  try:
+    size = int(f.request.form.get('size'))
+  except (TypeError, ValueError):
+    return make_error(400, 'A size is required')
+  if not filename:
+    return make_error(400, 'A filename is required')
+  upload_id = uuid.uuid4().hex
+  upload_dir.mkdir(exist_ok=True)
+  (upload_dir / upload_id).write_bytes(b'')
+  upload = {
+    'filename': filename, 'size': size,
+    'offset': 0, 'hash': hashlib.sha256(), 'complete': False
+  }
+  uploads[upload_id] = upload
+  response = f.jsonify({'id': upload_id, 'offset': 0})
+  response.status_code = 201
+  response.headers['Location'] = f'/uploads/{upload_id}'
+  return upload_headers(response, upload)
+
+
+@app.route('/uploads/<upload_id>', methods=['HEAD', 'PATCH'])
+def continue_upload(upload_id):
+  """Report on, or add a chunk to, a chunked upload"""
+  if not f.session.get('authenticated'):
+    return make_error(403, 'Access is forbidden')
+  upload = uploads.get(upload_id)
+  if upload is None:
+    return make_error(404, 'Upload not found')
+  if f.request.method == 'HEAD':
+    return upload_headers(f.Response(), upload)
+
+  etag = f'"{upload["hash"].hexdigest()}"'
+  if f.request.headers.get('If-Match', etag) != etag:
+    return upload_headers(
+      make_error(412, 'The upload has changed'), upload
+    )
+  offset = f.request.headers.get('Upload-Offset', type=int)
+  if offset != upload['offset']:
+    return upload_headers(
+      make_error(409, f'Expected offset {upload["offset"]}'), upload
+    )
+  encoding = f.request.headers.get('Content-Encoding', 'identity')
+  if encoding != 'identity' and encoding not in encodings:
+    return upload_headers(
+      make_error(415, f'Unsupported encoding {encoding}'), upload
+    )
+  try:
+    chunk = decode(f.request.get_data(), encoding)
+  except Exception:
+    return upload_headers(
+      make_error(400, f'Could not decode {encoding} data'), upload
+    )
+  if upload['offset'] + len(chunk) > upload['size']:
+    return upload_headers(
+      make_error(400, 'More data than the upload size'), upload
+    )
+  # A finished upload is kept, so a client that lost the
+  # response to its last chunk can confirm it with a HEAD
+  if not upload['complete']:
+    with open(upload_dir / upload_id, 'ab') as fh:
+      fh.write(chunk)
+    upload['offset'] += len(chunk)
+    upload['hash'].update(chunk)
+    if upload['offset'] == upload['size']:
+      (upload_dir / upload_id).replace(upload['filename'])
+      upload['complete'] = True
+      print(f'Uploaded {upload["filename"]}')
+
+  response = f.jsonify(
+    {'offset': upload['offset'], 'complete': upload['complete']}
+  )
+  return upload_headers(response, upload)
+
+
 @app.route('/files/<filename>', methods=['GET', 'HEAD'])
 def files(filename):
   """Endpoint for file download"""
@@ -73,11 +221,16 @@ def files(filename):
   fp = Path(filename)
   if not fp.exists():
     return make_error(404, 'File not found')
-  response = f.Response()
-  response.headers.add('content-length', fp.stat().st_size)
   if f.request.method == 'HEAD':
+    response = f.Response()
+    response.headers.add('content-length', fp.stat().st_size)
     return response
-  response.set_data(fp.read_text())
+  encoding = f.request.accept_encodings.best_match(encodings)
+  if encoding is None:
+    return f.send_file(fp.resolve())
+  response = f.Response(encode(fp, encoding), mimetype='text/csv')
+  response.headers['Content-Encoding'] = encoding
+  response.headers['Vary'] = 'Accept-Encoding'
   return response
 
 
@@ -7,6 +7,7 @@ from tkinter import filedialog
 from tkinter import font
 import platform
 from queue import Queue
+from datetime import date
 
 from . import views as v
 from . import models as m
@@ -42,8 +43,20 @@ class Application(tk.Tk):
    # remove for ch12
    # self.model = m.CSVModel()
 
+    # Database calls run on worker threads
+    self.model_worker = m.ThreadedModel(
+      self.model, self.settings['db_pool_size'].get()
+    )
+
+    # Uploads share one pool, limited per server
+    self.upload_scheduler = m.UploadScheduler(
+      self.settings['upload_workers'].get(),
+      self.settings['uploads_per_server'].get()
+    )
+
     self.inserted_rows = []
     self.updated_rows = []
+    self.growth_charts = []
 
     # Begin building GUI
     self.title("ABQ Data Entry Application")
@@ -60,8 +73,9 @@ class Application(tk.Tk):
 
     self.config(menu=menu)
     event_callbacks = {
-      '<<FileQuit>>': lambda _: self.quit(),
+      '<<FileQuit>>': self._on_quit,
       '<<ShowRecordlist>>': self._show_recordlist,
+      '<<RefreshRecordlist>>': self._refresh_recordlist,
       '<<NewRecord>>': self._new_record,
       '<<UpdateWeatherData>>': self._update_weather_data,
       '<<UploadToCorporateREST>>': self._upload_to_corporate_rest,
@@ -71,6 +85,8 @@ class Application(tk.Tk):
      }
     for sequence, callback in event_callbacks.items():
       self.bind(sequence, callback)
+    # Closing the window shuts down the workers too
+    self.protocol('WM_DELETE_WINDOW', self._on_quit)
 
     # new for ch9
     self.logo = tk.PhotoImage(file=images.ABQ_LOGO_32)
@@ -99,14 +115,16 @@ class Application(tk.Tk):
 
     # The data record list
     self.recordlist_icon = tk.PhotoImage(file=images.LIST_ICON)
-    self.recordlist = v.RecordList(self)
+    self.recordlist = v.VirtualRecordList(self)
 
     self.notebook.insert(
         0, self.recordlist, text='Records',
         image=self.recordlist_icon, compound=tk.LEFT
     )
-    self._populate_recordlist()
+    self._recordlist_key = None
+    self._recordlist_future = None
     self.recordlist.bind('<<OpenRecord>>', self._open_record)
+    self.recordlist.bind('<<LoadMoreRecords>>', self._load_more_records)
 
 
     self._show_recordlist()
@@ -118,11 +136,22 @@ class Application(tk.Tk):
 
 
     self.records_saved = 0
+    self._saving = False
+
+    # Escape cancels whatever the database workers are doing
+    self.bind('<Escape>', self._cancel_model_calls)
+    self._model_busy = False
+    self._check_model_worker()
+    self._populate_recordlist()
 
 
   def _on_save(self, *_):
     """Handles file-save requests"""
 
+    # One save at a time, or a double click inserts the record twice
+    if self._saving:
+      return False
+
     # Check for errors first
 
     errors = self.recordform.get_errors()
@@ -143,19 +172,48 @@ class Application(tk.Tk):
       return False
 
     data = self.recordform.get()
-    rowkey = self.recordform.current_record
-    self.model.save_record(data, rowkey)
-    if rowkey is not None:
+    old_rowkey = self.recordform.current_record
+    self._set_saving(True)
+    self.model_worker.submit(
+      'save_record', data, old_rowkey,
+      callback=lambda _: self._on_record_saved(data, old_rowkey),
+      errback=self._show_save_error,
+      # the row may already be committed, so the form must hear back
+      cancellable=False
+    )
+
+  def _set_saving(self, saving):
+    self._saving = saving
+    self.recordform.savebutton.state(
+      ['disabled'] if saving else ['!disabled']
+    )
+
+  def _on_record_saved(self, data, old_rowkey):
+    """Update the GUI once a record is in the database"""
+    self._set_saving(False)
+    rowkey = (data['Date'], data['Time'], data['Lab'], data['Plot'])
+    if old_rowkey is not None:
       self.updated_rows.append(rowkey)
+      self.recordlist.add_updated_row(rowkey)
     else:
-      rowkey = (data['Date'], data['Time'], data['Lab'], data['Plot'])
       self.inserted_rows.append(rowkey)
+      self.recordlist.add_inserted_row(rowkey)
     self.records_saved += 1
     self.status.set(
       "{} records saved this session".format(self.records_saved)
     )
-    self.recordform.reset()
-    self._populate_recordlist()
+    # Keep anything typed into the form since Save was clicked
+    if self.recordform.get() == data:
+      self.recordform.reset()
+    self._update_recordlist_row(old_rowkey, rowkey)
+    self._update_growth_charts(old_rowkey, rowkey)
+
+  def _show_save_error(self, error):
+    self._set_saving(False)
+    self.status.set('Record was not saved')
+    messagebox.showerror(
+      title='Error', message='Problem saving record', detail=str(error)
+    )
 
 # Remove for ch12
 #  def _on_file_select(self, *_):
@@ -182,9 +240,12 @@ class Application(tk.Tk):
     """Try to login to the database and create self.model"""
     db_host = self.settings['db_host'].get()
     db_name = self.settings['db_name'].get()
+    # One connection more than model_worker has threads, so
+    # queries made on the Tk thread never wait for a worker
+    pool_size = self.settings['db_pool_size'].get() + 1
     try:
       self.model = m.SQLModel(
-        db_host, db_name, username, password)
+        db_host, db_name, username, password, pool_size)
     except m.pg.OperationalError as e:
       print(e)
       return False
@@ -245,17 +306,108 @@ class Application(tk.Tk):
     """Show the recordform"""
     self.notebook.select(self.recordlist)
 
+  @staticmethod
+  def _show_read_error(error):
+    messagebox.showerror(
+      title='Error',
+      message='Problem reading file',
+      detail=str(error)
+    )
+
   def _populate_recordlist(self):
+    # Any page still loading is for the old list
+    if self._recordlist_future:
+      self.model_worker.cancel(self._recordlist_future)
+    self._recordlist_future = self.model_worker.submit(
+      'get_records_page',
+      callback=self._on_first_page,
+      errback=self._on_page_error
+    )
+
+  def _on_first_page(self, result):
+    rows, self._recordlist_key = result
+    self._recordlist_future = None
+    self.recordlist.populate(
+      rows, more_available=self._recordlist_key is not None
+    )
+
+  def _update_recordlist_row(self, old_rowkey, rowkey):
+    """Patch a single saved row into the record list"""
+
+    def patch_row(record):
+      if old_rowkey is not None:
+        self.recordlist.remove_row(old_rowkey)
+      # The record list only shows today's records
+      if record and str(record['Date']) == date.today().isoformat():
+        self.recordlist.insert_row(record)
+
+    self.model_worker.submit(
+      'get_record', rowkey,
+      callback=patch_row, errback=self._show_read_error
+    )
+
+  def _refresh_recordlist(self, *_):
+    """Reload the record list from the database"""
+    self._populate_recordlist()
+    self._show_recordlist()
+
+  def _load_more_records(self, *_):
+    """Fetch the next page of records into the record list"""
+    if self._recordlist_key is None or self._recordlist_future:
+      return
+    self._recordlist_future = self.model_worker.submit(
+      'get_records_page', after=self._recordlist_key,
+      callback=self._on_next_page,
+      errback=self._on_page_error
+    )
+
+  def _on_next_page(self, result):
+    rows, self._recordlist_key = result
+    self._recordlist_future = None
+    self.recordlist.extend(
+      rows, more_available=self._recordlist_key is not None
+    )
+
+  def _on_page_error(self, error):
+    self._recordlist_future = None
+    self.recordlist.cancel_fetch()
+    self._show_read_error(error)
+
+  def _check_model_worker(self):
+    """Deliver database results to the GUI and show busy state"""
     try:
-      rows = self.model.get_all_records()
-    except Exception as e:
-      messagebox.showerror(
-        title='Error',
-        message='Problem reading file',
-        detail=str(e)
+      self.model_worker.process_results()
+      busy = self.model_worker.busy
+      if busy != self._model_busy:
+        self._model_busy = busy
+        self.config(cursor='watch' if busy else '')
+        if busy:
+          self.status.set('Working… (press Escape to cancel)')
+        elif self.status.get().startswith('Working'):
+          self.status.set('')
+    finally:
+      # keep polling even if a callback raised
+      self.after(50, self._check_model_worker)
+
+  def _cancel_model_calls(self, *_):
+    if self.model_worker.cancel_all():
+      if self._recordlist_future:
+        self._recordlist_future = None
+        self.recordlist.cancel_fetch()
+      self.status.set('Cancelled')
+
+  def _on_quit(self, *_):
+    # Upload workers are daemon threads, so exiting kills them
+    if self.upload_scheduler.busy:
+      stop = messagebox.askyesno(
+        'Uploads in progress',
+        'Uploads are still running and will be stopped. Quit anyway?'
       )
-    else:
-      self.recordlist.populate(rows)
+      if not stop:
+        return
+    self.model_worker.close()
+    self.upload_scheduler.close(wait=False)
+    self.quit()
 
   def _new_record(self, *_):
     """Open the record form with a blank record"""
@@ -266,15 +418,14 @@ class Application(tk.Tk):
   def _open_record(self, *_):
     """Open the Record selected recordlist id in the recordform"""
     rowkey = self.recordlist.selected_id
-    try:
-      record = self.model.get_record(rowkey)
-    except Exception as e:
-      messagebox.showerror(
-        title='Error', message='Problem reading file', detail=str(e)
-      )
-      return
-    self.recordform.load_record(rowkey, record)
-    self.notebook.select(self.recordform)
+
+    def load(record):
+      self.recordform.load_record(rowkey, record)
+      self.notebook.select(self.recordform)
+
+    self.model_worker.submit(
+      'get_record', rowkey, callback=load, errback=self._show_read_error
+    )
 
   # new chapter 9
   def _set_font(self, *_):
@@ -307,25 +458,32 @@ class Application(tk.Tk):
       self.status.set(f"Weather data recorded for {time}")
 
   def _create_csv_extract(self):
+    """Stream today's records into a CSV file
+
+    This runs on a model worker thread.
+    """
     csvmodel = m.CSVModel()
-    records = self.model.get_all_records()
-    if not records:
+    count = csvmodel.append_records(self.model.iter_records())
+    if not count:
       raise Exception('No records were found to build a CSV file.')
-    for record in records:
-      csvmodel.save_record(record)
     return csvmodel.file
 
+  def _show_extract_error(self, error):
+    messagebox.showwarning(
+      title='Error', message=str(error)
+    )
 
   def _upload_to_corporate_sftp(self, *_):
 
     # create csv file
-    try:
-      csvfile = self._create_csv_extract()
-    except Exception as e:
-      messagebox.showwarning(
-        title='Error', message=str(e)
-      )
-      return
+    self.status.set('Creating CSV extract')
+    self.model_worker.submit(
+      self._create_csv_extract,
+      callback=self._upload_extract_to_sftp,
+      errback=self._show_extract_error
+    )
+
+  def _upload_extract_to_sftp(self, csvfile):
 
     # authenticate
     d = v.LoginDialog(self, 'Login to ABQ Corporate SFTP')
@@ -373,36 +531,35 @@ class Application(tk.Tk):
           filename = filedialog.asksaveasfilename()
           if not filename:
             return
-          try:
-            sftp_model.get_file(destination_path, filename)
-          except Exception as e:
-            messagebox.showerror('Error downloading', str(e))
-            return
-          messagebox.showinfo(
-            'Download Complete', 'Download Complete.'
-            )
+          self._start_sftp_transfer(
+            sftp_model, 'download', destination_path, filename
+          )
         return
     # if we haven't returned, the user wants to upload
-    try:
-      sftp_model.upload_file(csvfile, destination_path)
-    except Exception as e:
-      messagebox.showerror('Error uploading', str(e))
-    else:
-      messagebox.showinfo(
-        'Success',
-        f'{csvfile} successfully uploaded to SFTP server.'
-      )
+    self._start_sftp_transfer(
+      sftp_model, 'upload', csvfile, destination_path
+    )
+
+  def _start_sftp_transfer(self, sftp_model, method, *paths):
+    """Run an SFTP transfer in the background, showing progress"""
+    transfers = m.SFTPTransfers(sftp_model, workers=1)
+    future = getattr(transfers, method)(*paths)
+    # the worker exits and closes its channel when the transfer is done
+    transfers.close(wait=False)
+    future.add_done_callback(lambda _: sftp_model.close())
+    self._check_queue(transfers.queue)
 
   def _upload_to_corporate_rest(self, *_):
 
     # create csv file
-    try:
-      csvfile = self._create_csv_extract()
-    except Exception as e:
-      messagebox.showwarning(
-        title='Error', message=str(e)
-      )
-      return
+    self.status.set('Creating CSV extract')
+    self.model_worker.submit(
+      self._create_csv_extract,
+      callback=self._upload_extract_to_rest,
+      errback=self._show_extract_error
+    )
+
+  def _upload_extract_to_rest(self, csvfile):
 
     # Authenticate to the rest server
     d = v.LoginDialog(
@@ -415,7 +572,7 @@ class Application(tk.Tk):
 
     # create REST model
     rest_model = m.CorporateRestModel(
-        self.settings['abq_rest_url'].get()
+        self.settings['abq_rest_url'].get(), self.upload_scheduler
     )
     try:
       rest_model.authenticate(username, password)
@@ -448,16 +605,9 @@ class Application(tk.Tk):
           filename = filedialog.asksaveasfilename()
           if not filename:
             return
-          try:
-            data = rest_model.get_file(csvfile.name)
-          except Exception as e:
-            messagebox.showerror('Error downloading', str(e))
-            return
-          with open(filename, 'w', encoding='utf-8') as fh:
-            fh.write(data)
-          messagebox.showinfo(
-            'Download Complete', 'Download Complete.'
-            )
+          self.status.set(f'Downloading {csvfile.name}')
+          rest_model.download_file(csvfile.name, filename)
+          self._check_queue(rest_model.queue)
         return
     # if we haven't returned, the user wants to upload
     rest_model.upload_file(csvfile)
@@ -489,15 +639,73 @@ class Application(tk.Tk):
 
   #New for ch15
   def show_growth_chart(self, *_):
-    data = self.model.get_growth_by_lab()
+    self.model_worker.submit(
+      'get_growth_columns',
+      callback=self._draw_growth_chart, errback=self._show_read_error
+    )
+
+  def _draw_growth_chart(self, data):
     popup = tk.Toplevel()
     chart = v.LineChartView(
        popup, data, (800, 400),
        'Day', 'Avg Height (cm)', 'lab_id'
     )
     chart.pack(fill='both', expand=1)
+    # Keep the chart live until its window closes
+    self.growth_charts.append(chart)
+    chart.bind(
+      '<Destroy>', lambda _: self._forget_growth_chart(chart), add='+'
+    )
+
+  def _forget_growth_chart(self, chart):
+    if chart in self.growth_charts:
+      self.growth_charts.remove(chart)
+
+  def _update_growth_charts(self, *rowkeys):
+    """Refresh the growth points affected by saving a record
+
+    rowkeys are the old and new keys of the saved record; each
+    names a date and lab whose average may have changed.
+    """
+    if not self.growth_charts:
+      return
+    points = {
+      (rowkey[0], rowkey[2]) for rowkey in rowkeys if rowkey is not None
+    }
+    for date, lab in points:
+      self.model_worker.submit(
+        'get_growth_point', date, lab,
+        callback=lambda rows, date=date, lab=lab:
+          self._on_growth_point(date, lab, rows),
+        errback=self._show_read_error
+      )
+
+  def _on_growth_point(self, date, lab, rows):
+    if not rows:
+      # The save emptied this group, so its point has to go
+      self.model_worker.submit(
+        'get_growth_day', date,
+        callback=lambda day: self._remove_growth_point(lab, day),
+        errback=self._show_read_error
+      )
+      return
+    for chart in self.growth_charts:
+      for row in rows:
+        chart.update_point(row['lab_id'], row['Day'], row['Avg Height (cm)'])
+
+  def _remove_growth_point(self, lab, day):
+    if day is None:
+      return
+    for chart in self.growth_charts:
+      chart.remove_point(lab, day)
 
   def show_yield_chart(self, *_):
+    self.model_worker.submit(
+      'get_yield_columns',
+      callback=self._draw_yield_chart, errback=self._show_read_error
+    )
+
+  def _draw_yield_chart(self, data):
     popup = tk.Toplevel()
     chart = v.YieldChartView(
       popup,
@@ -505,14 +713,19 @@ class Application(tk.Tk):
       'Yield as a product of humidity and temperature'
     )
     chart.pack(fill='both', expand=True)
-    data = self.model.get_yield_by_plot()
     seed_colors = {
       'AXM477': 'red', 'AXM478': 'yellow',
       'AXM479': 'green', 'AXM480': 'blue'
     }
+    seeds = list(data.categories['seed_sample'])
+    columns = data.columns
     for seed, color in seed_colors.items():
-      seed_data = [
-       (x['avg_humidity'], x['avg_temperature'], x['yield'])
-       for x in data if x['seed_sample'] == seed
-      ]
+      if seed not in seeds:
+        continue
+      mask = columns['seed_sample'] == seeds.index(seed)
+      seed_data = (
+        columns['avg_humidity'][mask],
+        columns['avg_temperature'][mask],
+        columns['yield'][mask]
+      )
       chart.draw_scatter(seed_data, color, seed)
@@ -15,13 +15,15 @@ class GenericMainMenu(tk.Menu):
     'quit': 'Ctrl+Q',
     'record_list': 'Ctrl+L',
     'new_record': 'Ctrl+R',
+    'refresh_record_list': 'F5',
   }
 
   keybinds = {
     '<Control-o>': '<<FileSelect>>',
     '<Control-q>': '<<FileQuit>>',
     '<Control-n>': '<<NewRecord>>',
-    '<Control-l>': '<<ShowRecordlist>>'
+    '<Control-l>': '<<ShowRecordlist>>',
+    '<F5>': '<<RefreshRecordlist>>'
   }
 
   styles = {}
@@ -44,6 +46,7 @@ class GenericMainMenu(tk.Menu):
     #  'file_open': tk.PhotoImage(file=images.SAVE_ICON),
       'record_list': tk.PhotoImage(file=images.LIST_ICON),
       'new_record': tk.PhotoImage(file=images.FORM_ICON),
+      'refresh_record_list': tk.PhotoImage(file=images.RESET_ICON),
       'quit': tk.BitmapImage(file=images.QUIT_BMP, foreground='red'),
       'about': tk.BitmapImage(
           file=images.ABOUT_BMP, foreground='#CC0', background='#A09'
@@ -127,6 +130,13 @@ class GenericMainMenu(tk.Menu):
       image=self.icons.get('record_list'), compound=tk.LEFT
     )
 
+  def _add_refresh_record_list(self, menu):
+    menu.add_command(
+      label="Refresh Record List",
+      command=self._event('<<RefreshRecordlist>>'),
+      image=self.icons.get('refresh_record_list'), compound=tk.LEFT
+    )
+
   def _add_go_new_record(self, menu):
     menu.add_command(
       label="New Record", command=self._event('<<NewRecord>>'),
@@ -175,6 +185,7 @@ class GenericMainMenu(tk.Menu):
     # switch from recordlist to recordform
     self._menus['Go'] = tk.Menu(self, tearoff=False, **self.styles)
     self._add_go_record_list(self._menus['Go'])
+    self._add_refresh_record_list(self._menus['Go'])
     self._add_go_new_record(self._menus['Go'])
 
     # The help menu
@@ -273,6 +284,7 @@ class WindowsMainMenu(GenericMainMenu):
     self._add_sftp_upload(self._menus['Tools'])
     self._add_growth_chart(self._menus['Tools'])
     self._add_yield_chart(self._menus['Tools'])
+    self._add_refresh_record_list(self._menus['Tools'])
 
     # The help menu
     self._menus['Help'] = tk.Menu(self, tearoff=False)
@@ -331,6 +343,7 @@ class LinuxMainMenu(GenericMainMenu):
     # switch from recordlist to recordform
     self._menus['Go'] = tk.Menu(self, tearoff=False, **self.styles)
     self._add_go_record_list(self._menus['Go'])
+    self._add_refresh_record_list(self._menus['Go'])
     self._add_go_new_record(self._menus['Go'])
 
     # The help menu
@@ -356,12 +369,14 @@ class MacOsMainMenu(GenericMainMenu):
   keybinds = {
       '<Command-o>': '<<FileSelect>>',
       '<Command-n>': '<<NewRecord>>',
-      '<Command-l>': '<<ShowRecordlist>>'
+      '<Command-l>': '<<ShowRecordlist>>',
+      '<F5>': '<<RefreshRecordlist>>'
     }
   accelerators = {
     'file_open': 'Cmd-O',
     'record_list': 'Cmd-L',
     'new_record': 'Cmd-R',
+    'refresh_record_list': 'F5',
     }
 
   def _add_about(self, menu):
@@ -402,6 +417,7 @@ class MacOsMainMenu(GenericMainMenu):
     # Window Menu
     self._menus['Window'] = tk.Menu(self, name='window', tearoff=False)
     self._add_go_record_list(self._menus['Window'])
+    self._add_refresh_record_list(self._menus['Window'])
     self._add_go_new_record(self._menus['Window'])
 
     for label, menu in self._menus.items():
@@ -1,23 +1,198 @@
 import csv
-from pathlib import Path
+import io
+import mmap
+import re
+from pathlib import Path, PurePosixPath
 import os
 import json
+import gzip
+import zlib
+import hashlib
 import platform
 from datetime import datetime
 from urllib.request import urlopen
+from urllib.parse import urljoin
+from itertools import chain, count
 from xml.etree import ElementTree
 import requests
 import paramiko
-from threading import Thread, Lock
+from threading import Thread, Lock, BoundedSemaphore, Condition, local
 from queue import Queue
-from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple, OrderedDict, Counter
+from collections.abc import Mapping
+from contextlib import contextmanager
+from time import monotonic, sleep
+from decimal import Decimal, InvalidOperation
+from tempfile import SpooledTemporaryFile
+
+import numpy as np
 
 import psycopg2 as pg
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values, execute_batch
+from psycopg2.pool import ThreadedConnectionPool
+
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
 
 from .constants import FieldTypes as FT
 
 Message = namedtuple('Message', ['status', 'subject', 'body'])
+SaveResult = namedtuple('SaveResult', ['rowkey', 'status', 'error'])
+ImportReport = namedtuple('ImportReport', ['loaded', 'rejected'])
+ColumnBatch = namedtuple('ColumnBatch', ['columns', 'categories'])
+
+# Content encodings for REST transfers, most preferred first
+CONTENT_ENCODINGS = ('zstd', 'gzip') if zstandard else ('gzip',)
+
+
+def _coercer(field_type):
+  """Return a function that coerces any value to field_type"""
+  trues = ('true', 'yes', '1')
+
+  def to_boolean(value):
+    if isinstance(value, str):
+      return value.lower() in trues
+    return bool(value)
+
+  def to_integer(value):
+    if value is None or value == '':
+      return None
+    return int(value)
+
+  def to_decimal(value):
+    if value is None or value == '':
+      return None
+    if isinstance(value, Decimal):
+      return value
+    return Decimal(str(value))
+
+  def to_string(value):
+    if value is None or isinstance(value, str):
+      return value
+    # dates and times from the database
+    if hasattr(value, 'isoformat'):
+      return value.isoformat()
+    return str(value)
+
+  return {
+    FT.boolean: to_boolean,
+    FT.integer: to_integer,
+    FT.decimal: to_decimal
+  }.get(field_type, to_string)
+
+
+class Record(Mapping):
+  """A compact record with one slot per field
+
+  Don't use this directly; create a subclass for a fields
+  dictionary with record_type().  Records can be read like
+  the dicts used elsewhere in the application.
+  """
+
+  __slots__ = ()
+  fields = {}
+  _attributes = {}
+  _coercers = ()
+
+  def __init__(self, *values):
+    if len(values) > len(self.__slots__):
+      raise TypeError(
+        f'{type(self).__name__} takes at most '
+        f'{len(self.__slots__)} values'
+      )
+    values += (None,) * (len(self.__slots__) - len(values))
+    for attribute, coerce, value in zip(
+      self.__slots__, self._coercers, values
+    ):
+      setattr(self, attribute, coerce(value))
+
+  @classmethod
+  def from_dict(cls, record):
+    """Create a record from a dict or other mapping"""
+    return cls(*(record.get(key) for key in cls.fields))
+
+  def as_dict(self):
+    """Return the record as a dict"""
+    return {
+      key: getattr(self, attribute)
+      for key, attribute in self._attributes.items()
+    }
+
+  def __getitem__(self, key):
+    return getattr(self, self._attributes[key])
+
+  def __setitem__(self, key, value):
+    attribute = self._attributes[key]
+    coerce = self._coercers[self.__slots__.index(attribute)]
+    setattr(self, attribute, coerce(value))
+
+  def __iter__(self):
+    return iter(self.fields)
+
+  def __len__(self):
+    return len(self.fields)
+
+  def __repr__(self):
+    return f'{type(self).__name__}({self.as_dict()!r})'
+
+
+def record_type(name, fields):
+  """Create a Record subclass for a fields dictionary
+
+  Each field gets a slot named after it, so "Seed Sample"
+  is available as record.seed_sample or record["Seed Sample"].
+  """
+  attributes = {
+    key: key.lower().replace(' ', '_') for key in fields
+  }
+  return type(name, (Record,), {
+    '__slots__': tuple(attributes.values()),
+    'fields': fields,
+    '_attributes': attributes,
+    '_coercers': tuple(_coercer(spec['type']) for spec in fields.values())
+  })
+
+
+class LookupCache:
+  """A thread-safe LRU cache whose entries expire after ttl seconds
+
+  Look up values with cache[key], which raises KeyError
+  if the key is missing or expired.
+  """
+
+  def __init__(self, maxsize=256, ttl=60):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self._data = OrderedDict()
+    self._lock = Lock()
+
+  def __getitem__(self, key):
+    with self._lock:
+      expires, value = self._data[key]
+      if expires < monotonic():
+        del self._data[key]
+        raise KeyError(key)
+      self._data.move_to_end(key)
+      return value
+
+  def __setitem__(self, key, value):
+    with self._lock:
+      self._data[key] = (monotonic() + self.ttl, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+
+  def discard(self, key):
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self):
+    with self._lock:
+      self._data.clear()
+
 
 class SQLModel:
   """Data Model for SQL data storage"""
@@ -54,16 +229,7 @@ class SQLModel:
               'min': 0, 'max': 1000, 'inc': .01},
     "Notes": {'req': False, 'type': FT.long_string}
   }
-  lc_update_query = (
-    'UPDATE lab_checks SET lab_tech_id = '
-    '(SELECT id FROM lab_techs WHERE name = %(Technician)s) '
-    'WHERE date=%(Date)s AND time=%(Time)s AND lab_id=%(Lab)s'
-  )
-
-  lc_insert_query = (
-    'INSERT INTO lab_checks VALUES (%(Date)s, %(Time)s, %(Lab)s, '
-    '(SELECT id FROM lab_techs WHERE name LIKE %(Technician)s))'
-  )
+  record_class = record_type('SQLRecord', fields)
 
   pc_update_query = (
     'UPDATE plot_checks SET date=%(Date)s, time=%(Time)s, '
@@ -84,36 +250,352 @@ class SQLModel:
     ' %(Fruit)s, %(Max Height)s, %(Min Height)s,'
     ' %(Med Height)s, %(Notes)s)')
 
-  def __init__(self, host, database, user, password):
-    self.connection = pg.connect(host=host, database=database,
+  lc_values = (
+    '(%(Date)s, %(Time)s, %(Lab)s, '
+    '(SELECT id FROM lab_techs WHERE name = %(Technician)s))'
+  )
+
+  lc_upsert_conflict = (
+    ' ON CONFLICT (date, time, lab_id) '
+    'DO UPDATE SET lab_tech_id = EXCLUDED.lab_tech_id'
+  )
+
+  lc_upsert_query = (
+    'INSERT INTO lab_checks VALUES ' + lc_values + lc_upsert_conflict
+  )
+
+  # Multi-row versions are for execute_values()
+  lc_upsert_many_query = (
+    'INSERT INTO lab_checks VALUES %s' + lc_upsert_conflict
+  )
+
+  pc_values = (
+    '(%(Date)s, %(Time)s, %(Lab)s, %(Plot)s, %(Seed Sample)s,'
+    ' %(Humidity)s, %(Light)s, %(Temperature)s, %(Equipment Fault)s,'
+    ' %(Blossoms)s, %(Plants)s, %(Fruit)s, %(Max Height)s,'
+    ' %(Min Height)s, %(Med Height)s, %(Notes)s)'
+  )
+
+  pc_upsert_conflict = (
+    ' ON CONFLICT (date, time, lab_id, plot) DO UPDATE SET '
+    'seed_sample = EXCLUDED.seed_sample, humidity = EXCLUDED.humidity, '
+    'light = EXCLUDED.light, temperature = EXCLUDED.temperature, '
+    'equipment_fault = EXCLUDED.equipment_fault, '
+    'blossoms = EXCLUDED.blossoms, plants = EXCLUDED.plants, '
+    'fruit = EXCLUDED.fruit, max_height = EXCLUDED.max_height, '
+    'min_height = EXCLUDED.min_height, '
+    'median_height = EXCLUDED.median_height, notes = EXCLUDED.notes'
+  )
+
+  pc_upsert_query = (
+    'INSERT INTO plot_checks VALUES ' + pc_values + pc_upsert_conflict
+  )
+
+  pc_insert_many_query = 'INSERT INTO plot_checks VALUES %s'
+
+  pc_upsert_many_query = (
+    'INSERT INTO plot_checks VALUES %s' + pc_upsert_conflict
+  )
+
+  # The same columns as data_record_view, but filtered on the raw
+  # plot_checks key so the primary key can be used; the view's
+  # "Time" is formatted text.
+  record_query = (
+    'SELECT pc.date AS "Date", '
+    'to_char(pc.time, \'FMHH24:MI\') AS "Time", '
+    'lt.name AS "Technician", pc.lab_id AS "Lab", pc.plot AS "Plot", '
+    'pc.seed_sample AS "Seed Sample", '
+    'pc.equipment_fault AS "Equipment Fault", '
+    'pc.humidity AS "Humidity", pc.light AS "Light", '
+    'pc.temperature AS "Temperature", pc.plants AS "Plants", '
+    'pc.blossoms AS "Blossoms", pc.fruit AS "Fruit", '
+    'pc.max_height AS "Max Height", pc.min_height AS "Min Height", '
+    'pc.median_height AS "Med Height", pc.notes AS "Notes" '
+    'FROM plot_checks AS pc JOIN lab_checks AS lc '
+    'ON pc.lab_id = lc.lab_id AND pc.date = lc.date '
+    'AND pc.time = lc.time '
+    'JOIN lab_techs AS lt ON lc.lab_tech_id = lt.id '
+    'WHERE pc.date = %(date)s AND pc.time = %(time)s '
+    'AND pc.lab_id = %(lab)s AND pc.plot = %(plot)s')
+
+  lab_check_query = (
+    'SELECT date, time, lab_id, lab_tech_id, '
+    'lt.name as lab_tech FROM lab_checks JOIN lab_techs lt '
+    'ON lab_checks.lab_tech_id = lt.id WHERE '
+    'lab_id = %(lab)s AND date = %(date)s AND time = %(time)s')
+
+  seed_sample_query = (
+    'SELECT current_seed_sample FROM plots '
+    'WHERE lab_id=%(lab)s AND plot=%(plot)s')
+
+  # These run often enough to be worth preparing once per connection
+  prepared_queries = (
+    'record_query', 'lab_check_query', 'seed_sample_query',
+    'lc_upsert_query', 'pc_insert_query', 'pc_upsert_query',
+    'pc_update_query'
+  )
+
+  # Running these twice has the same effect as running them once
+  idempotent_queries = (
+    'record_query', 'lab_check_query', 'seed_sample_query',
+    'lc_upsert_query', 'pc_upsert_query'
+  )
+
+  # Seconds a pooled connection can sit idle before
+  # we check it is still alive
+  health_check_interval = 30
+
+  def __init__(self, host, database, user, password, pool_size=4):
+    # Threads share a pool of connections; the semaphore makes
+    # them wait for a free one rather than raising PoolError
+    self._pool = ThreadedConnectionPool(
+      1, pool_size, host=host, database=database,
       user=user, password=password, cursor_factory=DictCursor)
+    self._pool_slots = BoundedSemaphore(pool_size)
+    self._last_used = dict()
+    # Names of the statements prepared on each connection
+    self._prepared = dict()
 
     techs = self.query("SELECT name FROM lab_techs ORDER BY name")
     labs = self.query("SELECT id FROM labs ORDER BY id")
-    plots = self.query("SELECT DISTINCT plot FROM plots ORDER BY plot")
     self.fields['Technician']['values'] = [x['name'] for x in techs]
     self.fields['Lab']['values'] = [x['id'] for x in labs]
-    self.fields['Plot']['values'] = [str(x['plot']) for x in plots]
 
-  def query(self, query, parameters=None):
-    with self.connection:
-      with self.connection.cursor() as cursor:
+    # Cache the plots table and lab checks for form autofill
+    self._lab_checks = LookupCache()
+    self.load_plots()
+
+  def load_plots(self):
+    """Load the whole plots table into the seed sample lookup"""
+    plots = self.query(
+      "SELECT lab_id, plot, current_seed_sample FROM plots")
+    self._seed_samples = {
+      (x['lab_id'], str(x['plot'])): x['current_seed_sample'] or ''
+      for x in plots
+    }
+    plot_numbers = sorted(set([int(x['plot']) for x in plots]))
+    self.fields['Plot']['values'] = [str(x) for x in plot_numbers]
+
+  def _get_connection(self):
+    """Get a connection from the pool, replacing it if it has died"""
+    connection = self._pool.getconn()
+    idle = monotonic() - self._last_used.get(id(connection), 0)
+    if connection.closed or idle > self.health_check_interval:
+      try:
+        with connection.cursor() as cursor:
+          cursor.execute('SELECT 1')
+        connection.rollback()
+      except (pg.OperationalError, pg.InterfaceError):
+        self._forget_connection(connection)
+        self._pool.putconn(connection, close=True)
+        connection = self._pool.getconn()
+    return connection
+
+  def _forget_connection(self, connection):
+    self._last_used.pop(id(connection), None)
+    self._prepared.pop(id(connection), None)
+
+  @contextmanager
+  def _transaction(self):
+    """Borrow a pooled connection for one transaction
+
+    The transaction is committed when the block exits, or rolled
+    back if it raises.  Broken connections are closed rather than
+    returned to the pool, so the next caller gets a fresh one.
+    """
+    with self._pool_slots:
+      connection = self._get_connection()
+      broken = False
+      try:
+        with connection:
+          yield connection
+      except pg.errors.InvalidSqlStatementName:
+        # An OperationalError, but the connection is fine
+        raise
+      except (pg.OperationalError, pg.InterfaceError):
+        broken = True
+        raise
+      finally:
+        close = broken or bool(connection.closed)
+        if close:
+          self._forget_connection(connection)
+        else:
+          self._last_used[id(connection)] = monotonic()
+        self._pool.putconn(connection, close=close)
+
+  def _query(self, query, parameters=None):
+    with self._transaction() as connection:
+      with connection.cursor() as cursor:
         cursor.execute(query, parameters)
       # cursor.description is None when
       # no rows are returned
         if cursor.description is not None:
           return cursor.fetchall()
 
+  def query(self, query, parameters=None):
+    try:
+      return self._query(query, parameters)
+    except (pg.OperationalError, pg.InterfaceError):
+      # The connection was lost, maybe after a write had committed,
+      # so only reads are safe to try again on a new one
+      if not query.lstrip().upper().startswith('SELECT'):
+        raise
+      return self._query(query, parameters)
+
+  # new for prepared statements
+
+  @staticmethod
+  def _statement_name(query_name):
+    return 'abq_' + query_name
+
+  @classmethod
+  def _positional_query(cls, query_name):
+    """Convert a query's %(name)s placeholders to $1, $2...
+
+    Returns the converted query and the parameter names in
+    order.  Repeated names share one placeholder.
+    """
+    names = list()
+
+    def placeholder(match):
+      if match.group(1) not in names:
+        names.append(match.group(1))
+      return f'${names.index(match.group(1)) + 1}'
+
+    query = re.sub(r'%\((.+?)\)s', placeholder, getattr(cls, query_name))
+    return query.replace('%%', '%'), names
+
+  def _query_prepared(self, query_names, parameters):
+    with self._transaction() as connection:
+      with connection.cursor() as cursor:
+        prepared = self._prepared.get(id(connection))
+        if prepared is None:
+          # A new connection, or one we lost track of
+          cursor.execute('SELECT name FROM pg_prepared_statements')
+          prepared = {row[0] for row in cursor.fetchall()}
+          self._prepared[id(connection)] = prepared
+        statements = list()
+        values = list()
+        try:
+          for query_name in query_names:
+            statement = self._statement_name(query_name)
+            query, names = self._positional_query(query_name)
+            if statement not in prepared:
+              cursor.execute(f'PREPARE {statement} AS {query}')
+              prepared.add(statement)
+            if names:
+              statement += ' (' + ', '.join(['%s'] * len(names)) + ')'
+            statements.append('EXECUTE ' + statement)
+            values.extend(parameters[name] for name in names)
+          cursor.execute('; '.join(statements), values)
+        except (
+          pg.errors.InvalidSqlStatementName,
+          pg.errors.DuplicatePreparedStatement
+        ):
+          # Something outside the model changed the prepared statements
+          self._prepared.pop(id(connection), None)
+          raise
+        if cursor.description is not None:
+          return cursor.fetchall()
+
+  def query_prepared(self, query_names, parameters=None):
+    """Run queries from prepared_queries as prepared statements
+
+    query_names is a query attribute name, or a tuple of them to
+    run in one round trip.  Each query is prepared the first time
+    it is used on a connection; after that, only its parameters
+    are sent.  Rows are returned from the last query.  After a
+    lost connection, only idempotent_queries are tried again.
+    """
+    if isinstance(query_names, str):
+      query_names = (query_names,)
+    try:
+      return self._query_prepared(query_names, parameters)
+    except (
+      pg.errors.InvalidSqlStatementName,
+      pg.errors.DuplicatePreparedStatement
+    ):
+      # Prepared statements were dropped; nothing ran, so
+      # a second try prepares them again
+      return self._query_prepared(query_names, parameters)
+    except (pg.OperationalError, pg.InterfaceError):
+      # The connection was lost, maybe after the transaction had
+      # committed, so only retry what is safe to run twice
+      if not set(query_names) <= set(self.idempotent_queries):
+        raise
+      return self._query_prepared(query_names, parameters)
+
+  def close(self):
+    """Close all the pooled connections"""
+    self._pool.closeall()
+
+  @staticmethod
+  def _records_query(all_dates, *conditions):
+    """Build a query for records in the record list order
+
+    Today's records are selected with a plain "Date" condition
+    rather than "%(all_dates)s OR ...", so the planner can use
+    the plot_checks and lab_checks indexes.
+    """
+    if not all_dates:
+      conditions = ('"Date" = CURRENT_DATE',) + conditions
+    query = 'SELECT * FROM data_record_view '
+    if conditions:
+      query += 'WHERE ' + ' AND '.join(conditions) + ' '
+    return query + 'ORDER BY "Date" DESC, "Time", "Lab", "Plot"'
+
   def get_all_records(self, all_dates=False):
     """Return all records.
 
     By default, only return today's records, unless
     all_dates is True.
     """
-    query = ('SELECT * FROM data_record_view '
-      'WHERE %(all_dates)s OR "Date" = CURRENT_DATE '
-      'ORDER BY "Date" DESC, "Time", "Lab", "Plot"')
-    return self.query(query, {'all_dates': all_dates})
+    return self.query(self._records_query(all_dates))
+
+  def get_records_page(self, after=None, page_size=200, all_dates=False):
+    """Return a page of records and the key to continue from.
+
+    Records are in the same order as get_all_records().
+    after is the rowkey (date, time, lab, plot) of the last
+    record of the previous page, or None for the first page.
+    The returned key is None when there are no more records.
+    """
+    parameters = {'limit': page_size + 1}
+    conditions = ()
+    if after:
+      date, time, lab, plot = after
+      parameters.update(
+        {'date': date, 'time': time, 'lab': lab, 'plot': plot})
+      # The "Date" <= bound starts the index scan at the last page
+      conditions = (
+        '"Date" <= %(date)s',
+        '("Date" < %(date)s OR '
+        '("Time", "Lab", "Plot") > (%(time)s, %(lab)s, %(plot)s))'
+      )
+    query = self._records_query(all_dates, *conditions)
+    rows = self.query(query + ' LIMIT %(limit)s', parameters)
+
+    # We fetched one extra row to find out if there are more
+    if len(rows) <= page_size:
+      return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, (last['Date'], last['Time'], last['Lab'], last['Plot'])
+
+  def iter_records(self, all_dates=False, itersize=2000):
+    """Yield records using a server-side cursor.
+
+    Each record is a record_class instance.  Only itersize rows
+    are held in memory at a time.  The connection is in a
+    transaction until the generator is exhausted or closed.
+    """
+    query = self._records_query(all_dates)
+    with self._transaction() as connection:
+      with connection.cursor(name='abq_record_stream') as cursor:
+        cursor.itersize = itersize
+        cursor.execute(query)
+        for row in cursor:
+          yield self.record_class.from_dict(row)
 
   def get_record(self, rowkey):
     """Return a single record
@@ -121,12 +603,8 @@ class SQLModel:
     rowkey must be a tuple of date, time, lab, and plot
     """
     date, time, lab, plot = rowkey
-    query = (
-      'SELECT * FROM data_record_view '
-      'WHERE "Date" = %(date)s AND "Time" = %(time)s '
-      'AND "Lab" = %(lab)s AND "Plot" = %(plot)s')
-    result = self.query(
-      query,
+    result = self.query_prepared(
+      'record_query',
       {"date": date, "time": time, "lab": lab, "plot": plot}
     )
     return result[0] if result else dict()
@@ -137,6 +615,28 @@ class SQLModel:
     rowkey must be a tuple of date, time, lab, and plot.
       Or None if this is a new record.
     """
+    record.update(self._keyed_record(record, rowkey))
+
+    # Lab check is upserted on the entered date/time/lab,
+    # plot check is based on the key values
+    pc_query = self._plot_check_query(record, rowkey)
+
+    # Send both statements in one round trip
+    self.query_prepared(('lc_upsert_query', pc_query), record)
+    self._forget_lab_check(record)
+
+  def _plot_check_query(self, record, rowkey):
+    """Name the statement that saves record's plot check over rowkey"""
+    if not rowkey:
+      return 'pc_insert_query'
+    if self._same_rowkey(rowkey, self._record_rowkey(record)):
+      return 'pc_upsert_query'
+    return 'pc_update_query'
+
+  @staticmethod
+  def _keyed_record(record, rowkey):
+    """Return a copy of record with the key_ values for rowkey"""
+    record = dict(record)
     if rowkey:
       key_date, key_time, key_lab, key_plot = rowkey
       record.update({
@@ -145,39 +645,149 @@ class SQLModel:
         "key_lab": key_lab,
         "key_plot": key_plot
       })
+    return record
 
-    # Lab check is based on the entered date/time/lab
-    if self.get_lab_check(
-      record['Date'], record['Time'], record['Lab']
-    ):
-      lc_query = self.lc_update_query
-    else:
-      lc_query = self.lc_insert_query
-    # Plot check is based on the key values
-    if rowkey:
-      pc_query = self.pc_update_query
+  @staticmethod
+  def _record_rowkey(record):
+    return (record['Date'], record['Time'], record['Lab'], record['Plot'])
+
+  @staticmethod
+  def _same_rowkey(rowkey, other):
+    return [str(v) for v in rowkey] == [str(v) for v in other]
+
+  def _forget_lab_check(self, record):
+    """Drop the cached lab check for the record's date, time and lab"""
+    self._lab_checks.discard(
+      (str(record['Date']), str(record['Time']), str(record['Lab']))
+    )
+
+  def save_records(self, records):
+    """Save many records, such as a whole lab sheet, at once
+
+    records is a list of (record, rowkey) tuples, where rowkey
+    is as for save_record().  Everything is written in one transaction.
+    If the database rejects the batch, the records are saved
+    one at a time so that only the bad ones fail.  Where several
+    records have the same key, only the last is saved.
+
+    Returns a list of SaveResult tuples in the same order as records;
+    records that were passed over get the result of the last one.
+    """
+    for record, _ in records:
+      self._forget_lab_check(record)
+    # One upsert can't write a key twice, so the last record wins
+    latest = {
+      tuple(str(v) for v in self._record_rowkey(record)): index
+      for index, (record, _) in enumerate(records)
+    }
+    kept = [records[index] for index in sorted(latest.values())]
+    try:
+      self._save_batch(kept)
+    except (pg.IntegrityError, pg.DataError):
+      kept_results = self._save_each(kept)
     else:
-      pc_query = self.pc_insert_query
+      kept_results = [
+        SaveResult(
+          self._record_rowkey(record),
+          'updated' if rowkey else 'inserted',
+          None
+        )
+        for record, rowkey in kept
+      ]
+    by_key = {
+      tuple(str(v) for v in result.rowkey): result
+      for result in kept_results
+    }
+    return [
+      by_key[tuple(str(v) for v in self._record_rowkey(record))]
+      for record, _ in records
+    ]
 
-    self.query(lc_query, record)
-    self.query(pc_query, record)
+  def _save_batch(self, records):
+    """Write all the records in one transaction"""
+    lab_checks = dict()
+    inserts, upserts, updates = list(), list(), list()
+    for record, rowkey in records:
+      record = self._keyed_record(record, rowkey)
+      # One lab check per date, time and lab
+      lab_checks[(record['Date'], record['Time'], record['Lab'])] = record
+      pc_query = self._plot_check_query(record, rowkey)
+      if pc_query == 'pc_insert_query':
+        inserts.append(record)
+      elif pc_query == 'pc_upsert_query':
+        upserts.append(record)
+      else:
+        updates.append(record)
+
+    with self._transaction() as connection:
+      with connection.cursor() as cursor:
+        execute_values(
+          cursor, self.lc_upsert_many_query,
+          list(lab_checks.values()), template=self.lc_values
+        )
+        if inserts:
+          execute_values(
+            cursor, self.pc_insert_many_query,
+            inserts, template=self.pc_values
+          )
+        if upserts:
+          execute_values(
+            cursor, self.pc_upsert_many_query,
+            upserts, template=self.pc_values
+          )
+        if updates:
+          execute_batch(cursor, self.pc_update_query, updates)
+
+  def _save_each(self, records):
+    """Save records one at a time, using a savepoint for each"""
+    results = list()
+    with self._transaction() as connection:
+      with connection.cursor() as cursor:
+        for record, rowkey in records:
+          record = self._keyed_record(record, rowkey)
+          cursor.execute('SAVEPOINT abq_save_record')
+          try:
+            cursor.execute(self.lc_upsert_query, record)
+            cursor.execute(
+              getattr(self, self._plot_check_query(record, rowkey)), record
+            )
+          except (pg.IntegrityError, pg.DataError) as e:
+            cursor.execute('ROLLBACK TO SAVEPOINT abq_save_record')
+            results.append(
+              SaveResult(self._record_rowkey(record), 'error', str(e))
+            )
+          else:
+            cursor.execute('RELEASE SAVEPOINT abq_save_record')
+            results.append(SaveResult(
+              self._record_rowkey(record),
+              'updated' if rowkey else 'inserted',
+              None
+            ))
+    return results
 
   def get_lab_check(self, date, time, lab):
     """Retrieve the lab check record for the given date, time, and lab"""
-    query = ('SELECT date, time, lab_id, lab_tech_id, '
-      'lt.name as lab_tech FROM lab_checks JOIN lab_techs lt '
-      'ON lab_checks.lab_tech_id = lt.id WHERE '
-      'lab_id = %(lab)s AND date = %(date)s AND time = %(time)s')
-    results = self.query(
-      query, {'date': date, 'time': time, 'lab': lab})
-    return results[0] if results else dict()
+    key = (str(date), str(time), str(lab))
+    try:
+      return self._lab_checks[key]
+    except KeyError:
+      pass
+    results = self.query_prepared(
+      'lab_check_query', {'date': date, 'time': time, 'lab': lab})
+    check = results[0] if results else dict()
+    self._lab_checks[key] = check
+    return check
 
   def get_current_seed_sample(self, lab, plot):
     """Get the seed sample currently planted in the given lab and plot"""
-    result = self.query('SELECT current_seed_sample FROM plots '
-      'WHERE lab_id=%(lab)s AND plot=%(plot)s',
-      {'lab': lab, 'plot': plot})
-    return result[0]['current_seed_sample'] if result else ''
+    key = (str(lab), str(plot))
+    if key in self._seed_samples:
+      return self._seed_samples[key]
+    result = self.query_prepared(
+      'seed_sample_query', {'lab': lab, 'plot': plot})
+    seed = result[0]['current_seed_sample'] if result else ''
+    self._seed_samples[key] = seed
+    return seed
 
   def add_weather_data(self, data):
     query = (
@@ -193,24 +803,338 @@ class SQLModel:
       pass
 
   # new ch15
+  # Chart data comes from the summary tables in sql/create_summaries.sql,
+  # which a trigger on plot_checks keeps up to date.
+
   def get_growth_by_lab(self):
     query = (
-      'SELECT date - (SELECT min(date) FROM plot_checks) AS "Day", '
-      'lab_id, avg(median_height) AS "Avg Height (cm)" FROM plot_checks '
-      'GROUP BY date, lab_id ORDER BY "Day", lab_id;'
+      'SELECT date - (SELECT min(date) FROM growth_summary) AS "Day", '
+      'lab_id, avg_height AS "Avg Height (cm)" FROM growth_summary '
+      'ORDER BY "Day", lab_id;'
     )
     return self.query(query)
 
+  def get_growth_point(self, date, lab):
+    """Get the average height for one lab on one date
+
+    This lets a live growth chart update a single point after
+    a save instead of re-running the whole aggregate.
+    """
+    query = (
+      'SELECT date - (SELECT min(date) FROM growth_summary) AS "Day", '
+      'lab_id, avg_height AS "Avg Height (cm)" FROM growth_summary '
+      'WHERE date = %(date)s AND lab_id = %(lab)s'
+    )
+    return self.query(query, {'date': date, 'lab': lab})
+
+  def get_growth_day(self, date):
+    """Get the growth chart's day number for date
+
+    Returns None when there is no growth data at all.
+    """
+    query = (
+      'SELECT %(date)s::date - min(date) AS "Day" FROM growth_summary'
+    )
+    return self.query(query, {'date': date})[0]['Day']
+
   def get_yield_by_plot(self):
     query = (
-      'SELECT lab_id, plot, seed_sample, MAX(fruit) AS yield, '
-      'AVG(humidity) AS avg_humidity, '
-      'AVG(temperature) AS avg_temperature '
-      'FROM plot_checks WHERE NOT equipment_fault '
-      'GROUP BY lab_id, plot, seed_sample'
+      'SELECT lab_id, plot, seed_sample, yield, '
+      'avg_humidity, avg_temperature FROM yield_summary'
     )
     return self.query(query)
 
+  # new for vectorized charts
+
+  @staticmethod
+  def _column_batch(rows, numeric=(), categorical=()):
+    """Convert a list of rows to a ColumnBatch of NumPy arrays
+
+    Numeric fields become float arrays, with NULL as NaN.
+    Categorical fields become integer codes into a sorted
+    array of labels, found in the batch's categories.
+    """
+    columns = dict()
+    categories = dict()
+    for field in numeric:
+      columns[field] = np.fromiter(
+        (np.nan if row[field] is None else row[field] for row in rows),
+        dtype=float, count=len(rows)
+      )
+    for field in categorical:
+      labels, codes = np.unique(
+        np.array([str(row[field]) for row in rows], dtype=str),
+        return_inverse=True
+      )
+      columns[field] = codes
+      categories[field] = labels
+    return ColumnBatch(columns, categories)
+
+  def get_growth_columns(self):
+    """Growth by lab as columns, with lab_id as categorical codes"""
+    return self._column_batch(
+      self.get_growth_by_lab(),
+      numeric=('Day', 'Avg Height (cm)'), categorical=('lab_id',)
+    )
+
+  def get_yield_columns(self):
+    """Yield by plot as columns, with seed_sample as categorical codes"""
+    return self._column_batch(
+      self.get_yield_by_plot(),
+      numeric=('yield', 'avg_humidity', 'avg_temperature'),
+      categorical=('lab_id', 'seed_sample')
+    )
+
+  # new for bulk data exchange
+
+  export_query = (
+    'COPY (SELECT "Date", "Time", "Technician", "Lab", "Plot", '
+    '"Seed Sample", "Humidity", "Light", "Temperature", '
+    'CASE WHEN "Equipment Fault" THEN \'True\' ELSE \'False\' END '
+    'AS "Equipment Fault", '
+    '"Plants", "Blossoms", "Fruit", "Min Height", "Max Height", '
+    '"Med Height", "Notes" FROM data_record_view {where}'
+    'ORDER BY "Date" DESC, "Time", "Lab", "Plot") '
+    'TO STDOUT WITH (FORMAT csv, HEADER)'
+  )
+
+  # Columns are in the same order as CSVModel.fields
+  import_table_query = (
+    'CREATE TEMP TABLE record_import ('
+    'date DATE, time TIME, technician VARCHAR(512), lab_id CHAR(1), '
+    'plot SMALLINT, seed_sample CHAR(6), humidity NUMERIC(4, 2), '
+    'light NUMERIC(5, 2), temperature NUMERIC(4, 2), '
+    'equipment_fault BOOLEAN, plants SMALLINT, blossoms SMALLINT, '
+    'fruit SMALLINT, min_height NUMERIC(6, 2), '
+    'max_height NUMERIC(6, 2), median_height NUMERIC(6, 2), notes TEXT'
+    ') ON COMMIT DROP'
+  )
+
+  import_copy_query = 'COPY record_import FROM STDIN WITH (FORMAT csv)'
+
+  import_lc_query = (
+    'INSERT INTO lab_checks SELECT DISTINCT ON (date, time, lab_id) '
+    'date, time, lab_id, lt.id FROM record_import '
+    'JOIN lab_techs lt ON lt.name = record_import.technician'
+    + lc_upsert_conflict
+  )
+
+  import_pc_query = (
+    'INSERT INTO plot_checks (date, time, lab_id, plot, seed_sample, '
+    'humidity, light, temperature, equipment_fault, blossoms, plants, '
+    'fruit, max_height, min_height, median_height, notes) '
+    'SELECT date, time, lab_id, plot, seed_sample, humidity, light, '
+    'temperature, equipment_fault, blossoms, plants, fruit, max_height, '
+    'min_height, median_height, notes FROM record_import'
+    + pc_upsert_conflict
+  )
+
+  def export_csv(self, filename, all_dates=True):
+    """Write records to a CSVModel format file using COPY"""
+    with self._transaction() as connection:
+      with connection.cursor() as cursor:
+        query = self.export_query.format(
+          where='' if all_dates else 'WHERE "Date" = CURRENT_DATE '
+        )
+        with open(filename, 'w', encoding='utf-8', newline='') as fh:
+          cursor.copy_expert(query, fh)
+
+  # These are left blank when there's an equipment fault
+  environment_fields = ('Humidity', 'Light', 'Temperature')
+  boolean_values = ('true', 'false', 't', 'f', 'yes', 'no', '1', '0')
+
+  def _import_error(self, row):
+    """Return why a CSV row can't be imported, or None if it's OK"""
+    fault = row.get('Equipment Fault') or ''
+    fault = fault.lower() in ('true', 'yes', '1')
+    for key, spec in self.fields.items():
+      value = row.get(key) or ''
+      if not value:
+        if spec['req'] and not (fault and key in self.environment_fields):
+          return f'{key} is required'
+        continue
+      if spec['type'] == FT.iso_date_string:
+        try:
+          datetime.strptime(value, '%Y-%m-%d')
+        except ValueError:
+          return f'{key} is not a valid date'
+      elif spec['type'] in (FT.integer, FT.decimal):
+        try:
+          number = Decimal(value)
+        except InvalidOperation:
+          return f'{key} is not a number'
+        if not number.is_finite():
+          return f'{key} is not a number'
+        # Check the range first: int() of a huge exponent is very slow
+        minimum = spec.get('min', number)
+        maximum = spec.get('max', number)
+        if not minimum <= number <= maximum:
+          return f'{key} is out of range'
+        if (
+          spec['type'] == FT.integer and
+          number != number.to_integral_value()
+        ):
+          return f'{key} is not a whole number'
+      elif spec['type'] == FT.boolean:
+        if value.lower() not in self.boolean_values:
+          return f'{key} is not true or false'
+      elif spec.get('values') and value not in spec['values']:
+        return f'{key} has an unknown value'
+    if (row['Lab'], row['Plot']) not in self._seed_samples:
+      return f'Lab {row["Lab"]} has no plot {row["Plot"]}'
+    if len(row['Seed Sample']) > 6:
+      return 'Seed Sample is too long'
+    if not (
+      Decimal(row['Min Height']) <= Decimal(row['Med Height']) <=
+      Decimal(row['Max Height'])
+    ):
+      return 'Med Height is not between Min Height and Max Height'
+    return None
+
+  @staticmethod
+  def _import_key(row):
+    """Return the key a valid CSV row will be saved under
+
+    Values are parsed, so '2021-6-1' and '2021-06-01' match.
+    """
+    return (
+      datetime.strptime(row['Date'], '%Y-%m-%d').date(),
+      datetime.strptime(row['Time'], '%H:%M').time(),
+      row['Lab'],
+      int(row['Plot'])
+    )
+
+  def import_csv(self, filename):
+    """Bulk load a CSVModel format file using COPY
+
+    Every row is checked against the fields first, and rows that
+    would be rejected are skipped.  Existing records with the same
+    key are updated.
+
+    Returns an ImportReport of the number of records loaded and
+    a list of (line number, reason) tuples for rejected rows.
+    """
+    rejected = list()
+    seen = dict()
+    loaded = 0
+    columns = list(CSVModel.fields.keys())
+    integers = [
+      key for key, spec in self.fields.items() if spec['type'] == FT.integer
+    ]
+    booleans = [
+      key for key, spec in self.fields.items() if spec['type'] == FT.boolean
+    ]
+    # Valid rows are spooled to disk past a few MB
+    with SpooledTemporaryFile(
+      max_size=4 * 2**20, mode='w+', encoding='utf-8', newline=''
+    ) as valid:
+      writer = csv.writer(valid)
+      with open(filename, 'r', encoding='utf-8', newline='') as fh:
+        reader = csv.DictReader(fh)
+        for row in reader:
+          line = reader.line_num
+          error = self._import_error(row)
+          if error is None:
+            key = self._import_key(row)
+            if key in seen:
+              error = f'Duplicate of line {seen[key]}'
+          if error:
+            rejected.append((line, error))
+            continue
+          seen[key] = line
+          # COPY won't read '5.0' into a SMALLINT
+          for column in integers:
+            row[column] = int(Decimal(row[column]))
+          # Blank booleans are false; the columns are NOT NULL
+          for column in booleans:
+            row[column] = row[column] or 'false'
+          writer.writerow([row[column] for column in columns])
+          loaded += 1
+      valid.seek(0)
+
+      with self._transaction() as connection:
+        with connection.cursor() as cursor:
+          cursor.execute(self.import_table_query)
+          cursor.copy_expert(self.import_copy_query, valid)
+          cursor.execute(self.import_lc_query)
+          cursor.execute(self.import_pc_query)
+    self._lab_checks.clear()
+    return ImportReport(loaded, rejected)
+
+
+class ThreadedModel:
+  """Runs model methods on worker threads
+
+  submit() returns a concurrent.futures.Future.  When the call
+  finishes, its callback or errback is put on a queue; the GUI
+  calls process_results() from an after() loop so that callbacks
+  always run on the Tk thread.
+
+  Calls submitted with cancellable=False, such as writes, are
+  left alone by cancel_all(), so their callbacks still run.
+  """
+
+  def __init__(self, model, workers=4):
+    self.model = model
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self.queue = Queue()
+    self._pending = set()
+    self._uncancellable = set()
+
+  def submit(
+    self, method, *args, callback=None, errback=None, cancellable=True,
+    **kwargs
+  ):
+    """Call the named model method, or a callable, on a worker thread"""
+    if not callable(method):
+      method = getattr(self.model, method)
+    future = self.executor.submit(method, *args, **kwargs)
+    self._pending.add(future)
+    if not cancellable:
+      self._uncancellable.add(future)
+    future.add_done_callback(
+      lambda f: self.queue.put((f, callback, errback))
+    )
+    return future
+
+  def process_results(self):
+    """Run the callbacks for finished calls"""
+    while not self.queue.empty():
+      future, callback, errback = self.queue.get()
+      if future not in self._pending:
+        # cancelled
+        continue
+      self._pending.discard(future)
+      self._uncancellable.discard(future)
+      error = future.exception()
+      if error is not None:
+        if errback:
+          errback(error)
+      elif callback:
+        callback(future.result())
+
+  @property
+  def busy(self):
+    return bool(self._pending)
+
+  def cancel(self, future):
+    """Cancel a call, or ignore its result if it already started"""
+    future.cancel()
+    self._pending.discard(future)
+
+  def cancel_all(self):
+    """Cancel every cancellable call; returns how many were cancelled"""
+    cancelled = self._pending - self._uncancellable
+    for future in cancelled:
+      self.cancel(future)
+    return len(cancelled)
+
+  def close(self):
+    for future in list(self._pending):
+      self.cancel(future)
+    self._uncancellable.clear()
+    self.executor.shutdown(wait=False)
+
 
 class CSVModel:
   """CSV file storage"""
@@ -243,6 +1167,7 @@ class CSVModel:
                    'min': 0, 'max': 1000, 'inc': .01},
     "Notes": {'req': False, 'type': FT.long_string}
   }
+  record_class = record_type('CSVRecord', fields)
 
 
   def __init__(self, filename=None):
@@ -285,6 +1210,29 @@ class CSVModel:
         csvwriter.writeheader()
         csvwriter.writerows(records)
 
+  def append_records(self, records):
+    """Append records from any iterable in a single pass
+
+    Records are written as they are read, so the iterable
+    can be a stream of any length.  Returns the number of
+    records written; with none, the file is left alone.
+    """
+    records = iter(records)
+    first = next(records, None)
+    if first is None:
+      return 0
+    newfile = not self.file.exists()
+    count = 0
+    with open(self.file, 'a', encoding='utf-8', newline='') as fh:
+      csvwriter = csv.DictWriter(fh, fieldnames=self.fields.keys())
+      if newfile:
+        csvwriter.writeheader()
+      for record in chain([first], records):
+        # dict() so database rows work with DictWriter
+        csvwriter.writerow(dict(record))
+        count += 1
+    return count
+
   def get_all_records(self):
     """Read in all records from the CSV and return a list"""
     if not self.file.exists():
@@ -301,7 +1249,52 @@ class CSVModel:
         )
       records = list(csvreader)
 
-    # Correct issue with boolean fields
+    return self._correct_booleans(records)
+
+  def iter_records(self):
+    """Iterate over the records without loading the whole file
+
+    The file is memory-mapped and parsed a row at a time.
+    Each row is a record_class instance, with its values
+    converted to their field types.  A value that can't be
+    converted raises ValueError with its line number.
+    """
+    if not self.file.exists() or not self.file.stat().st_size:
+      return
+
+    with open(self.file, 'rb') as fh, mmap.mmap(
+      fh.fileno(), 0, access=mmap.ACCESS_READ
+    ) as mapped:
+      # Translate newlines the same way get_all_records() does
+      lines = (
+        line.decode('utf-8').replace('\r\n', '\n')
+        for line in iter(mapped.readline, b'')
+      )
+      csvreader = csv.reader(lines)
+      fieldnames = next(csvreader)
+      missing_fields = set(self.fields.keys()) - set(fieldnames)
+      if len(missing_fields) > 0:
+        fields_string = ', '.join(missing_fields)
+        raise Exception(
+          f"File is missing fields: {fields_string}"
+        )
+      # Where each field is in the file's columns
+      positions = [fieldnames.index(key) for key in self.fields]
+      padding = [''] * len(fieldnames)
+      for values in csvreader:
+        if not values:
+          continue
+        values += padding[len(values):]
+        try:
+          record = self.record_class(*[values[i] for i in positions])
+        except (InvalidOperation, ValueError) as e:
+          raise ValueError(
+            f'Line {csvreader.line_num}: bad value in {self.file}'
+          ) from e
+        yield record
+
+  def _correct_booleans(self, records):
+    """Correct issue with boolean fields"""
     trues = ('true', 'yes', '1')
     bool_fields = [
       key for key, meta
@@ -323,6 +1316,195 @@ class CSVModel:
     return self.get_all_records()[rownum]
 
 
+class IndexedCSVModel(CSVModel):
+  """CSV file storage with a row index and an update log
+
+  A sidecar file (<file>.idx) keeps the byte offset of each row,
+  so a single row can be read without parsing the whole file.
+  Updates are appended to <file>.log rather than rewriting the file,
+  and are folded back into it by compact() once the log holds
+  more than compact_threshold entries.
+  """
+
+  compact_threshold = 100
+
+  def __init__(self, filename=None):
+    super().__init__(filename)
+    self.index_file = Path(f'{self.file}.idx')
+    self.log_file = Path(f'{self.file}.log')
+    self._offsets = None
+    self._signature = None
+    self._updates = None
+    self._log_entries = 0
+
+  @staticmethod
+  def _read_raw_record(fh):
+    """Read the bytes of one CSV record from a binary file
+
+    Quoted fields can contain newlines, so keep reading
+    lines until the quotes are balanced.
+    """
+    data = fh.readline()
+    while data.count(b'"') % 2:
+      line = fh.readline()
+      if not line:
+        break
+      data += line
+    return data
+
+  @staticmethod
+  def _parse_raw_record(data):
+    text = io.StringIO(data.decode('utf-8'), newline=None)
+    return next(csv.reader(text), [])
+
+  def _file_signature(self):
+    stat = self.file.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+  def _build_index(self):
+    """Scan the CSV file for the offset of each row"""
+    offsets = list()
+    with open(self.file, 'rb') as fh:
+      self._read_raw_record(fh)  # header
+      while True:
+        offset = fh.tell()
+        data = self._read_raw_record(fh)
+        if not data:
+          break
+        # DictReader skips blank lines, so we do too
+        if data.strip():
+          offsets.append(offset)
+    return offsets
+
+  def _save_index(self):
+    self._signature = self._file_signature()
+    index = {'signature': self._signature, 'offsets': self._offsets}
+    with open(self.index_file, 'w', encoding='utf-8') as fh:
+      json.dump(index, fh)
+
+  def _load_index(self):
+    """Make sure the row index matches the CSV file"""
+    if not self.file.exists():
+      self._offsets = list()
+      self._signature = None
+      return
+    signature = self._file_signature()
+    if self._offsets is not None and signature == self._signature:
+      return
+    if self.index_file.exists():
+      with open(self.index_file, 'r', encoding='utf-8') as fh:
+        index = json.load(fh)
+      if index.get('signature') == signature:
+        self._offsets = index['offsets']
+        self._signature = signature
+        return
+    self._offsets = self._build_index()
+    self._save_index()
+
+  def _load_updates(self):
+    """Read the update log into memory"""
+    if self._updates is not None:
+      return
+    self._updates = dict()
+    self._log_entries = 0
+    if self.log_file.exists():
+      with open(self.log_file, 'r', encoding='utf-8', newline='') as fh:
+        for row in csv.DictReader(fh):
+          self._updates[int(row.pop('rownum'))] = row
+          self._log_entries += 1
+
+  def _check_rownum(self, rownum):
+    """Return rownum as a positive index, or raise IndexError"""
+    if rownum < 0:
+      rownum += len(self._offsets)
+    if not 0 <= rownum < len(self._offsets):
+      raise IndexError('CSV row number out of range')
+    return rownum
+
+  def save_record(self, data, rownum=None):
+    """Save a dict of data to the CSV file
+
+    New records are appended to the file and the index;
+    updates are appended to the update log.
+    """
+    self._load_index()
+    if rownum is None:
+      offset = self.file.stat().st_size if self.file.exists() else None
+      super().save_record(data)
+      if offset is None:
+        self._offsets = self._build_index()
+      else:
+        self._offsets.append(offset)
+      self._save_index()
+      return
+
+    self._load_updates()
+    rownum = self._check_rownum(rownum)
+    newlog = not self.log_file.exists()
+    with open(self.log_file, 'a', encoding='utf-8', newline='') as fh:
+      csvwriter = csv.DictWriter(
+        fh, fieldnames=['rownum', *self.fields.keys()]
+      )
+      if newlog:
+        csvwriter.writeheader()
+      csvwriter.writerow({'rownum': rownum, **data})
+    # Keep the same string values we'd read back from the log
+    self._updates[rownum] = {
+      key: '' if value is None else str(value)
+      for key, value in data.items()
+    }
+    # Repeated edits of one row add log entries, not updates
+    self._log_entries += 1
+    if self._log_entries > self.compact_threshold:
+      self.compact()
+
+  def get_all_records(self):
+    """Read in all records, with logged updates applied"""
+    records = super().get_all_records()
+    self._load_updates()
+    updates = [
+      (rownum, dict(record)) for rownum, record in self._updates.items()
+      if rownum < len(records)
+    ]
+    self._correct_booleans([record for _, record in updates])
+    for rownum, record in updates:
+      records[rownum] = record
+    return records
+
+  def get_record(self, rownum):
+    """Get a single record by row number
+
+    Callling code should catch IndexError
+      in case of a bad rownum.
+    """
+    self._load_index()
+    self._load_updates()
+    rownum = self._check_rownum(rownum)
+    if rownum in self._updates:
+      record = dict(self._updates[rownum])
+    else:
+      with open(self.file, 'rb') as fh:
+        header = self._parse_raw_record(self._read_raw_record(fh))
+        fh.seek(self._offsets[rownum])
+        values = self._parse_raw_record(self._read_raw_record(fh))
+      record = dict(zip(header, values))
+    return self._correct_booleans([record])[0]
+
+  def compact(self):
+    """Fold the update log back into the CSV file"""
+    records = self.get_all_records()
+    with open(self.file, 'w', encoding='utf-8', newline='') as fh:
+      csvwriter = csv.DictWriter(fh, fieldnames=self.fields.keys())
+      csvwriter.writeheader()
+      csvwriter.writerows(records)
+    if self.log_file.exists():
+      self.log_file.unlink()
+    self._updates = dict()
+    self._log_entries = 0
+    self._offsets = self._build_index()
+    self._save_index()
+
+
 class SettingsModel:
   """A model for saving settings"""
 
@@ -334,6 +1516,9 @@ class SettingsModel:
     'theme': {'type': 'str', 'value': 'default'},
     'db_host': {'type': 'str', 'value': 'localhost'},
     'db_name': {'type': 'str', 'value': 'abq'},
+    'db_pool_size': {'type': 'int', 'value': 4},
+    'upload_workers': {'type': 'int', 'value': 4},
+    'uploads_per_server': {'type': 'int', 'value': 2},
     'weather_station': {'type': 'str', 'value': 'KBMG'},
     'abq_rest_url': {
       'type': 'str',
@@ -423,16 +1608,45 @@ class WeatherDataModel:
 
 
 class ThreadedUploader(Thread):
-
-  upload_lock = Lock()
-
-  def __init__(self, session_cookie, files_url, filepath, queue):
+  """Upload a file to the REST server on a background thread
+
+  The file is sent in chunks with the server's resumable upload
+  protocol.  Transient failures are retried with exponential
+  backoff, resuming from the offset the server reports; the
+  server's ETag (the SHA-256 of the data it has) is checked
+  against ours before any data is added to it.
+
+  The upload URL is kept in <file>.upload until the upload
+  completes, so a failed upload of an unchanged file resumes
+  where it stopped the next time it is uploaded.
+
+  Chunks are compressed with the best of CONTENT_ENCODINGS that
+  the server lists in the Accept-Encoding header of its upload
+  responses; offsets and ETags always refer to the file's bytes.
+
+  Call start() to run it on its own thread, or submit it to an
+  UploadScheduler.
+  """
+
+  chunk_size = 2**20
+  max_retries = 5
+  # Seconds to wait after the first failure; doubled each time
+  backoff = 0.5
+  max_backoff = 30
+  timeout = 30
+
+  def __init__(
+    self, session_cookie, files_url, filepath, queue, uploads_url=None
+  ):
     super().__init__()
     self.files_url = files_url
-    self.filepath = filepath
+    self.uploads_url = uploads_url or files_url.rsplit('/', 1)[0] + '/uploads'
+    self.filepath = Path(filepath)
+    self.state_file = Path(f'{filepath}.upload')
     self.session = requests.Session()
     self.session.cookies['session'] = session_cookie
     self.queue = queue
+    self.encoding = None
 
 
   def run(self, *args, **kwargs):
@@ -443,34 +1657,273 @@ class ThreadedUploader(Thread):
       )
     )
 
-    with self.upload_lock:
-      with open(self.filepath, 'rb') as fh:
-        files = {'file': fh}
-        response = self.session.put(
-          self.files_url, files=files
+    try:
+      self._upload()
+    except Exception as e:
+      self.queue.put(Message('error', 'Upload Error', str(e)))
+    else:
+      self.queue.put(
+        Message(
+          'done',
+          'Upload Succeeded',
+          f'Upload of {self.filepath} to REST succeeded'
         )
+      )
+
+  def _wait(self, attempt):
+    """Back off before retry number attempt"""
+    sleep(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+  def _request(self, method, url, **kwargs):
+    """Send a request, retrying connection and server errors"""
+    for attempt in range(self.max_retries + 1):
+      if attempt:
+        self._wait(attempt)
       try:
-        response.raise_for_status()
-      except Exception as e:
-        self.queue.put(Message('error', 'Upload Error', str(e)))
+        response = self.session.request(
+          method, url, timeout=self.timeout, **kwargs
+        )
+      except (requests.ConnectionError, requests.Timeout) as e:
+        error = e
+        continue
+      if response.status_code < 500:
+        return response
+      error = requests.HTTPError(
+        f'{response.status_code} Server Error', response=response
+      )
+    raise error
+
+  def _hash_to(self, fh, offset):
+    """Return a SHA-256 of the first offset bytes of fh"""
+    digest = hashlib.sha256()
+    fh.seek(0)
+    remaining = offset
+    while remaining:
+      data = fh.read(min(self.chunk_size, remaining))
+      if not data:
+        break
+      digest.update(data)
+      remaining -= len(data)
+    return digest
+
+  def _accept_encoding(self, response):
+    """Choose the chunk encoding from a server response"""
+    accepted = {
+      encoding.strip() for encoding
+      in response.headers.get('Accept-Encoding', '').split(',')
+    }
+    self.encoding = next(
+      (e for e in CONTENT_ENCODINGS if e in accepted), None
+    )
+
+  def _encode(self, chunk):
+    if self.encoding == 'zstd':
+      return zstandard.ZstdCompressor().compress(chunk)
+    if self.encoding == 'gzip':
+      return gzip.compress(chunk, compresslevel=6)
+    return chunk
+
+  def _file_signature(self):
+    stat = self.filepath.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+  def _start(self):
+    """Start a new upload on the server and return its URL"""
+    response = self._request(
+      'POST', self.uploads_url,
+      data={'filename': self.filepath.name, 'size': self.filepath.stat().st_size}
+    )
+    response.raise_for_status()
+    self._accept_encoding(response)
+    url = urljoin(self.uploads_url, response.headers['Location'])
+    self.state_file.write_text(json.dumps(
+      {'url': url, 'signature': self._file_signature()}
+    ))
+    return url
+
+  def _resync(self, url, fh):
+    """Get the offset, ETag and digest to continue an upload from
+
+    Returns None if the upload can't be continued, because the
+    server no longer has it or has different data from ours.
+    """
+    response = self._request('HEAD', url)
+    if response.status_code == 404:
+      return None
+    response.raise_for_status()
+    self._accept_encoding(response)
+    offset = int(response.headers['Upload-Offset'])
+    etag = response.headers['ETag']
+    digest = self._hash_to(fh, offset)
+    if etag.strip('"') != digest.hexdigest():
+      return None
+    return offset, etag, digest
+
+  def _resume(self, fh):
+    """Continue the upload in the state file, if there is one"""
+    try:
+      state = json.loads(self.state_file.read_text())
+    except (OSError, ValueError):
+      return None
+    if state.get('signature') != self._file_signature():
+      return None
+    resync = self._resync(state['url'], fh)
+    return resync and (state['url'], *resync)
+
+  def _upload(self):
+    size = self.filepath.stat().st_size
+    with open(self.filepath, 'rb') as fh:
+      resumed = self._resume(fh)
+      if resumed:
+        url, offset, etag, digest = resumed
       else:
-        self.queue.put(
-          Message(
-            'done',
-            'Upload Succeeded',
-            f'Upload of {self.filepath} to REST succeeded'
-          )
+        url, offset, etag, digest = self._start(), 0, None, hashlib.sha256()
+
+      # Chunks refused in a row; counted against max_retries
+      refused = 0
+      while True:
+        fh.seek(offset)
+        chunk = fh.read(self.chunk_size)
+        headers = {'Upload-Offset': str(offset)}
+        if etag:
+          headers['If-Match'] = etag
+        if self.encoding:
+          headers['Content-Encoding'] = self.encoding
+        response = self._request(
+          'PATCH', url, data=self._encode(chunk), headers=headers
         )
+        if response.status_code in (404, 409, 412):
+          # The server lost the upload, or has more or different
+          # data than we think, e.g. after a dropped response
+          refused += 1
+          if refused > self.max_retries:
+            raise Exception(
+              f'The server refused the upload at offset {offset}'
+            )
+          self._wait(refused)
+          resync = self._resync(url, fh)
+          if resync is None:
+            url, resync = self._start(), (0, None, hashlib.sha256())
+          offset, etag, digest = resync
+          continue
+        response.raise_for_status()
+        refused = 0
+        offset += len(chunk)
+        digest.update(chunk)
+        etag = response.headers.get('ETag')
+        if etag and etag.strip('"') != digest.hexdigest():
+          raise Exception('The uploaded data does not match the file')
+        self.queue.put(Message(
+          'info', 'Uploading',
+          f'{self.filepath.name}: {offset} of {size} bytes'
+        ))
+        if offset >= size:
+          break
+    self.state_file.unlink(missing_ok=True)
+
+
+class UploadScheduler:
+  """Runs upload jobs on a bounded pool of worker threads
+
+  Jobs are objects with a run() method, such as ThreadedUploader,
+  which report their own progress and errors on their Message
+  queue.  Queued jobs start in priority order (lowest first, then
+  first submitted), but no more than per_destination of them run
+  against one destination at a time; a job for a busy destination
+  waits without holding up jobs for other destinations.
+  """
+
+  def __init__(self, workers=4, per_destination=2):
+    self.per_destination = per_destination
+    self._jobs = list()
+    self._running = Counter()
+    self._order = count()
+    self._condition = Condition()
+    self._closed = False
+    self._threads = [
+      Thread(target=self._work, daemon=True) for _ in range(workers)
+    ]
+    for thread in self._threads:
+      thread.start()
+
+  def submit(self, job, destination, priority=0):
+    """Queue job to run against destination"""
+    with self._condition:
+      if self._closed:
+        raise RuntimeError('The upload scheduler is closed')
+      self._jobs.append((priority, next(self._order), destination, job))
+      self._condition.notify()
+
+  def cancel(self, job):
+    """Remove a job that hasn't started yet
+
+    Returns False if it's already running or finished.
+    """
+    with self._condition:
+      for item in self._jobs:
+        if item[3] is job:
+          self._jobs.remove(item)
+          return True
+    return False
+
+  @property
+  def busy(self):
+    with self._condition:
+      return bool(self._jobs) or any(self._running.values())
+
+  def _next_job(self):
+    """Take the first job whose destination has a free slot"""
+    ready = [
+      item for item in self._jobs
+      if self._running[item[2]] < self.per_destination
+    ]
+    if not ready:
+      return None
+    item = min(ready)
+    self._jobs.remove(item)
+    self._running[item[2]] += 1
+    return item
+
+  def _work(self):
+    while True:
+      with self._condition:
+        item = self._next_job()
+        while item is None:
+          if self._closed and not self._jobs:
+            return
+          self._condition.wait()
+          item = self._next_job()
+      _, _, destination, job = item
+      try:
+        job.run()
+      except Exception:
+        # Jobs report their own errors; keep the worker alive
+        pass
+      finally:
+        with self._condition:
+          self._running[destination] -= 1
+          self._condition.notify_all()
+
+  def close(self, wait=True):
+    """Stop the workers once the queued jobs have run"""
+    with self._condition:
+      self._closed = True
+      self._condition.notify_all()
+    if wait:
+      for thread in self._threads:
+        thread.join()
 
 
 class CorporateRestModel:
 
-  def __init__(self, base_url):
+  def __init__(self, base_url, scheduler=None):
 
     self.auth_url = f'{base_url}/auth'
     self.files_url = f'{base_url}/files'
+    self.uploads_url = f'{base_url}/uploads'
     self.session = requests.session()
     self.queue = Queue()
+    self.scheduler = scheduler
 
   @staticmethod
   def _raise_for_status(response):
@@ -497,22 +1950,98 @@ class CorporateRestModel:
       return False
     self._raise_for_status(response)
 
-  def get_file(self, filename):
-    """Download a file from the server"""
+  @staticmethod
+  def _decompressor(encoding):
+    """Return a decompressor for a response's Content-Encoding"""
+    if encoding in (None, 'identity'):
+      return None
+    if encoding == 'gzip':
+      # wbits=47 reads a gzip or zlib header
+      return zlib.decompressobj(wbits=47)
+    if encoding == 'zstd' and zstandard:
+      return zstandard.ZstdDecompressor().decompressobj()
+    raise Exception(f'The server sent unsupported encoding {encoding}')
+
+  def get_file(self, filename, local_path, chunk_size=2**16):
+    """Download a file from the server to local_path
+
+    The response is streamed to disk a chunk at a time and
+    decompressed on the way, so memory use doesn't depend on the
+    size of the file.
+    """
     url = f"{self.files_url}/{filename}"
-    response = self.session.get(url)
-    self._raise_for_status(response)
-    return response.text
+    partial = Path(f'{local_path}.part')
+    with self.session.get(
+      url, stream=True,
+      headers={'Accept-Encoding': ', '.join(CONTENT_ENCODINGS)}
+    ) as response:
+      self._raise_for_status(response)
+      decompressor = self._decompressor(
+        response.headers.get('Content-Encoding')
+      )
+      try:
+        with open(partial, 'wb') as fh:
+          # We decompress ourselves, as urllib3 may not have zstd
+          for chunk in response.raw.stream(chunk_size, decode_content=False):
+            if decompressor:
+              chunk = decompressor.decompress(chunk)
+            fh.write(chunk)
+          if decompressor:
+            fh.write(decompressor.flush())
+      except Exception:
+        partial.unlink(missing_ok=True)
+        raise
+    partial.replace(local_path)
+
+  def download_file(self, filename, local_path):
+    """Download a file on a thread of its own
+
+    The result is reported on queue, as uploads are, so the
+    download doesn't hold up a database worker.
+    """
+    def download():
+      try:
+        self.get_file(filename, local_path)
+      except Exception as e:
+        self.queue.put(
+          Message('error', 'Download Failed', f'{filename}: {e}')
+        )
+      else:
+        self.queue.put(
+          Message('done', 'Download Complete', f'Saved {local_path}.')
+        )
+    thread = Thread(target=download)
+    thread.start()
+    return thread
 
-  def upload_file(self, filepath):
-    """PUT a file on the server"""
+  def upload_file(self, filepath, priority=0):
+    """Upload a file to the server in the background
+
+    With a scheduler, the upload is queued at priority;
+    otherwise it starts on a thread of its own.
+    """
     cookie = self.session.cookies.get('session')
     uploader = ThreadedUploader(
-      cookie, self.files_url, filepath, self.queue
+      cookie, self.files_url, filepath, self.queue, self.uploads_url
     )
-    uploader.start()
+    if self.scheduler is None:
+      uploader.start()
+    else:
+      self.queue.put(
+        Message('info', 'Upload Queued', uploader.filepath.name)
+      )
+      self.scheduler.submit(uploader, self.uploads_url, priority)
+    return uploader
 
 class SFTPModel:
+  """Transfers files over one SFTP session
+
+  A single SFTP channel is opened on first use and kept for the
+  session, along with a cache of the remote directories known to
+  exist, so repeated uploads to the same directory don't need any
+  extra round trips.  Remote paths are POSIX paths, relative to
+  the directory the session starts in.
+  """
 
   def __init__(self, host, port=22):
     self.host = host
@@ -524,6 +2053,9 @@ class SFTPModel:
       paramiko.AutoAddPolicy()
     )
     self._client.load_system_host_keys()
+    self._sftp = None
+    self._remote_dirs = set()
+    self._dirs_lock = Lock()
 
 
   def authenticate(self, username, password):
@@ -539,40 +2071,206 @@ class SFTPModel:
 
   def _check_auth(self):
     transport = self._client.get_transport()
-    if not transport.is_active() and transport.is_authenticated():
+    if not (
+      transport and transport.is_active() and transport.is_authenticated()
+    ):
       raise Exception('Not connected to a server.')
 
+  @property
+  def sftp(self):
+    """The session's SFTP channel, opened if needed"""
+    if self._sftp is None or self._sftp.get_channel().closed:
+      self._sftp = self.open_channel()
+      self._remote_dirs.clear()
+    return self._sftp
+
+  def open_channel(self):
+    """Open another SFTP channel on the session's transport"""
+    self._check_auth()
+    return self._client.open_sftp()
+
+  def close(self):
+    if self._sftp is not None:
+      self._sftp.close()
+      self._sftp = None
+    self._client.close()
 
   def check_file(self, remote_path):
     """Check if the file at remote_path exists"""
-    self._check_auth()
-    sftp = self._client.open_sftp()
     try:
-      sftp.stat(remote_path)
+      self.sftp.stat(str(remote_path))
     except FileNotFoundError:
       return False
     return True
 
-  def upload_file(self, local_path, remote_path):
+  def _make_dirs(self, sftp, directory):
+    """Create directory and any missing parents
+
+    Stats upward from directory to the nearest one that exists,
+    then creates the missing ones top down, so a directory that
+    already exists costs one round trip, or none if cached.
+    """
+    directory = PurePosixPath(directory)
+    missing = []
+    # Held throughout, so concurrent uploads don't race to mkdir
+    with self._dirs_lock:
+      for path in (directory, *directory.parents):
+        if str(path) in ('.', '/') or str(path) in self._remote_dirs:
+          break
+        try:
+          sftp.stat(str(path))
+        except FileNotFoundError:
+          missing.append(path)
+        else:
+          self._remote_dirs.add(str(path))
+          break
+      for path in reversed(missing):
+        sftp.mkdir(str(path))
+        self._remote_dirs.add(str(path))
+
+  def upload_file(self, local_path, remote_path, callback=None, sftp=None):
     """Upload file at local_path to remote_path
 
-    Both paths must include a filename
+    Both paths must include a filename.  callback is called with
+    the bytes sent so far and the file size as the upload goes.
+    Pass sftp to use a channel other than the session's.
     """
-    self._check_auth()
-    sftp = self._client.open_sftp()
-
-    # Create the dstination path if it doesn't exist
-    remote_path = Path(remote_path)
-    for directory in remote_path.parent.parts:
-      if directory not in sftp.listdir():
-        sftp.mkdir(directory)
-      sftp.chdir(directory)
-    # copy the file
-    # just use filename because our CWD should
-    # be the full path without the name
-    sftp.put(local_path, remote_path.name)
-
-  def get_file(self, remote_path, local_path):
-    self._check_auth()
-    sftp = self._client.open_sftp()
-    sftp.get(remote_path, local_path)
+    sftp = sftp or self.sftp
+    remote_path = PurePosixPath(remote_path)
+    self._make_dirs(sftp, remote_path.parent)
+    try:
+      sftp.put(str(local_path), str(remote_path), callback)
+    except FileNotFoundError:
+      # A cached directory was removed on the server
+      with self._dirs_lock:
+        self._remote_dirs.clear()
+      self._make_dirs(sftp, remote_path.parent)
+      sftp.put(str(local_path), str(remote_path), callback)
+
+  def get_file(
+    self, remote_path, local_path, callback=None, sftp=None,
+    max_requests=None
+  ):
+    """Download the file at remote_path to local_path
+
+    The file is prefetched with up to max_requests reads in
+    flight; callback and sftp are as for upload_file.
+    """
+    sftp = sftp or self.sftp
+    sftp.get(
+      str(remote_path), str(local_path), callback,
+      max_concurrent_prefetch_requests=max_requests
+    )
+
+
+class SFTPTransfers:
+  """Runs SFTP uploads and downloads on background threads
+
+  Each worker thread opens its own SFTP channel on the model's
+  SSH transport, so several files move at once over a single
+  connection.  Uploads are written pipelined and downloads are
+  prefetched, so neither waits for a round trip per block.
+
+  Progress and results are put on queue as Messages, with
+  progress at most every progress_interval seconds per file.
+  """
+
+  progress_interval = 0.25
+  max_prefetch_requests = 64
+
+  def __init__(self, model, workers=3):
+    self.model = model
+    self.queue = Queue()
+    self.executor = ThreadPoolExecutor(max_workers=workers)
+    self._local = local()
+    self._channels = []
+    self._pending = set()
+    self._closed = False
+    self._lock = Lock()
+
+  def _channel(self):
+    """Return this worker thread's SFTP channel"""
+    sftp = getattr(self._local, 'sftp', None)
+    if sftp is None or sftp.get_channel().closed:
+      sftp = self._local.sftp = self.model.open_channel()
+      with self._lock:
+        self._channels.append(sftp)
+    return sftp
+
+  def _progress(self, subject, name):
+    """Return a transfer callback that reports on queue"""
+    last = None
+
+    def callback(done, total):
+      nonlocal last
+      now = monotonic()
+      if last is None or now - last >= self.progress_interval:
+        last = now
+        self.queue.put(
+          Message('info', subject, f'{name}: {done} of {total} bytes')
+        )
+    return callback
+
+  def _run(self, kind, name, transfer, *args, **kwargs):
+    try:
+      transfer(
+        *args, sftp=self._channel(),
+        callback=self._progress(f'{kind}ing', name), **kwargs
+      )
+    except Exception as e:
+      self.queue.put(Message('error', f'{kind} Error', f'{name}: {e}'))
+      raise
+    self.queue.put(
+      Message(
+        'done', f'{kind} Succeeded',
+        f'{name} successfully {kind.lower()}ed via SFTP.'
+      )
+    )
+
+  def _submit(self, *args, **kwargs):
+    future = self.executor.submit(self._run, *args, **kwargs)
+    with self._lock:
+      self._pending.add(future)
+    future.add_done_callback(self._finished)
+    return future
+
+  def _finished(self, future):
+    with self._lock:
+      self._pending.discard(future)
+      if self._closed and not self._pending:
+        self._close_channels()
+
+  def _close_channels(self):
+    # Call with self._lock held
+    for sftp in self._channels:
+      sftp.close()
+    self._channels.clear()
+
+  def upload(self, local_path, remote_path):
+    """Queue an upload; returns a concurrent.futures.Future"""
+    return self._submit(
+      'Upload', PurePosixPath(remote_path).name,
+      self.model.upload_file, local_path, remote_path
+    )
+
+  def download(self, remote_path, local_path):
+    """Queue a download; returns a concurrent.futures.Future"""
+    return self._submit(
+      'Download', PurePosixPath(remote_path).name,
+      self.model.get_file, remote_path, local_path,
+      max_requests=self.max_prefetch_requests
+    )
+
+  def close(self, wait=True):
+    """Stop taking transfers
+
+    With wait, block until queued transfers finish; otherwise
+    they finish in the background.  Either way, their channels
+    are closed once the last one is done.
+    """
+    with self._lock:
+      self._closed = True
+    self.executor.shutdown(wait=wait)
+    with self._lock:
+      if not self._pending:
+        self._close_channels()
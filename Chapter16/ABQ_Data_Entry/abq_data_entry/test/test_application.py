@@ -1,5 +1,5 @@
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 from .. import application
 
 
@@ -26,7 +26,12 @@ class TestApplication(TestCase):
         'autofill sheet data': {'type': 'bool', 'value': True},
         'font size': {'type': 'int', 'value': 9},
         'font family': {'type': 'str', 'value': ''},
-        'theme': {'type': 'str', 'value': 'default'}
+        'theme': {'type': 'str', 'value': 'default'},
+        'db_host': {'type': 'str', 'value': 'localhost'},
+        'db_name': {'type': 'str', 'value': 'abq'},
+        'db_pool_size': {'type': 'int', 'value': 2},
+        'upload_workers': {'type': 'int', 'value': 1},
+        'uploads_per_server': {'type': 'int', 'value': 1}
       }
 
   def setUp(self):
@@ -36,15 +41,20 @@ class TestApplication(TestCase):
       patch('abq_data_entry.application.m.SettingsModel') as settingsmodel,\
       patch('abq_data_entry.application.Application._show_login') as show_login,\
       patch('abq_data_entry.application.v.DataRecordForm'),\
-      patch('abq_data_entry.application.v.RecordList'),\
+      patch('abq_data_entry.application.v.VirtualRecordList'),\
       patch('abq_data_entry.application.ttk.Notebook'),\
-      patch('abq_data_entry.application.get_main_menu_for_os')\
+      patch('abq_data_entry.application.get_main_menu_for_os'),\
+      patch.object(application.Application, 'model', Mock(), create=True)\
+      as model\
     :
 
       settingsmodel().fields = self.settings
       csvmodel().get_all_records.return_value = self.records
       show_login.return_value = True
+      # _show_login normally connects the database model
+      model.get_records_page.return_value = ([], None)
       self.app = application.Application()
+      self.app.model = model
 
   def tearDown(self):
     self.app.update()
@@ -55,18 +65,116 @@ class TestApplication(TestCase):
     self.app.update()
     self.app.notebook.select.assert_called_with(self.app.recordlist)
 
+  def _finish_model_calls(self):
+    """Wait for the app's model calls and deliver their results"""
+    self.app.model_worker.executor.shutdown(wait=True)
+    self.app.model_worker.process_results()
+
   def test_populate_recordlist(self):
     # test correct functions
+    model = Mock()
+    model.get_records_page.return_value = (self.records, None)
+    self.app.model_worker = application.m.ThreadedModel(model)
     self.app._populate_recordlist()
-    self.app.model.get_all_records.assert_called()
-    self.app.recordlist.populate.assert_called_with(self.records)
+    self._finish_model_calls()
+    model.get_records_page.assert_called()
+    self.app.recordlist.populate.assert_called_with(
+      self.records, more_available=False
+    )
 
     # test exceptions
 
-    self.app.model.get_all_records.side_effect = Exception('Test message')
+    model.get_records_page.side_effect = Exception('Test message')
+    self.app.model_worker = application.m.ThreadedModel(model)
     with patch('abq_data_entry.application.messagebox'):
       self.app._populate_recordlist()
+      self._finish_model_calls()
       application.messagebox.showerror.assert_called_with(
         title='Error', message='Problem reading file',
         detail='Test message'
       )
+
+  def test_on_save(self):
+    model = Mock()
+    self.app.model_worker = application.m.ThreadedModel(model)
+    form = self.app.recordform
+    form.get_errors.return_value = {}
+    form.get.return_value = dict(self.records[0])
+    form.current_record = None
+    self.app._on_save()
+    # a second click while the first save runs does nothing
+    self.assertFalse(self.app._on_save())
+    form.savebutton.state.assert_called_with(['disabled'])
+
+    with patch.object(self.app, '_update_recordlist_row'):
+      self._finish_model_calls()
+    model.save_record.assert_called_once_with(self.records[0], None)
+    form.savebutton.state.assert_called_with(['!disabled'])
+    form.reset.assert_called_once()
+
+  def test_on_save_keeps_new_input(self):
+    model = Mock()
+    self.app.model_worker = application.m.ThreadedModel(model)
+    form = self.app.recordform
+    form.get_errors.return_value = {}
+    form.get.return_value = dict(self.records[0])
+    form.current_record = None
+    self.app._on_save()
+    # the user starts on the next record before the save finishes
+    form.get.return_value = dict(self.records[1])
+    with patch.object(self.app, '_update_recordlist_row'):
+      self._finish_model_calls()
+    form.reset.assert_not_called()
+    form.savebutton.state.assert_called_with(['!disabled'])
+
+  def test_growth_point(self):
+    chart = Mock()
+    self.app.growth_charts = [chart]
+    model = Mock()
+
+    def submit(method, *args, callback=None, errback=None, **kwargs):
+      callback(getattr(model, method)(*args))
+    self.app.model_worker = Mock(submit=Mock(side_effect=submit))
+    rowkey = ('2021-06-04', '8:00', 'A', '1')
+
+    model.get_growth_point.return_value = [
+      {'lab_id': 'A', 'Day': 3, 'Avg Height (cm)': 2}
+    ]
+    self.app._update_growth_charts(None, rowkey)
+    model.get_growth_point.assert_called_with('2021-06-04', 'A')
+    chart.update_point.assert_called_once_with('A', 3, 2)
+
+    # a save that empties the group takes its point off the chart
+    model.get_growth_point.return_value = []
+    model.get_growth_day.return_value = 3
+    self.app._update_growth_charts(rowkey, None)
+    model.get_growth_day.assert_called_with('2021-06-04')
+    chart.remove_point.assert_called_once_with('A', 3)
+    self.assertEqual(chart.update_point.call_count, 1)
+
+  def test_on_quit(self):
+    self.app.model_worker = Mock()
+    self.app.upload_scheduler = Mock(busy=True)
+    close_window = self.app.protocol('WM_DELETE_WINDOW')
+    with \
+      patch.object(self.app, 'quit') as quit,\
+      patch('abq_data_entry.application.messagebox') as messagebox\
+    :
+      # running uploads are only stopped if the user agrees
+      messagebox.askyesno.return_value = False
+      self.app.tk.call(close_window)
+      quit.assert_not_called()
+      self.app.upload_scheduler.close.assert_not_called()
+
+      messagebox.askyesno.return_value = True
+      self.app.tk.call(close_window)
+      self.app.model_worker.close.assert_called_once()
+      self.app.upload_scheduler.close.assert_called_once_with(wait=False)
+      quit.assert_called_once()
+
+  def test_database_login(self):
+    # the pool keeps a connection free for the Tk thread
+    with patch('abq_data_entry.application.m.SQLModel') as sqlmodel:
+      self.assertTrue(self.app._database_login('user', 'pass'))
+    self.assertEqual(self.app.model_worker.executor._max_workers, 2)
+    sqlmodel.assert_called_with('localhost', 'abq', 'user', 'pass', 3)
@@ -3,6 +3,22 @@ from unittest import TestCase
 from unittest import mock
 
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+from threading import Event
+from datetime import date
+import csv
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+
+import paramiko
 
 class TestCSVModel(TestCase):
 
@@ -135,3 +151,1391 @@ class TestCSVModel(TestCase):
       ])
       with self.assertRaises(IndexError):
         self.model2.save_record(record, 2)
+
+
+  @mock.patch('abq_data_entry.models.Path.exists')
+  def test_append_records(self, mock_path_exists):
+    mock_path_exists.return_value = False
+    fields = list(models.CSVModel.fields.keys())
+    records = (
+      {key: str(n) for key in fields} for n in range(3)
+    )
+    with mock.patch('abq_data_entry.models.open', self.file2_open):
+      count = self.model2.append_records(records)
+    self.assertEqual(count, 3)
+    # one open for the whole stream
+    self.file2_open.assert_called_once_with(
+      Path('file2'), 'a', encoding='utf-8', newline=''
+    )
+    file2_handle = self.file2_open()
+    file2_handle.write.assert_has_calls([
+      mock.call(','.join(fields) + '\r\n'),
+      mock.call(','.join(['0'] * len(fields)) + '\r\n'),
+      mock.call(','.join(['1'] * len(fields)) + '\r\n'),
+      mock.call(','.join(['2'] * len(fields)) + '\r\n')
+    ])
+
+    # no records, no file
+    self.file2_open.reset_mock()
+    with mock.patch('abq_data_entry.models.open', self.file2_open):
+      self.assertEqual(self.model2.append_records(iter([])), 0)
+    self.file2_open.assert_not_called()
+
+  def test_iter_records(self):
+    with TemporaryDirectory() as tempdir:
+      filename = Path(tempdir) / 'records.csv'
+      data = self.file1_open.return_value.read()
+      filename.write_text(data, newline='')
+      model = models.CSVModel(filename)
+      records = list(model.iter_records())
+      self.assertEqual(len(records), 2)
+      self.assertIsInstance(records[0], models.CSVModel.record_class)
+      self.assertEqual(records[1]['Plot'], '3')
+      self.assertEqual(records[1]['Plants'], 18)
+      self.assertEqual(records[1]['Light'], models.Decimal('1'))
+      self.assertEqual(records[1]['Notes'], '')
+      self.assertFalse(records[0]['Equipment Fault'])
+      self.assertEqual(list(records[0]), list(model.fields))
+
+      # a bad number stops the iteration at its line
+      filename.write_text(data.replace('14.2', 'tall'), newline='')
+      records = model.iter_records()
+      self.assertEqual(next(records)['Plot'], '2')
+      with self.assertRaisesRegex(ValueError, 'Line 3'):
+        next(records)
+
+      # an empty file yields nothing
+      filename.write_text('')
+      self.assertEqual(list(model.iter_records()), [])
+
+
+class TestIndexedCSVModel(TestCase):
+
+  def setUp(self):
+    self.tempdir = TemporaryDirectory()
+    self.filename = Path(self.tempdir.name) / 'records.csv'
+    self.model = models.IndexedCSVModel(self.filename)
+    self.records = [
+      {key: f'{key} {n}' for key in models.CSVModel.fields}
+      for n in range(5)
+    ]
+    for record in self.records:
+      record['Equipment Fault'] = False
+    self.records[2]['Notes'] = 'Test Note\nTest Note\n'
+    for record in self.records:
+      self.model.save_record(record)
+
+  def tearDown(self):
+    self.tempdir.cleanup()
+
+  def test_get_record(self):
+    self.assertEqual(len(self.model._offsets), 5)
+    self.assertEqual(self.model.get_record(2), self.records[2])
+    self.assertEqual(self.model.get_record(-1), self.records[4])
+    with self.assertRaises(IndexError):
+      self.model.get_record(5)
+
+    # a new model instance uses the saved index
+    model = models.IndexedCSVModel(self.filename)
+    with mock.patch.object(model, '_build_index') as build_index:
+      self.assertEqual(model.get_record(3), self.records[3])
+      build_index.assert_not_called()
+
+  def test_update(self):
+    contents = self.filename.read_bytes()
+    update = dict(self.records[1], Notes='updated', **{
+      'Equipment Fault': True
+    })
+    self.model.save_record(update, 1)
+
+    # the CSV file is untouched until compaction
+    self.assertEqual(self.filename.read_bytes(), contents)
+    self.assertEqual(self.model.get_record(1), update)
+    self.assertEqual(self.model.get_all_records()[1], update)
+    model = models.IndexedCSVModel(self.filename)
+    self.assertEqual(model.get_record(1), update)
+
+    self.model.compact()
+    self.assertFalse(self.model.log_file.exists())
+    self.assertEqual(self.model.get_record(1), update)
+    self.assertEqual(self.model.get_record(2), self.records[2])
+
+  def test_compact_threshold(self):
+    # editing the same row again and again still compacts the log
+    self.model.compact_threshold = 3
+    for n in range(3):
+      self.model.save_record(dict(self.records[1], Notes=f'edit {n}'), 1)
+    self.assertTrue(self.model.log_file.exists())
+
+    # a fresh instance counts the entries already in the log
+    model = models.IndexedCSVModel(self.filename)
+    model.compact_threshold = 3
+    model.save_record(dict(self.records[1], Notes='edit 3'), 1)
+    self.assertFalse(model.log_file.exists())
+    self.assertEqual(model.get_record(1)['Notes'], 'edit 3')
+
+
+class TestSQLModel(TestCase):
+
+  def setUp(self):
+    with \
+      mock.patch('abq_data_entry.models.ThreadedConnectionPool'),\
+      mock.patch.object(models.SQLModel, 'query', return_value=[])\
+    :
+      self.model = models.SQLModel('localhost', 'abq', 'user', 'pass')
+    self.connection = self.model._pool.getconn()
+    self.connection.closed = 0
+    self.model.query = mock.Mock()
+    self.model.query_prepared = mock.Mock()
+    self.rows = [
+      {'Date': '2021-06-02', 'Time': '8:00', 'Lab': 'A', 'Plot': 1},
+      {'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': 1},
+      {'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': 2},
+    ]
+
+  def test_get_records_page(self):
+    # a full page returns the key of its last row
+    self.model.query.return_value = self.rows
+    rows, key = self.model.get_records_page(page_size=2)
+    self.assertEqual(rows, self.rows[:2])
+    self.assertEqual(key, ('2021-06-01', '8:00', 'A', 1))
+    query, parameters = self.model.query.call_args[0]
+    self.assertEqual(parameters['limit'], 3)
+    self.assertNotIn('"Date" <', query)
+
+    # continuing from a key uses it in the where clause
+    self.model.query.return_value = self.rows[2:]
+    rows, key = self.model.get_records_page(after=key, page_size=2)
+    self.assertEqual(rows, self.rows[2:])
+    self.assertIsNone(key)
+    query, parameters = self.model.query.call_args[0]
+    self.assertIn('("Time", "Lab", "Plot") >', query)
+    self.assertEqual(parameters['date'], '2021-06-01')
+    self.assertEqual(parameters['plot'], 1)
+
+  def test_get_growth_columns(self):
+    self.model.query.return_value = [
+      {'Day': 0, 'lab_id': 'B', 'Avg Height (cm)': models.Decimal('1.5')},
+      {'Day': 0, 'lab_id': 'A', 'Avg Height (cm)': models.Decimal('2')},
+      {'Day': 1, 'lab_id': 'B', 'Avg Height (cm)': None},
+    ]
+    batch = self.model.get_growth_columns()
+    self.assertEqual(list(batch.categories['lab_id']), ['A', 'B'])
+    self.assertEqual(list(batch.columns['lab_id']), [1, 0, 1])
+    self.assertEqual(list(batch.columns['Day']), [0, 0, 1])
+    heights = batch.columns['Avg Height (cm)']
+    self.assertEqual(list(heights[:2]), [1.5, 2.0])
+    self.assertTrue(models.np.isnan(heights[2]))
+
+  def test_get_growth_point(self):
+    self.model.get_growth_point('2021-06-01', 'A')
+    query, parameters = self.model.query.call_args[0]
+    self.assertIn('FROM growth_summary', query)
+    self.assertIn('WHERE date = %(date)s AND lab_id = %(lab)s', query)
+    self.assertEqual(parameters, {'date': '2021-06-01', 'lab': 'A'})
+
+  def test_get_growth_day(self):
+    self.model.query.return_value = [{'Day': 3}]
+    self.assertEqual(self.model.get_growth_day('2021-06-04'), 3)
+    query, parameters = self.model.query.call_args[0]
+    self.assertIn('min(date) AS "Day" FROM growth_summary', query)
+    self.assertEqual(parameters, {'date': '2021-06-04'})
+
+  @mock.patch('abq_data_entry.models.execute_batch')
+  @mock.patch('abq_data_entry.models.execute_values')
+  def test_save_records(self, mock_values, mock_batch):
+    sheet = [
+      {'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': str(x),
+       'Technician': 'J Simms'}
+      for x in range(1, 4)
+    ]
+    records = [
+      (sheet[0], None),
+      (sheet[1], ('2021-06-01', '8:00', 'A', 2)),
+      (sheet[2], ('2021-06-01', '8:00', 'A', 20))
+    ]
+    results = self.model.save_records(records)
+
+    self.assertEqual(
+      [r.status for r in results], ['inserted', 'updated', 'updated']
+    )
+    # only one lab check for the whole sheet
+    lc_call, insert_call, upsert_call = mock_values.call_args_list
+    self.assertEqual(len(lc_call[0][2]), 1)
+    self.assertEqual(insert_call[0][2][0]['Plot'], '1')
+    self.assertEqual(upsert_call[0][2][0]['Plot'], '2')
+    # a changed key needs an update
+    updates = mock_batch.call_args[0][2]
+    self.assertEqual(updates[0]['key_plot'], 20)
+
+    # the last of several records for one key is the one saved
+    mock_values.reset_mock()
+    duplicates = [
+      (dict(sheet[0], Notes='first'), None),
+      (dict(sheet[0], Notes='second'), None)
+    ]
+    results = self.model.save_records(duplicates)
+    self.assertEqual([r.status for r in results], ['inserted', 'inserted'])
+    inserted = mock_values.call_args_list[1][0][2]
+    self.assertEqual(len(inserted), 1)
+    self.assertEqual(inserted[0]['Notes'], 'second')
+
+    # a rejected batch falls back to saving one at a time
+    mock_values.side_effect = models.pg.IntegrityError('bad')
+    cursor = self.connection.cursor().__enter__()
+    cursor.execute.reset_mock()
+    cursor.execute.side_effect = [
+      None, None, None, None,  # savepoint, lc, pc, release
+      None, None, models.pg.IntegrityError('bad plot'), None,
+      None, None, None, None
+    ]
+    results = self.model.save_records(records)
+    self.assertEqual(
+      [r.status for r in results], ['inserted', 'error', 'updated']
+    )
+    self.assertEqual(results[1].error, 'bad plot')
+    # the same statements as the batch: an unchanged key is upserted
+    statements = [c[0][0] for c in cursor.execute.call_args_list]
+    self.assertEqual(statements[2], self.model.pc_insert_query)
+    self.assertEqual(statements[6], self.model.pc_upsert_query)
+    self.assertEqual(statements[10], self.model.pc_update_query)
+
+  def test_save_record(self):
+    record = {
+      'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': '1',
+      'Technician': 'J Simms'
+    }
+    # new records are inserted
+    self.model.save_record(dict(record), None)
+    self.model.query_prepared.assert_called_once()
+    queries = self.model.query_prepared.call_args[0][0]
+    self.assertEqual(queries, ('lc_upsert_query', 'pc_insert_query'))
+
+    # updates with the same key are upserted
+    self.model.save_record(dict(record), ('2021-06-01', '8:00', 'A', 1))
+    queries = self.model.query_prepared.call_args[0][0]
+    self.assertEqual(queries, ('lc_upsert_query', 'pc_upsert_query'))
+
+    # updates that change the key are updated by the old key
+    self.model.save_record(dict(record), ('2021-06-01', '8:00', 'A', 2))
+    queries, parameters = self.model.query_prepared.call_args[0]
+    self.assertEqual(queries, ('lc_upsert_query', 'pc_update_query'))
+    self.assertEqual(parameters['key_plot'], 2)
+
+  def test_query_reconnect(self):
+    del self.model.query
+    cursor = self.connection.cursor().__enter__()
+    cursor.fetchall.return_value = [{'id': 'A'}]
+
+    # a lost connection is discarded and the query retried
+    cursor.execute.side_effect = [
+      None,  # health check
+      models.pg.OperationalError('server closed the connection'),
+      None,  # health check of the new connection
+      None
+    ]
+    result = self.model.query('SELECT id FROM labs')
+    self.assertEqual(result, [{'id': 'A'}])
+    self.model._pool.putconn.assert_any_call(self.connection, close=True)
+
+    # a write may have committed before the connection dropped,
+    # so it is not run a second time
+    self.connection.closed = 1
+    cursor.execute.reset_mock()
+    cursor.execute.side_effect = [
+      None,  # health check
+      models.pg.OperationalError('server closed the connection'),
+    ]
+    with self.assertRaises(models.pg.OperationalError):
+      self.model.query("INSERT INTO labs VALUES ('F')")
+    self.assertEqual(cursor.execute.call_count, 2)
+
+  def test_query_prepared(self):
+    del self.model.query_prepared
+    cursor = self.connection.cursor().__enter__()
+    cursor.fetchall.side_effect = [
+      [('abq_lab_check_query',)],  # already prepared on the server
+      [{'lab_tech': 'J Simms'}],
+      [], []
+    ]
+    cursor.description = ('lab_tech',)
+    parameters = {'date': '2021-06-01', 'time': '8:00', 'lab': 'A'}
+
+    result = self.model.query_prepared('lab_check_query', parameters)
+    self.assertEqual(result, [{'lab_tech': 'J Simms'}])
+    executed = [call[0][0] for call in cursor.execute.call_args_list]
+    self.assertFalse([q for q in executed if q.startswith('PREPARE')])
+
+    # other queries are prepared once, then only executed
+    self.model.query_prepared(
+      ('lc_upsert_query', 'pc_insert_query'), mock.MagicMock()
+    )
+    self.model.query_prepared(
+      ('lc_upsert_query', 'pc_insert_query'), mock.MagicMock()
+    )
+    executed = [call[0][0] for call in cursor.execute.call_args_list]
+    prepares = [q for q in executed if q.startswith('PREPARE')]
+    self.assertEqual(len(prepares), 2)
+    self.assertIn(
+      'PREPARE abq_lc_upsert_query AS INSERT INTO lab_checks VALUES '
+      '($1, $2, $3, (SELECT id FROM lab_techs WHERE name = $4))',
+      prepares[0]
+    )
+    self.assertEqual(
+      executed[-1],
+      'EXECUTE abq_lc_upsert_query (%s, %s, %s, %s); '
+      'EXECUTE abq_pc_insert_query (' + ', '.join(['%s'] * 16) + ')'
+    )
+
+  def test_query_prepared_resync(self):
+    del self.model.query_prepared
+    cursor = self.connection.cursor().__enter__()
+    cursor.fetchall.return_value = []
+    cursor.description = None
+    self.model._prepared[id(self.connection)] = {'abq_record_query'}
+
+    # the statement was deallocated behind the model's back
+    cursor.execute.side_effect = [
+      None,  # health check
+      models.pg.errors.InvalidSqlStatementName('no such statement'),
+      None,  # reload of pg_prepared_statements
+      None,  # PREPARE
+      None   # EXECUTE
+    ]
+    self.model.query_prepared('record_query', mock.MagicMock())
+    executed = [call[0][0] for call in cursor.execute.call_args_list]
+    self.assertEqual(executed[2], 'SELECT name FROM pg_prepared_statements')
+    self.assertTrue(executed[3].startswith('PREPARE abq_record_query'))
+    self.assertEqual(
+      self.model._prepared[id(self.connection)], {'abq_record_query'}
+    )
+
+  def test_query_prepared_reconnect(self):
+    del self.model.query_prepared
+    cursor = self.connection.cursor().__enter__()
+    cursor.fetchall.return_value = []
+    cursor.description = None
+    self.model._prepared[id(self.connection)] = {
+      'abq_lc_upsert_query', 'abq_pc_upsert_query'
+    }
+    lost = models.pg.OperationalError('server closed the connection')
+
+    # upserts are safe to run again on a new connection
+    cursor.execute.side_effect = [None, lost] + [None] * 5
+    self.model.query_prepared(
+      ('lc_upsert_query', 'pc_upsert_query'), mock.MagicMock()
+    )
+    executed = [call[0][0] for call in cursor.execute.call_args_list]
+    self.assertEqual(executed[-1], executed[1])
+
+    # an insert may have committed before the connection dropped
+    self.connection.closed = 1
+    cursor.execute.reset_mock()
+    cursor.execute.side_effect = [None, None, lost]  # PREPARE, EXECUTE
+    with self.assertRaises(models.pg.OperationalError):
+      self.model.query_prepared(
+        ('lc_upsert_query', 'pc_insert_query'), mock.MagicMock()
+      )
+    self.assertEqual(cursor.execute.call_count, 3)
+
+  def test_autofill_lookups(self):
+    # seed samples come from the preloaded plots table
+    self.model.query.return_value = [
+      {'lab_id': 'A', 'plot': 1, 'current_seed_sample': 'AXM477'},
+      {'lab_id': 'A', 'plot': 2, 'current_seed_sample': 'AXM478'}
+    ]
+    self.model.load_plots()
+    self.model.query.reset_mock()
+    self.assertEqual(self.model.get_current_seed_sample('A', '2'), 'AXM478')
+    self.model.query.assert_not_called()
+    self.assertEqual(self.model.fields['Plot']['values'], ['1', '2'])
+
+    # lab checks are cached until a save touches them
+    check = {'lab_tech': 'J Simms'}
+    self.model.query_prepared.return_value = [check]
+    for _ in range(3):
+      result = self.model.get_lab_check('2021-06-01', '8:00', 'A')
+    self.assertEqual(result, check)
+    self.model.query_prepared.assert_called_once()
+
+    self.model.save_record(
+      {'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': '1'},
+      None
+    )
+    self.model.query_prepared.reset_mock()
+    self.model.get_lab_check('2021-06-01', '8:00', 'A')
+    self.model.query_prepared.assert_called_once()
+
+
+  def test_iter_records(self):
+    cursor = self.connection.cursor().__enter__()
+    cursor.__iter__.return_value = iter([
+      {'Date': date(2021, 6, 1), 'Time': '8:00', 'Lab': 'A', 'Plot': 1,
+       'Plants': 10, 'Equipment Fault': False}
+    ])
+    records = list(self.model.iter_records(all_dates=True))
+    self.assertIsInstance(records[0], models.SQLModel.record_class)
+    self.assertEqual(records[0]['Date'], '2021-06-01')
+    self.assertEqual(records[0].plot, '1')
+    self.assertEqual(records[0]['Plants'], 10)
+    self.assertIsNone(records[0]['Humidity'])
+
+  def test_import_csv(self):
+    header = ','.join(models.CSVModel.fields.keys())
+    good = (
+      '2021-06-01,8:00,J Simms,A,2,AX478,24.47,1.01,21.44,False,14,'
+      '27,1,2.35,9.2,5.09,'
+    )
+    faulted = (
+      '2021-06-01,8:00,J Simms,A,3,AX479,,,,True,18,49,'
+      '6,2.47,14.2,11.83,"two\nlines"'
+    )
+    out_of_range = (
+      '2021-06-01,8:00,J Simms,A,4,AX480,99,1,20.82,False,18,49,'
+      '6,2.47,14.2,11.83,'
+    )
+    not_a_number = (
+      '2021-06-01,8:00,J Simms,A,4,AX480,NaN,1,20.82,False,18,49,'
+      '6,2.47,14.2,11.83,'
+    )
+    infinite = (
+      '2021-06-01,8:00,J Simms,A,4,AX480,20,1,20.82,False,18,49,'
+      '6,2.47,Infinity,11.83,'
+    )
+    huge = (
+      '2021-06-01,8:00,J Simms,A,4,AX480,20,1,20.82,False,1e999999999,49,'
+      '6,2.47,14.2,11.83,'
+    )
+    unknown_plot = (
+      '2021-06-01,8:00,J Simms,A,5,AX480,20,1,20.82,False,18,49,'
+      '6,2.47,14.2,11.83,'
+    )
+    decimal_integer = (
+      '2021-06-01,8:00,J Simms,A,4,AX480,20,1,20.82,False,18.0,49,'
+      '6,2.47,14.2,11.83,'
+    )
+    blank_fault = (
+      '2021-06-01,12:00,J Simms,A,2,AX478,24.47,1.01,21.44,,14,'
+      '27,1,2.35,9.2,5.09,'
+    )
+    unpadded_date = (
+      '2021-6-1,8:00,J Simms,A,2,AX478,24.47,1.01,21.44,False,14,'
+      '27,1,2.35,9.2,5.09,'
+    )
+    data = '\n'.join([
+      header, good, faulted, out_of_range, good, not_a_number, infinite,
+      huge, unknown_plot, decimal_integer, blank_fault, unpadded_date
+    ]) + '\n'
+    self.model._seed_samples = {
+      ('A', '2'): 'AX478', ('A', '3'): 'AX479', ('A', '4'): 'AX480'
+    }
+    cursor = self.connection.cursor().__enter__()
+    copied = list()
+    cursor.copy_expert.side_effect = lambda query, fh: copied.append(
+      list(csv.reader(fh))
+    )
+    with \
+      mock.patch.dict(
+        self.model.fields['Technician'], {'values': ['J Simms']}
+      ),\
+      mock.patch.dict(self.model.fields['Lab'], {'values': ['A']}),\
+      mock.patch.dict(
+        self.model.fields['Plot'], {'values': ['2', '3', '4', '5']}
+      ),\
+      mock.patch('abq_data_entry.models.open', mock.mock_open(read_data=data))\
+    :
+      report = self.model.import_csv('import.csv')
+
+    self.assertEqual(report.loaded, 4)
+    self.assertEqual(report.rejected, [
+      (5, 'Humidity is out of range'),
+      (6, 'Duplicate of line 2'),
+      (7, 'Humidity is not a number'),
+      (8, 'Max Height is not a number'),
+      (9, 'Plants is out of range'),
+      (10, 'Lab A has no plot 5'),
+      (13, 'Duplicate of line 2')
+    ])
+    query = cursor.copy_expert.call_args[0][0]
+    self.assertEqual(query, self.model.import_copy_query)
+    self.assertEqual(len(copied[0]), 4)
+    # Plants is written as a whole number for the SMALLINT column
+    self.assertEqual(copied[0][2][10], '18')
+    # A blank Equipment Fault is loaded as false
+    self.assertEqual(copied[0][3][9], 'false')
+    cursor.execute.assert_called_with(self.model.import_pc_query)
+
+class PostgresTestCase(TestCase):
+  """Runs SQLModel against a real database
+
+  A throwaway PostgreSQL server is started in a temporary
+  directory and loaded with a year of checks for every plot;
+  the tests are skipped if one can't be started.
+  """
+
+  @staticmethod
+  def _postgres_bindir():
+    pg_ctl = shutil.which('pg_ctl')
+    if pg_ctl:
+      return Path(pg_ctl).parent
+    # Debian and Ubuntu keep the server programs off the PATH
+    bindirs = sorted(glob.glob('/usr/lib/postgresql/*/bin'), reverse=True)
+    return Path(bindirs[0]) if bindirs else None
+
+  @classmethod
+  def setUpClass(cls):
+    bindir = cls._postgres_bindir()
+    if bindir is None:
+      raise SkipTest('PostgreSQL is not installed')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+      raise SkipTest('PostgreSQL will not run as root')
+
+    tempdir = TemporaryDirectory()
+    cls.addClassCleanup(tempdir.cleanup)
+    datadir = Path(tempdir.name) / 'data'
+    subprocess.run(
+      [bindir / 'initdb', '-D', datadir, '-U', 'abq', '--auth=trust'],
+      check=True, capture_output=True
+    )
+    # Only listen on a socket in the temporary directory
+    subprocess.run(
+      [bindir / 'pg_ctl', '-D', datadir, '-w',
+       '-l', Path(tempdir.name) / 'postgres.log',
+       '-o', f"-k {tempdir.name} -c listen_addresses=''", 'start'],
+      check=True, capture_output=True
+    )
+    cls.addClassCleanup(
+      subprocess.run,
+      [bindir / 'pg_ctl', '-D', datadir, '-m', 'fast', 'stop'],
+      capture_output=True
+    )
+
+    connection = models.pg.connect(
+      host=tempdir.name, database='postgres', user='abq'
+    )
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+      cursor.execute('CREATE DATABASE abq')
+    connection.close()
+    cls.connection = models.pg.connect(
+      host=tempdir.name, database='abq', user='abq'
+    )
+    cls.connection.autocommit = True
+    cls.addClassCleanup(cls.connection.close)
+    cls._load_database()
+
+    cls.model = models.SQLModel(tempdir.name, 'abq', 'abq', '')
+    cls.addClassCleanup(cls.model.close)
+
+  @classmethod
+  def _load_database(cls):
+    """Create the schema with a year of checks for every plot"""
+    sqldir = Path(__file__).parents[2] / 'sql'
+    with cls.connection.cursor() as cursor:
+      for script in ('create_db.sql', 'populate_db.sql'):
+        cursor.execute((sqldir / script).read_text())
+      cursor.execute(
+        'INSERT INTO lab_checks '
+        'SELECT day::date, check_time::time, labs.id, 4291 '
+        "FROM generate_series(CURRENT_DATE - 364, CURRENT_DATE, '1 day') "
+        'AS day, '
+        "unnest(ARRAY['8:00', '12:00', '16:00', '20:00']) AS check_time, "
+        'labs'
+      )
+      cursor.execute(
+        'INSERT INTO plot_checks '
+        'SELECT lc.date, lc.time, lc.lab_id, plots.plot, '
+        'plots.current_seed_sample, 20, 50, 20, false, 10, 10, 5, '
+        '12, 8, 10, NULL '
+        'FROM lab_checks AS lc JOIN plots ON plots.lab_id = lc.lab_id'
+      )
+      cursor.execute((sqldir / 'create_summaries.sql').read_text())
+      # CREATE INDEX CONCURRENTLY can't share a query string
+      indexes = (sqldir / 'add_indexes.sql').read_text()
+      lines = [l for l in indexes.splitlines() if not l.startswith('--')]
+      for statement in '\n'.join(lines).split(';'):
+        if statement.strip():
+          cursor.execute(statement)
+
+
+class TestQueryPlans(PostgresTestCase):
+  """Check the SQLModel queries use indexes on a real database"""
+
+  large_tables = {'plot_checks', 'lab_checks'}
+
+  def _explain(self, method, *args, **kwargs):
+    """Call a model method, returning the plans of its queries"""
+    plans = list()
+
+    def explain(query, parameters=None):
+      with self.connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + query, parameters)
+        plan = cursor.fetchone()[0]
+      if isinstance(plan, str):
+        plan = json.loads(plan)
+      plans.append(plan[0]['Plan'])
+      return []
+
+    def explain_prepared(query_names, parameters=None):
+      if isinstance(query_names, str):
+        query_names = (query_names,)
+      for query_name in query_names:
+        explain(getattr(self.model, query_name), parameters)
+      return []
+
+    with \
+      mock.patch.object(self.model, 'query', explain),\
+      mock.patch.object(self.model, 'query_prepared', explain_prepared)\
+    :
+      method(*args, **kwargs)
+    return plans
+
+  def _seq_scans(self, plan):
+    scans = set()
+    if plan['Node Type'] == 'Seq Scan':
+      scans.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+      scans |= self._seq_scans(child)
+    return scans
+
+  def assertNoSeqScan(self, method, *args, **kwargs):
+    plans = self._explain(method, *args, **kwargs)
+    self.assertTrue(plans)
+    for plan in plans:
+      scans = self._seq_scans(plan) & self.large_tables
+      self.assertFalse(scans, f'Sequential scan of {scans}')
+
+  def test_todays_records(self):
+    self.assertNoSeqScan(self.model.get_all_records)
+
+  def test_records_page(self):
+    rowkey = (date.today().isoformat(), '8:00', 'A', 1)
+    self.assertNoSeqScan(self.model.get_records_page, after=rowkey)
+
+  def test_single_record(self):
+    rowkey = (date.today().isoformat(), '8:00', 'A', 1)
+    self.assertNoSeqScan(self.model.get_record, rowkey)
+
+    # the lookup returns the same row as data_record_view
+    with self.connection.cursor(cursor_factory=models.DictCursor) as cursor:
+      cursor.execute(
+        'SELECT * FROM data_record_view WHERE "Date" = %s '
+        'AND "Time" = %s AND "Lab" = %s AND "Plot" = %s', rowkey
+      )
+      expected = cursor.fetchone()
+    self.assertEqual(dict(self.model.get_record(rowkey)), dict(expected))
+    self.assertEqual(list(self.model.get_record(rowkey)), list(expected))
+
+  def test_lab_check(self):
+    self.assertNoSeqScan(
+      self.model.get_lab_check, date.today().isoformat(), '8:00', 'B'
+    )
+
+  def test_growth_point(self):
+    self.assertNoSeqScan(
+      self.model.get_growth_point, date.today().isoformat(), 'A'
+    )
+
+
+class TestSummaries(PostgresTestCase):
+  """Check the summary triggers keep up with bulk changes"""
+
+  growth_query = (
+    'SELECT date, lab_id, avg(median_height) FROM plot_checks '
+    'GROUP BY date, lab_id'
+  )
+  yield_query = (
+    'SELECT lab_id, plot, seed_sample, max(fruit), avg(humidity), '
+    'avg(temperature) FROM plot_checks WHERE NOT equipment_fault '
+    'GROUP BY lab_id, plot, seed_sample'
+  )
+
+  def assertSummariesCurrent(self):
+    with self.connection.cursor() as cursor:
+      for summary, query in (
+        ('growth_summary', self.growth_query),
+        ('yield_summary', self.yield_query)
+      ):
+        cursor.execute(
+          f'({query} EXCEPT SELECT * FROM {summary}) UNION ALL '
+          f'(SELECT * FROM {summary} EXCEPT {query})'
+        )
+        self.assertEqual(cursor.fetchall(), [], summary)
+
+  def test_bulk_changes(self):
+    self.assertSummariesCurrent()
+    with self.connection.cursor() as cursor:
+      cursor.execute(
+        'INSERT INTO lab_checks SELECT CURRENT_DATE, \'9:00\', id, 4291 '
+        'FROM labs'
+      )
+      cursor.execute(
+        'INSERT INTO plot_checks '
+        'SELECT CURRENT_DATE, \'9:00\', lab_id, plot, '
+        'current_seed_sample, 30, 50, 20, plot = 1, 10, 10, plot, '
+        '12, 8, 8 + plot / 10.0, NULL FROM plots'
+      )
+      self.assertSummariesCurrent()
+
+      # move checks between seed samples and change heights
+      cursor.execute(
+        'UPDATE plot_checks SET seed_sample = \'AXM477\', '
+        'median_height = median_height + 1, equipment_fault = false '
+        'WHERE date = CURRENT_DATE AND plot <= 5'
+      )
+      self.assertSummariesCurrent()
+
+      cursor.execute(
+        'DELETE FROM plot_checks WHERE date = CURRENT_DATE AND lab_id = \'A\''
+      )
+      self.assertSummariesCurrent()
+
+
+class TestBulkExchange(PostgresTestCase):
+
+  def test_export_import_round_trip(self):
+    tempdir = TemporaryDirectory()
+    self.addCleanup(tempdir.cleanup)
+    filename = Path(tempdir.name) / 'export.csv'
+    self.model.export_csv(filename, all_dates=False)
+
+    with open(filename, 'r', encoding='utf-8', newline='') as fh:
+      rows = list(csv.DictReader(fh))
+    self.assertEqual(list(rows[0]), list(models.CSVModel.fields))
+    with self.connection.cursor() as cursor:
+      cursor.execute(
+        'SELECT count(*) FROM plot_checks WHERE date = CURRENT_DATE'
+      )
+      self.assertEqual(len(rows), cursor.fetchone()[0])
+    # CSVModel can read the export too
+    self.assertEqual(
+      len(list(models.CSVModel(filename).iter_records())), len(rows)
+    )
+
+    # Change a record and import the file back over the database
+    rows[0]['Notes'] = 'Imported'
+    with open(filename, 'w', encoding='utf-8', newline='') as fh:
+      writer = csv.DictWriter(fh, fieldnames=rows[0].keys())
+      writer.writeheader()
+      writer.writerows(rows)
+    report = self.model.import_csv(filename)
+    self.assertEqual(report, models.ImportReport(len(rows), []))
+
+    rowkey = tuple(rows[0][key] for key in ('Date', 'Time', 'Lab', 'Plot'))
+    self.assertEqual(self.model.get_record(rowkey)['Notes'], 'Imported')
+
+
+class TestRecord(TestCase):
+
+  def setUp(self):
+    self.Record = models.CSVModel.record_class
+    self.data = {
+      "Date": '2021-07-01', "Time": '12:00',
+      "Technician": 'Test Technician', "Lab": 'E',
+      "Plot": '17', "Seed Sample": 'test sample',
+      "Humidity": '10.5', "Light": '99',
+      "Temperature": '20', "Equipment Fault": 'False',
+      "Plants": '10', "Blossoms": '200',
+      "Fruit": '250', "Min Height": '40',
+      "Max Height": '50', "Med Height": '55',
+      "Notes": None
+    }
+
+  def test_from_dict(self):
+    record = self.Record.from_dict(self.data)
+    self.assertFalse(hasattr(record, '__dict__'))
+    self.assertEqual(record.seed_sample, 'test sample')
+    self.assertEqual(record['Humidity'], models.Decimal('10.5'))
+    self.assertEqual(record['Plants'], 10)
+    self.assertIs(record['Equipment Fault'], False)
+    self.assertIsNone(record['Notes'])
+    self.assertEqual(list(record), list(self.data))
+    with self.assertRaises(KeyError):
+      record['Bogus']
+
+  def test_as_dict(self):
+    record = self.Record.from_dict(self.data)
+    record['Plants'] = '12'
+    self.assertEqual(record.plants, 12)
+    as_dict = record.as_dict()
+    self.assertIsInstance(as_dict, dict)
+    self.assertEqual(self.Record.from_dict(as_dict), record)
+    self.assertEqual(dict(record), as_dict)
+
+
+class TestLookupCache(TestCase):
+
+  @mock.patch('abq_data_entry.models.monotonic')
+  def test_expiry_and_eviction(self, mock_monotonic):
+    mock_monotonic.return_value = 100
+    cache = models.LookupCache(maxsize=2, ttl=10)
+    cache['a'] = 1
+    cache['b'] = 2
+    self.assertEqual(cache['a'], 1)
+
+    # 'b' is least recently used, so it is evicted
+    cache['c'] = 3
+    with self.assertRaises(KeyError):
+      cache['b']
+    self.assertEqual(cache['c'], 3)
+
+    # entries expire after ttl
+    mock_monotonic.return_value = 111
+    with self.assertRaises(KeyError):
+      cache['a']
+
+
+class TestThreadedModel(TestCase):
+
+  def setUp(self):
+    self.model = mock.Mock()
+    self.worker = models.ThreadedModel(self.model, workers=1)
+
+  def finish(self):
+    self.worker.executor.shutdown(wait=True)
+    self.worker.process_results()
+
+  def test_submit(self):
+    self.model.get_record.return_value = {'Plot': 1}
+    callback = mock.Mock()
+    self.worker.submit('get_record', ('key',), callback=callback)
+    self.assertTrue(self.worker.busy)
+    self.finish()
+    self.model.get_record.assert_called_with(('key',))
+    callback.assert_called_with({'Plot': 1})
+    self.assertFalse(self.worker.busy)
+
+  def test_errback(self):
+    error = Exception('query failed')
+    self.model.get_record.side_effect = error
+    callback, errback = mock.Mock(), mock.Mock()
+    self.worker.submit(
+      'get_record', ('key',), callback=callback, errback=errback
+    )
+    self.finish()
+    callback.assert_not_called()
+    errback.assert_called_with(error)
+
+  def test_cancel(self):
+    callback = mock.Mock()
+    future = self.worker.submit('get_record', ('key',), callback=callback)
+    self.worker.cancel(future)
+    self.assertFalse(self.worker.busy)
+    self.finish()
+    callback.assert_not_called()
+
+  def test_cancel_all_keeps_writes(self):
+    read_callback, save_callback = mock.Mock(), mock.Mock()
+    self.worker.submit('get_record', ('key',), callback=read_callback)
+    self.worker.submit(
+      'save_record', {}, None, callback=save_callback, cancellable=False
+    )
+    self.assertEqual(self.worker.cancel_all(), 1)
+    self.assertTrue(self.worker.busy)
+    self.assertEqual(self.worker.cancel_all(), 0)
+    self.finish()
+    read_callback.assert_not_called()
+    save_callback.assert_called()
+    self.assertFalse(self.worker.busy)
+
+
+class TestThreadedUploader(TestCase):
+  """Run ThreadedUploader against a fake chunked upload server"""
+
+  def setUp(self):
+    self.tempdir = TemporaryDirectory()
+    self.file = Path(self.tempdir.name) / 'upload.csv'
+    self.data = os.urandom(2500)
+    self.file.write_bytes(self.data)
+    self.received = bytearray()
+    self.drops = set()
+    self.accept_encoding = ''
+    self.requests = []
+    self.queue = models.Queue()
+    self.uploader = models.ThreadedUploader(
+      'cookie', 'http://example.com/files', self.file, self.queue
+    )
+    self.uploader.chunk_size = 1000
+    self.uploader.session.request = self.serve
+    sleep_patch = mock.patch('abq_data_entry.models.sleep')
+    self.sleep = sleep_patch.start()
+    self.addCleanup(sleep_patch.stop)
+    self.addCleanup(self.tempdir.cleanup)
+
+  def response(self, status=200):
+    response = mock.Mock(status_code=status)
+    response.headers = {
+      'Accept-Encoding': self.accept_encoding,
+      'Location': '/uploads/1',
+      'Upload-Offset': str(len(self.received)),
+      'ETag': f'"{hashlib.sha256(self.received).hexdigest()}"'
+    }
+    return response
+
+  def serve(self, method, url, data=None, headers=None, **kwargs):
+    self.requests.append(method)
+    if method == 'POST':
+      self.received = bytearray()
+      return self.response(201)
+    if method == 'HEAD':
+      return self.response()
+    if int(headers['Upload-Offset']) != len(self.received):
+      return self.response(409)
+    if headers.get('Content-Encoding') == 'gzip':
+      data = gzip.decompress(data)
+    self.received += data
+    if len(self.requests) in self.drops:
+      raise models.requests.ConnectionError('connection dropped')
+    return self.response()
+
+  def messages(self):
+    messages = []
+    while not self.queue.empty():
+      messages.append(self.queue.get())
+    return messages
+
+  def test_upload(self):
+    self.uploader.run()
+    self.assertEqual(bytes(self.received), self.data)
+    self.assertEqual(self.requests, ['POST', 'PATCH', 'PATCH', 'PATCH'])
+    self.assertEqual(self.messages()[-1].status, 'done')
+    self.assertFalse(self.uploader.state_file.exists())
+
+  def test_compressed_upload(self):
+    self.accept_encoding = 'gzip, br'
+    self.data = b'2021-01-01,8:00,A,1\n' * 200
+    self.file.write_bytes(self.data)
+    self.uploader.run()
+    self.assertEqual(self.uploader.encoding, 'gzip')
+    self.assertEqual(bytes(self.received), self.data)
+    self.assertEqual(self.messages()[-1].status, 'done')
+
+  def test_retry_after_dropped_response(self):
+    # the second chunk arrives, but its response is lost
+    self.drops = {3}
+    self.uploader.run()
+    self.assertEqual(bytes(self.received), self.data)
+    self.assertEqual(
+      self.requests,
+      ['POST', 'PATCH', 'PATCH', 'PATCH', 'HEAD', 'PATCH']
+    )
+    # once to retry the PATCH, once before resyncing after the 409
+    self.assertEqual(
+      self.sleep.call_args_list, [mock.call(self.uploader.backoff)] * 2
+    )
+    self.assertEqual(self.messages()[-1].status, 'done')
+
+  def test_refused(self):
+    # every new upload already holds a byte we didn't send,
+    # so the server never accepts the first chunk
+    serve = self.serve
+
+    def serve_stale(method, url, **kwargs):
+      response = serve(method, url, **kwargs)
+      if method == 'POST':
+        self.received = bytearray(b'x')
+      return response
+
+    self.uploader.session.request = serve_stale
+    self.uploader.run()
+    message = self.messages()[-1]
+    self.assertEqual(message.status, 'error')
+    self.assertIn('refused', message.body)
+    self.assertEqual(
+      self.requests.count('PATCH'), self.uploader.max_retries + 1
+    )
+    self.assertEqual(self.sleep.call_count, self.uploader.max_retries)
+
+  def test_resume(self):
+    self.uploader.max_retries = 0
+    self.drops = {3}
+    self.uploader.run()
+    self.assertEqual(self.messages()[-1].status, 'error')
+    self.assertTrue(self.uploader.state_file.exists())
+
+    self.requests = []
+    self.uploader.run()
+    self.assertEqual(bytes(self.received), self.data)
+    self.assertEqual(self.requests, ['HEAD', 'PATCH'])
+    self.assertEqual(self.messages()[-1].status, 'done')
+
+  def test_changed_file_restarts(self):
+    self.uploader.max_retries = 0
+    self.drops = {3}
+    self.uploader.run()
+    self.assertTrue(self.uploader.state_file.exists())
+
+    self.file.write_bytes(self.data[:1500])
+    os.utime(self.file, ns=(0, 0))
+    self.requests = []
+    self.uploader.run()
+    self.assertEqual(self.requests, ['POST', 'PATCH', 'PATCH'])
+    self.assertEqual(bytes(self.received), self.data[:1500])
+
+
+class TestUploadScheduler(TestCase):
+
+  class Job:
+    """A job that runs until released"""
+
+    def __init__(self, name, log):
+      self.name = name
+      self.log = log
+      self.started = Event()
+      self.release = Event()
+
+    def run(self):
+      self.log.append(self.name)
+      self.started.set()
+      self.release.wait(5)
+
+  def setUp(self):
+    self.log = []
+
+  def job(self, name):
+    return self.Job(name, self.log)
+
+  def test_priority(self):
+    scheduler = models.UploadScheduler(workers=1)
+    first = self.job('first')
+    scheduler.submit(first, 'a')
+    self.assertTrue(first.started.wait(5))
+    jobs = [self.job('low'), self.job('high'), self.job('next high')]
+    scheduler.submit(jobs[0], 'a', priority=5)
+    scheduler.submit(jobs[1], 'b', priority=1)
+    scheduler.submit(jobs[2], 'a', priority=1)
+    for job in [first] + jobs:
+      job.release.set()
+    scheduler.close()
+    self.assertEqual(self.log, ['first', 'high', 'next high', 'low'])
+    self.assertFalse(scheduler.busy)
+
+  def test_per_destination(self):
+    scheduler = models.UploadScheduler(workers=3, per_destination=1)
+    a1, a2, b1 = self.job('a1'), self.job('a2'), self.job('b1')
+    scheduler.submit(a1, 'a')
+    scheduler.submit(a2, 'a')
+    scheduler.submit(b1, 'b')
+    self.assertTrue(a1.started.wait(5))
+    self.assertTrue(b1.started.wait(5))
+    # a2 waits for a1, although a worker is free
+    self.assertFalse(a2.started.wait(0.1))
+    self.assertTrue(scheduler.cancel(a2))
+    a1.release.set()
+    b1.release.set()
+    scheduler.close()
+    self.assertEqual(sorted(self.log), ['a1', 'b1'])
+    with self.assertRaises(RuntimeError):
+      scheduler.submit(a2, 'a')
+
+
+class TestCorporateRestModel(TestCase):
+
+  def setUp(self):
+    self.model = models.CorporateRestModel('http://example.com')
+    self.tempdir = TemporaryDirectory()
+    self.addCleanup(self.tempdir.cleanup)
+    self.file = Path(self.tempdir.name) / 'download.csv'
+    self.data = b'2021-01-01,8:00,A,1\n' * 1000
+
+  def serve(self, body, headers):
+    response = mock.MagicMock(status_code=200, headers=headers)
+    response.__enter__.return_value = response
+    response.raw.stream.return_value = [
+      body[i:i + 100] for i in range(0, len(body), 100)
+    ]
+    self.model.session.get = mock.Mock(return_value=response)
+    return response
+
+  def test_get_file(self):
+    self.serve(self.data, {})
+    self.model.get_file('abq.csv', self.file)
+    self.assertEqual(self.file.read_bytes(), self.data)
+    self.assertFalse(Path(f'{self.file}.part').exists())
+    args, kwargs = self.model.session.get.call_args
+    self.assertEqual(args, ('http://example.com/files/abq.csv',))
+    self.assertTrue(kwargs['stream'])
+    self.assertIn('gzip', kwargs['headers']['Accept-Encoding'])
+
+  def test_get_file_gzip(self):
+    response = self.serve(
+      gzip.compress(self.data), {'Content-Encoding': 'gzip'}
+    )
+    self.model.get_file('abq.csv', self.file)
+    self.assertEqual(self.file.read_bytes(), self.data)
+    response.raw.stream.assert_called_with(2**16, decode_content=False)
+
+  def test_get_file_error(self):
+    response = self.serve(b'', {'Content-Encoding': 'gzip'})
+    response.raw.stream.side_effect = models.requests.ConnectionError
+    with self.assertRaises(models.requests.ConnectionError):
+      self.model.get_file('abq.csv', self.file)
+    self.assertFalse(self.file.exists())
+    self.assertFalse(Path(f'{self.file}.part').exists())
+
+  def test_download_file(self):
+    self.serve(self.data, {})
+    self.model.download_file('abq.csv', self.file).join(5)
+    self.assertEqual(self.file.read_bytes(), self.data)
+    message = self.model.queue.get_nowait()
+    self.assertEqual(message.status, 'done')
+
+    self.model.session.get.side_effect = models.requests.ConnectionError
+    self.model.download_file('abq.csv', self.file).join(5)
+    message = self.model.queue.get_nowait()
+    self.assertEqual(message.status, 'error')
+    self.assertEqual(message.subject, 'Download Failed')
+
+
+class TestSFTPModel(TestCase):
+
+  def setUp(self):
+    self.model = models.SFTPModel('localhost')
+    self.model._client = mock.Mock()
+    self.sftp = self.model._client.open_sftp.return_value
+    self.sftp.get_channel.return_value.closed = False
+    self.existing = {'ABQ'}
+    self.sftp.stat.side_effect = self.stat
+
+  def stat(self, path):
+    if path not in self.existing:
+      raise FileNotFoundError(path)
+
+  def test_upload_file(self):
+    self.model.upload_file('a.csv', 'ABQ/BLTN_IN/2021/a.csv')
+    self.assertEqual(
+      self.sftp.mkdir.call_args_list,
+      [mock.call('ABQ/BLTN_IN'), mock.call('ABQ/BLTN_IN/2021')]
+    )
+    self.sftp.put.assert_called_with('a.csv', 'ABQ/BLTN_IN/2021/a.csv', None)
+
+    # the channel and directories are reused
+    self.sftp.reset_mock()
+    self.model.upload_file('b.csv', 'ABQ/BLTN_IN/2021/b.csv')
+    self.model.upload_file('c.csv', 'ABQ/BLTN_IN/c.csv')
+    self.sftp.stat.assert_not_called()
+    self.sftp.mkdir.assert_not_called()
+    self.assertEqual(self.sftp.put.call_count, 2)
+    self.model._client.open_sftp.assert_called_once()
+
+  def test_reconnect(self):
+    self.model.upload_file('a.csv', 'ABQ/a.csv')
+    self.sftp.get_channel.return_value.closed = True
+    new_sftp = mock.Mock()
+    new_sftp.get_channel.return_value.closed = False
+    self.model._client.open_sftp.return_value = new_sftp
+    self.model.upload_file('a.csv', 'ABQ/a.csv')
+    self.assertEqual(self.model._client.open_sftp.call_count, 2)
+    # the directory cache was dropped with the old channel
+    new_sftp.stat.assert_called_with('ABQ')
+    new_sftp.put.assert_called_with('a.csv', 'ABQ/a.csv', None)
+
+  def test_removed_directory(self):
+    self.model.upload_file('a.csv', 'ABQ/a.csv')
+    self.sftp.put.side_effect = [FileNotFoundError, None]
+    self.existing = set()
+    self.model.upload_file('b.csv', 'ABQ/b.csv')
+    self.sftp.mkdir.assert_called_once_with('ABQ')
+    self.assertEqual(self.sftp.put.call_count, 3)
+
+  def test_not_connected(self):
+    self.model._client.get_transport.return_value = None
+    with self.assertRaises(Exception):
+      self.model.check_file('ABQ')
+
+
+class StubSFTPServer(paramiko.SFTPServerInterface):
+  """Serves the files under root to SFTP clients"""
+
+  def __init__(self, server, root, *args, **kwargs):
+    super().__init__(server, *args, **kwargs)
+    self.root = root
+
+  def _path(self, path):
+    return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+  def _attributes(self, path):
+    try:
+      return paramiko.SFTPAttributes.from_stat(os.stat(path))
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+
+  def canonicalize(self, path):
+    return os.path.normpath('/' + path).replace(os.sep, '/')
+
+  def list_folder(self, path):
+    path = self._path(path)
+    try:
+      return [
+        paramiko.SFTPAttributes.from_stat(
+          os.stat(os.path.join(path, name)), name
+        ) for name in os.listdir(path)
+      ]
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+
+  def stat(self, path):
+    return self._attributes(self._path(path))
+
+  lstat = stat
+
+  def mkdir(self, path, attr):
+    try:
+      os.mkdir(self._path(path))
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+    return paramiko.SFTP_OK
+
+  def open(self, path, flags, attr):
+    path = self._path(path)
+    try:
+      fd = os.open(path, flags, 0o644)
+    except OSError as e:
+      return paramiko.SFTPServer.convert_errno(e.errno)
+    if flags & os.O_WRONLY:
+      mode = 'ab' if flags & os.O_APPEND else 'wb'
+    elif flags & os.O_RDWR:
+      mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+    else:
+      mode = 'rb'
+    handle = paramiko.SFTPHandle(flags)
+    handle.filename = path
+    handle.readfile = handle.writefile = os.fdopen(fd, mode)
+    handle.stat = lambda: self._attributes(path)
+    return handle
+
+
+class StubSSHServer(paramiko.ServerInterface):
+
+  def get_allowed_auths(self, username):
+    return 'password'
+
+  def check_auth_password(self, username, password):
+    if (username, password) == ('test', 'test'):
+      return paramiko.AUTH_SUCCESSFUL
+    return paramiko.AUTH_FAILED
+
+  def check_channel_request(self, kind, chanid):
+    return paramiko.OPEN_SUCCEEDED
+
+
+class TestSFTPTransfers(TestCase):
+  """Transfer files with a local paramiko SFTP server"""
+
+  @classmethod
+  def setUpClass(cls):
+    cls.host_key = paramiko.RSAKey.generate(2048)
+
+  def setUp(self):
+    self.tempdir = TemporaryDirectory()
+    self.addCleanup(self.tempdir.cleanup)
+    self.local = Path(self.tempdir.name) / 'local'
+    self.remote = Path(self.tempdir.name) / 'remote'
+    self.local.mkdir()
+    self.remote.mkdir()
+
+    self.transports = []
+    self.listener = socket.socket()
+    self.listener.bind(('127.0.0.1', 0))
+    self.listener.listen()
+    threading.Thread(target=self.serve, daemon=True).start()
+
+    port = self.listener.getsockname()[1]
+    self.model = models.SFTPModel('127.0.0.1', port)
+    self.model._client.load_host_keys(os.devnull)
+    self.model._client.connect(
+      '127.0.0.1', port=port, username='test', password='test',
+      allow_agent=False, look_for_keys=False
+    )
+    self.transfers = models.SFTPTransfers(self.model, workers=3)
+    self.transfers.progress_interval = 0
+    self.addCleanup(self.stop)
+
+  def serve(self):
+    while True:
+      try:
+        sock, _ = self.listener.accept()
+      except OSError:
+        return
+      transport = paramiko.Transport(sock)
+      transport.add_server_key(self.host_key)
+      transport.set_subsystem_handler(
+        'sftp', paramiko.SFTPServer, StubSFTPServer, str(self.remote)
+      )
+      transport.start_server(server=StubSSHServer())
+      self.transports.append(transport)
+
+  def stop(self):
+    self.transfers.close()
+    self.model.close()
+    self.listener.close()
+    for transport in self.transports:
+      transport.close()
+
+  def messages(self):
+    messages = []
+    while not self.transfers.queue.empty():
+      messages.append(self.transfers.queue.get())
+    return messages
+
+  def test_upload_and_download(self):
+    files = {}
+    for lab in 'ABC':
+      path = self.local / f'lab_{lab}.csv'
+      files[path.name] = os.urandom(300000)
+      path.write_bytes(files[path.name])
+    futures = [
+      self.transfers.upload(self.local / name, f'ABQ/BLTN_IN/{name}')
+      for name in files
+    ]
+    for future in futures:
+      future.result(10)
+    for name, data in files.items():
+      self.assertEqual(
+        (self.remote / 'ABQ' / 'BLTN_IN' / name).read_bytes(), data
+      )
+    # all files went over one connection
+    self.assertEqual(len(self.transports), 1)
+
+    messages = self.messages()
+    done = [m for m in messages if m.status == 'done']
+    self.assertEqual(len(done), 3)
+    self.assertIn(
+      'lab_A.csv: 300000 of 300000 bytes',
+      [m.body for m in messages if m.subject == 'Uploading']
+    )
+
+    self.transfers.download(
+      'ABQ/BLTN_IN/lab_B.csv', self.local / 'copy.csv'
+    ).result(10)
+    self.assertEqual(
+      (self.local / 'copy.csv').read_bytes(), files['lab_B.csv']
+    )
+    self.assertEqual(self.messages()[-1].subject, 'Download Succeeded')
+
+  def test_error(self):
+    future = self.transfers.download('missing.csv', self.local / 'x.csv')
+    with self.assertRaises(FileNotFoundError):
+      future.result(10)
+    message = self.messages()[-1]
+    self.assertEqual(message.status, 'error')
+    self.assertEqual(message.subject, 'Download Error')
+
+  def test_close_without_wait(self):
+    path = self.local / 'lab_A.csv'
+    path.write_bytes(os.urandom(300000))
+    channels = []
+    open_channel = self.model.open_channel
+
+    def record_channel():
+      channels.append(open_channel())
+      return channels[-1]
+
+    with mock.patch.object(self.model, 'open_channel', record_channel):
+      future = self.transfers.upload(path, 'lab_A.csv')
+      self.transfers.close(wait=False)
+      future.result(10)
+      self.transfers.executor.shutdown(wait=True)
+    # the worker's channel is closed once its transfer is done
+    self.assertEqual(len(channels), 1)
+    self.assertTrue(channels[0].get_channel().closed)
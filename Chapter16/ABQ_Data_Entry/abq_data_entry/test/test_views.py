@@ -0,0 +1,368 @@
+from .. import models
+from .. import views
+from .test_widgets import TkTestCase
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import numpy as np
+
+
+class TestDownsample(TestCase):
+
+  def setUp(self):
+    self.x = np.arange(10000, dtype=float)
+    self.y = np.sin(self.x / 100)
+    self.y[5000] = 50  # a spike that must survive
+
+  def test_lttb_downsample(self):
+    x, y = views.lttb_downsample(self.x, self.y, 100)
+    self.assertEqual(len(x), 100)
+    self.assertEqual((x[0], x[-1]), (0, 9999))
+    self.assertTrue(np.all(np.diff(x) > 0))
+    self.assertIn(50, y)
+
+    # short lines are left alone
+    x, y = views.lttb_downsample(self.x[:50], self.y[:50], 100)
+    self.assertEqual(len(x), 50)
+
+  def test_minmax_downsample(self):
+    x, y = views.minmax_downsample(self.x, self.y, 100)
+    self.assertLessEqual(len(x), 200)
+    self.assertIn(50, y)
+    self.assertEqual(y.min(), self.y.min())
+
+  def test_downsample(self):
+    x, y = views.downsample(self.x, self.y, 800)
+    self.assertEqual(len(x), 800)
+    self.assertIn(50, y)
+
+
+class TestVirtualRecordList(TkTestCase):
+
+  def setUp(self):
+    self.root.geometry('400x600')
+    self.recordlist = views.VirtualRecordList(self.root)
+    self.recordlist.pack(fill='both', expand=True)
+    self.root.update()
+    self.rows = [
+      {'Date': '2021-06-01', 'Time': '8:00', 'Lab': 'A', 'Plot': plot}
+      for plot in range(1, 201)
+    ]
+
+  def tearDown(self):
+    self.recordlist.destroy()
+
+  def children(self):
+    return self.recordlist.treeview.get_children()
+
+  @staticmethod
+  def key(date, plot):
+    return (date, '8:00', 'A', str(plot))
+
+  def test_populate(self):
+    self.recordlist.populate(self.rows)
+    # the rows are measured once they are drawn
+    self.root.update()
+    visible = self.recordlist._visible
+    self.assertGreater(visible, 10)
+    bbox = self.recordlist.treeview.bbox('0')
+    self.assertEqual(
+      visible,
+      (self.recordlist.treeview.winfo_height() - bbox[1]) // bbox[3]
+    )
+    # only the visible rows and the overscan are in the treeview
+    children = self.children()
+    self.assertEqual(len(children), visible + self.recordlist.overscan)
+    self.assertEqual(children[0], '0')
+    self.assertEqual(self.recordlist.iid_map['0'], self.key('2021-06-01', 1))
+    self.assertEqual(self.recordlist.treeview.selection(), ('0',))
+    self.assertEqual(
+      self.recordlist.scrollbar.get(), (0.0, visible / len(self.rows))
+    )
+
+  def test_scrolling(self):
+    self.recordlist.populate(self.rows)
+    visible = self.recordlist._visible
+    self.recordlist._scroll_to(50)
+    self.assertEqual(self.children()[0], '50')
+    self.assertEqual(
+      self.recordlist.scrollbar.get(), (0.25, (50 + visible) / 200)
+    )
+
+    self.recordlist._on_scrollbar('moveto', '0.5')
+    self.assertEqual(self.recordlist._offset, 100)
+    self.recordlist._on_scrollbar('scroll', '1', 'pages')
+    self.assertEqual(self.recordlist._offset, 100 + visible)
+    self.recordlist._on_scrollbar('scroll', '-2', 'units')
+    self.assertEqual(self.recordlist._offset, 98 + visible)
+
+    # the window stops at the end of the rows
+    self.recordlist._scroll_to(1000)
+    self.assertEqual(self.recordlist._offset, 200 - visible)
+    self.assertEqual(self.children()[-1], '199')
+
+    self.recordlist._on_key(Mock(keysym='Home'))
+    self.assertEqual(self.recordlist._offset, 0)
+    self.assertEqual(self.recordlist.selected_id, self.key('2021-06-01', 1))
+    self.recordlist._on_key(Mock(keysym='End'))
+    self.assertEqual(self.recordlist._offset, 200 - visible)
+    self.assertEqual(self.recordlist.treeview.selection(), ('199',))
+
+  def test_insert_and_remove_row(self):
+    self.recordlist.populate(self.rows)
+    new = {'Date': '2021-06-02', 'Time': '8:00', 'Lab': 'A', 'Plot': 1}
+    self.recordlist.insert_row(new)
+    self.assertEqual(len(self.recordlist._rows), 201)
+    self.assertEqual(self.recordlist.iid_map['0'], self.key('2021-06-02', 1))
+    self.assertEqual(self.recordlist.iid_map['1'], self.key('2021-06-01', 1))
+    # the selection follows the row it was on
+    self.assertEqual(self.recordlist.selected_id, self.key('2021-06-01', 1))
+
+    # saving the same key again replaces the row
+    self.recordlist.insert_row(dict(self.rows[4]))
+    self.assertEqual(len(self.recordlist._rows), 201)
+    self.assertEqual(self.recordlist._rows[5]['Plot'], 5)
+
+    self.recordlist.remove_row(self.key('2021-06-02', 1))
+    self.assertEqual(len(self.recordlist._rows), 200)
+    self.assertEqual(self.recordlist.iid_map['0'], self.key('2021-06-01', 1))
+    self.assertEqual(self.recordlist.selected_id, self.key('2021-06-01', 1))
+    # unknown keys are ignored
+    self.recordlist.remove_row(self.key('2021-06-03', 1))
+    self.assertEqual(len(self.recordlist._rows), 200)
+
+    # rows past the last loaded page wait for that page
+    self.recordlist.more_available = True
+    self.recordlist.insert_row(
+      {'Date': '2021-05-01', 'Time': '8:00', 'Lab': 'A', 'Plot': 1}
+    )
+    self.assertEqual(len(self.recordlist._rows), 200)
+
+  def test_load_more(self):
+    load_more = Mock()
+    self.recordlist.bind('<<LoadMoreRecords>>', load_more)
+    self.recordlist.populate(self.rows, more_available=True)
+
+    # far from the end, nothing is requested
+    self.recordlist._scroll_to(0)
+    load_more.assert_not_called()
+
+    # near the end, one page is requested at a time
+    self.recordlist._scroll_to(1000)
+    self.recordlist._scroll_to(0)
+    self.recordlist._scroll_to(1000)
+    self.assertEqual(load_more.call_count, 1)
+
+    more = [
+      {'Date': '2021-05-31', 'Time': '8:00', 'Lab': 'A', 'Plot': plot}
+      for plot in range(1, 21)
+    ]
+    self.recordlist.extend(more, more_available=False)
+    self.assertEqual(len(self.recordlist._rows), 220)
+    self.recordlist._scroll_to(1000)
+    self.assertEqual(self.recordlist._offset, 220 - self.recordlist._visible)
+    self.assertEqual(load_more.call_count, 1)
+
+    # a cancelled fetch is asked for again
+    self.recordlist.more_available = True
+    self.recordlist._fetch_pending = True
+    self.recordlist.cancel_fetch()
+    self.recordlist._scroll_to(0)
+    self.recordlist._scroll_to(1000)
+    self.assertEqual(load_more.call_count, 2)
+
+
+class TestLineChartView(TkTestCase):
+
+  def setUp(self):
+    days = np.arange(1000, dtype=float)
+    data = models.ColumnBatch(
+      {
+        'Day': np.concatenate([days, days]),
+        'Avg Height (cm)': np.concatenate([days / 100, days / 50]),
+        'lab_id': np.repeat([0, 1], 1000)
+      },
+      {'lab_id': np.array(['A', 'B'])}
+    )
+    self.chart = views.LineChartView(
+      self.root, data, (400, 200), 'Day', 'Avg Height (cm)', 'lab_id'
+    )
+
+  def tearDown(self):
+    self.chart.destroy()
+
+  def line_coords(self, plot_name):
+    """Get the coordinates of the one line drawn for plot_name"""
+    items = self.chart.plot_area.find_withtag(f'line-{plot_name}')
+    self.assertEqual(len(items), 1)
+    return self.chart.plot_area.coords(items[0])
+
+  def finish_redraw(self):
+    # Run the pending redraw now rather than after redraw_delay
+    self.chart.after_cancel(self.chart._redraw_job)
+    self.chart._redraw()
+
+  def test_draw(self):
+    self.assertEqual(self.chart.viewport, (0.0, 999.0))
+    self.assertEqual(self.chart.max_y, 999 / 50)
+    # each line is downsampled to one point per pixel
+    for plot_name in 'AB':
+      self.assertEqual(len(self.line_coords(plot_name)), 800)
+    self.assertEqual(len(self.chart._lod_cache), 2)
+    legend = [
+      self.chart.plot_area.itemcget(item, 'text')
+      for item in self.chart.plot_area.find_withtag('legend')
+    ]
+    self.assertEqual(legend, ['A', 'B'])
+
+  def test_lod_cache(self):
+    with patch.object(
+      views, 'downsample', wraps=views.downsample
+    ) as downsample:
+      # the same viewport is not redrawn at all
+      self.chart.set_viewport(0, 999)
+      downsample.assert_not_called()
+
+      self.chart.set_viewport(100, 200)
+      self.assertEqual(downsample.call_count, 2)
+      # one point either side of the viewport runs off the edges
+      coords = self.line_coords('A')
+      self.assertEqual(len(coords), 2 * 103)
+      self.assertEqual(coords[0], -4)
+
+      # going back to the full view uses the cached lines
+      self.chart.set_viewport(0, 999)
+      self.assertEqual(downsample.call_count, 2)
+      self.assertEqual(len(self.line_coords('A')), 800)
+
+    for start in range(40):
+      self.chart.set_viewport(start, start + 100)
+    self.assertEqual(
+      len(self.chart._lod_cache), self.chart.lod_cache_size
+    )
+
+  def test_zoom(self):
+    # wheel up in the middle of the plot
+    event = Mock(num=4, delta=0, x=200)
+    self.assertEqual(self.chart._on_zoom(event), 'break')
+    # the drawn lines are scaled now, and redrawn later
+    self.assertEqual(self.line_coords('A')[0], -50)
+    self.assertEqual(self.chart.viewport, (0.0, 999.0))
+    x0, x1 = self.chart._target
+    self.assertAlmostEqual(x1 - x0, 999 / 1.25)
+    self.assertAlmostEqual((x0 + x1) / 2, 499.5)
+    self.finish_redraw()
+    self.assertEqual(self.chart.viewport, (x0, x1))
+    self.assertEqual(len(self.line_coords('A')), 800)
+
+    # zooming in stops at min_span
+    for _ in range(50):
+      self.chart._on_zoom(Mock(num=4, delta=0, x=0))
+    x0, x1 = self.chart._target
+    self.assertAlmostEqual(x1 - x0, self.chart.min_span)
+
+    # zooming out stops at the whole data range
+    for _ in range(50):
+      self.chart._on_zoom(Mock(num=5, delta=-120, x=0))
+    self.finish_redraw()
+    self.assertEqual(self.chart.viewport, (0.0, 999.0))
+
+  def test_pan(self):
+    self.chart.set_viewport(0, 100)
+    before = self.line_coords('A')
+    # dragging left moves on to later days
+    self.chart._on_drag_start(Mock(x=300))
+    self.chart._on_drag(Mock(x=100))
+    self.chart._on_drag_end(Mock(x=100))
+    self.assertEqual(self.line_coords('A')[0], before[0] - 200)
+    self.assertEqual(self.chart._target, (50.0, 150.0))
+    self.finish_redraw()
+    self.assertEqual(self.chart.viewport, (50.0, 150.0))
+
+    # the viewport stays inside the data
+    self.chart._pan(-100000)
+    self.assertEqual(self.chart._target, (899.0, 999.0))
+    self.chart.reset_view()
+    self.finish_redraw()
+    self.assertEqual(self.chart.viewport, (0.0, 999.0))
+
+  def test_resize(self):
+    self.chart._on_configure(Mock(width=640, height=300))
+    self.assertEqual(
+      (self.chart.plot_width, self.chart.plot_height), (600, 260)
+    )
+    self.assertEqual(int(self.chart.plot_area.cget('width')), 600)
+    self.finish_redraw()
+    self.assertEqual(len(self.line_coords('A')), 1200)
+    self.assertIn(('A', (0.0, 999.0), 600, 260), self.chart._lod_cache)
+
+    # the same size again doesn't redraw
+    self.chart._on_configure(Mock(width=640, height=300))
+    self.assertIsNone(self.chart._redraw_job)
+
+  def test_update_point(self):
+    a_key = ('A', (0.0, 999.0), 400, 200)
+    b_key = ('B', (0.0, 999.0), 400, 200)
+    b_coords = self.chart._lod_cache[b_key]
+
+    # replacing a point only redraws its own line
+    self.chart.update_point('A', 10, 5)
+    x, y, _ = self.chart.lines['A']
+    self.assertEqual(len(x), 1000)
+    self.assertEqual(y[10], 5)
+    self.assertEqual(self.line_coords('A'), self.chart._lod_cache[a_key])
+    self.assertIs(self.chart._lod_cache[b_key], b_coords)
+
+    # a new day extends the line, and the view follows it
+    self.chart.update_point('A', 1000, 5)
+    self.assertEqual(len(self.chart.lines['A'][0]), 1001)
+    self.assertEqual(self.chart.x_range, (0.0, 1000.0))
+    self.assertEqual(self.chart.viewport, (0.0, 1000.0))
+    self.assertEqual(len(self.line_coords('A')), 800)
+
+    # a new lab gets a line and a legend entry
+    self.chart.update_point('C', 0, 1)
+    self.chart.update_point('C', 1, 2)
+    self.assertEqual(list(self.chart.lines['C'][0]), [0, 1])
+    self.assertEqual(len(self.line_coords('C')), 4)
+    legend = [
+      self.chart.plot_area.itemcget(item, 'text')
+      for item in self.chart.plot_area.find_withtag('legend')
+    ]
+    self.assertEqual(legend, ['A', 'B', 'C'])
+
+    # a higher point rescales every line
+    self.chart.update_point('B', 500, 40)
+    self.assertEqual(self.chart.max_y, 40)
+    self.assertEqual(min(self.line_coords('B')[1::2]), 0)
+    self.assertNotIn(b_key, self.chart._lod_cache)
+
+  def test_remove_point(self):
+    a_key = ('A', (0.0, 999.0), 400, 200)
+    b_key = ('B', (0.0, 999.0), 400, 200)
+    b_coords = self.chart._lod_cache[b_key]
+
+    self.chart.remove_point('A', 10)
+    x, y, _ = self.chart.lines['A']
+    self.assertEqual(len(x), 999)
+    self.assertNotIn(10, x)
+    self.assertEqual(self.line_coords('A'), self.chart._lod_cache[a_key])
+    self.assertIs(self.chart._lod_cache[b_key], b_coords)
+
+    # points and labs that aren't there are ignored
+    self.chart.remove_point('A', 10)
+    self.chart.remove_point('A', 5000)
+    self.chart.remove_point('C', 1)
+    self.assertEqual(len(self.chart.lines['A'][0]), 999)
+    self.assertNotIn('C', self.chart.lines)
+
+    # removing a whole group leaves no line for it
+    for day in range(1000):
+      self.chart.remove_point('B', day)
+    self.assertEqual(self.chart.lines['B'][0].size, 0)
+    self.assertEqual(self.chart.plot_area.find_withtag('line-B'), ())
+    self.assertEqual(len(self.line_coords('A')), 800)
+
+    # the data range shrinks with the removed points
+    self.chart.remove_point('A', 999)
+    self.assertEqual(self.chart.x_range, (0.0, 998.0))
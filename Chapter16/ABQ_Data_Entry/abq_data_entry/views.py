@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import ttk
 from tkinter.simpledialog import Dialog
 from datetime import datetime
+import numpy as np
 from . import widgets as w
 from .constants import FieldTypes as FT
 from . import images
@@ -578,12 +579,335 @@ class RecordList(tk.Frame):
     self._updated.clear()
 
 
+class VirtualRecordList(RecordList):
+  """A RecordList that only renders the rows currently in view
+
+  The rows are kept in a plain Python list, and only the visible slice
+  (plus a few rows of overscan) is inserted into the treeview.
+  When the view gets near the end of the loaded rows, and more rows
+  are available, <<LoadMoreRecords>> is generated so the application
+  can fetch another page from the model.
+  """
+
+  overscan = 5
+  fetch_threshold = 50
+
+  def __init__(self, parent, *args, **kwargs):
+    super().__init__(parent, *args, **kwargs)
+    self._rows = list()
+    self._offset = 0
+    self._selected = None
+    # A guess until the rows can be measured
+    self._visible = int(self.treeview.cget('height'))
+    self._measure_job = None
+    self.more_available = False
+    self._fetch_pending = False
+
+    # The scrollbar works on the row list, not the treeview
+    self.scrollbar.configure(command=self._on_scrollbar)
+    self.treeview.configure(yscrollcommand='')
+
+    for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+      self.treeview.bind(sequence, self._on_mousewheel)
+    for sequence in (
+      '<Up>', '<Down>', '<Prior>', '<Next>', '<Home>', '<End>'
+    ):
+      self.treeview.bind(sequence, self._on_key)
+    self.treeview.bind('<Configure>', self._on_configure)
+    self.treeview.bind('<<TreeviewSelect>>', self._on_select)
+
+  def _rowkey(self, rowdata):
+    cids = list(self.column_defs.keys())[1:]
+    return tuple([str(rowdata[key]) for key in cids])
+
+  def populate(self, rows, more_available=False):
+    """Replace the row list and show the first page of it."""
+    self._rows = list(rows)
+    self._offset = 0
+    self._selected = 0 if self._rows else None
+    self.more_available = more_available
+    self._fetch_pending = False
+    self._render()
+    self._update_scrollbar()
+    # The first rows may arrive after the last <Configure>
+    if self._measure_job is None:
+      self._measure_job = self.after_idle(self._measure)
+
+    if self._rows:
+      self.treeview.focus_set()
+      self.treeview.selection_set('0')
+      self.treeview.focus('0')
+
+  def extend(self, rows, more_available=False):
+    """Add another page of rows to the end of the list"""
+    start = len(self._rows)
+    self._rows.extend(rows)
+    self.more_available = more_available
+    self._fetch_pending = False
+    if start < self._offset + self._visible + self.overscan:
+      self._render()
+    self._update_scrollbar()
+
+  def cancel_fetch(self):
+    """Forget a requested page that won't arrive
+
+    The next scroll near the end of the list asks for it again.
+    """
+    self._fetch_pending = False
+
+  def _index_of(self, rowkey):
+    rowkey = tuple([str(v) for v in rowkey])
+    for index, rowdata in enumerate(self._rows):
+      if self._rowkey(rowdata) == rowkey:
+        return index
+    return None
+
+  @staticmethod
+  def _sorts_before(row, other):
+    """True if row comes before other in the record list order
+
+    This matches the model's order: date descending,
+    then time, lab and plot ascending.
+    """
+    if str(row['Date']) != str(other['Date']):
+      return str(row['Date']) > str(other['Date'])
+    return (
+      (str(row['Time']), str(row['Lab']), int(row['Plot'])) <
+      (str(other['Time']), str(other['Lab']), int(other['Plot']))
+    )
+
+  def _refresh_window(self, index):
+    """Redraw if a change at index affects what is on screen"""
+    if index < self._offset + self._visible + self.overscan:
+      self._render()
+    self._update_scrollbar()
+
+  def remove_row(self, rowkey):
+    """Remove the row with the given rowkey, if it's loaded"""
+    index = self._index_of(rowkey)
+    if index is None:
+      return
+    del self._rows[index]
+    if self._selected is not None:
+      if self._selected > index:
+        self._selected -= 1
+      elif self._selected == index:
+        self._selected = None
+    if self._offset > max(0, len(self._rows) - self._visible):
+      self._offset = max(0, len(self._rows) - self._visible)
+    self._refresh_window(index)
+
+  def insert_row(self, rowdata):
+    """Insert or replace a single row in its sorted position"""
+    self.remove_row(self._rowkey(rowdata))
+    index = 0
+    while (
+      index < len(self._rows) and
+      self._sorts_before(self._rows[index], rowdata)
+    ):
+      index += 1
+    if index == len(self._rows) and self.more_available:
+      # It belongs in a page we haven't loaded yet
+      return
+    self._rows.insert(index, rowdata)
+    if self._selected is not None and self._selected >= index:
+      self._selected += 1
+    self._refresh_window(index)
+
+  def _render(self):
+    """Write the current window of rows to the treeview"""
+    self.treeview.delete(*self.treeview.get_children())
+    self.iid_map.clear()
+
+    cids = list(self.column_defs.keys())[1:]
+    end = min(
+      len(self._rows), self._offset + self._visible + self.overscan
+    )
+    for index in range(self._offset, end):
+      rowdata = self._rows[index]
+      values = [rowdata[key] for key in cids]
+      rowkey = tuple([str(v) for v in values])
+      if rowkey in self._inserted:
+        tag = 'inserted'
+      elif rowkey in self._updated:
+        tag = 'updated'
+      else:
+        tag = ''
+      # iids are the row's index in the full list
+      iid = self.treeview.insert(
+        '', 'end', iid=str(index), values=values, tag=tag)
+      self.iid_map[iid] = rowkey
+
+    if self._selected is not None and self.treeview.exists(
+      str(self._selected)
+    ):
+      self.treeview.selection_set(str(self._selected))
+      self.treeview.focus(str(self._selected))
+    # keep the first row of the window at the top of the treeview
+    self.treeview.yview_moveto(0)
+
+  def _update_scrollbar(self):
+    total = len(self._rows)
+    if not total:
+      self.scrollbar.set(0, 1)
+      return
+    first = self._offset / total
+    last = min(1, (self._offset + self._visible) / total)
+    self.scrollbar.set(first, last)
+
+  def _scroll_to(self, offset):
+    """Move the window so that it starts at offset"""
+    max_offset = max(0, len(self._rows) - self._visible)
+    offset = max(0, min(offset, max_offset))
+    if offset != self._offset:
+      self._offset = offset
+      self._render()
+    self._update_scrollbar()
+    self._check_fetch()
+
+  def _check_fetch(self):
+    """Ask for more rows if we're close to the end of the list"""
+    if not self.more_available or self._fetch_pending:
+      return
+    window_end = self._offset + self._visible
+    if window_end + self.fetch_threshold >= len(self._rows):
+      self._fetch_pending = True
+      self.event_generate('<<LoadMoreRecords>>')
+
+  def _on_scrollbar(self, action, amount, unit=None):
+    if action == 'moveto':
+      self._scroll_to(round(float(amount) * len(self._rows)))
+    elif action == 'scroll':
+      step = self._visible if unit == 'pages' else 1
+      self._scroll_to(self._offset + int(amount) * step)
+
+  def _on_mousewheel(self, event):
+    if event.num == 4 or event.delta > 0:
+      self._scroll_to(self._offset - 3)
+    else:
+      self._scroll_to(self._offset + 3)
+    return 'break'
+
+  def _on_key(self, event):
+    """Move the selection, scrolling the window as needed"""
+    if not self._rows:
+      return 'break'
+    current = self._offset if self._selected is None else self._selected
+    moves = {
+      'Up': current - 1,
+      'Down': current + 1,
+      'Prior': current - self._visible,
+      'Next': current + self._visible,
+      'Home': 0,
+      'End': len(self._rows) - 1
+    }
+    index = max(0, min(moves[event.keysym], len(self._rows) - 1))
+    self._selected = index
+    if index < self._offset:
+      self._scroll_to(index)
+    elif index >= self._offset + self._visible:
+      self._scroll_to(index - self._visible + 1)
+    else:
+      self._check_fetch()
+    self.treeview.selection_set(str(index))
+    self.treeview.focus(str(index))
+    return 'break'
+
+  def _on_select(self, *_):
+    selection = self.treeview.selection()
+    if selection:
+      self._selected = int(selection[0])
+
+  def _on_configure(self, event):
+    self._measure(event.height)
+
+  def _measure(self, height=None):
+    """Work out how many rows fit in the treeview"""
+    self._measure_job = None
+    children = self.treeview.get_children()
+    bbox = self.treeview.bbox(children[0]) if children else ''
+    if not bbox:
+      return
+    if height is None:
+      height = self.treeview.winfo_height()
+    _, heading_height, _, row_height = bbox
+    visible = max(1, (height - heading_height) // row_height)
+    if visible != self._visible:
+      self._visible = visible
+      self._render()
+      self._scroll_to(self._offset)
+
+  @property
+  def selected_id(self):
+    if self._selected is None or self._selected >= len(self._rows):
+      return None
+    return self._rowkey(self._rows[self._selected])
+
+  def destroy(self):
+    if self._measure_job is not None:
+      self.after_cancel(self._measure_job)
+    super().destroy()
+
+
 # New ch15
 
+def minmax_downsample(x, y, buckets):
+  """Keep the lowest and highest y point of each of buckets bins
+
+  This is cheap, and keeps the peaks that a plain stride would drop.
+  """
+  if len(x) <= 2 * buckets:
+    return x, y
+  edges = np.linspace(0, len(x), buckets + 1).astype(int)
+  keep = list()
+  for start, end in zip(edges[:-1], edges[1:]):
+    chunk = y[start:end]
+    keep.extend(sorted((start + chunk.argmin(), start + chunk.argmax())))
+  keep = np.unique(keep)
+  return x[keep], y[keep]
+
+
+def lttb_downsample(x, y, threshold):
+  """Reduce x and y to threshold points using Largest-Triangle-Three-Buckets
+
+  The first and last points are kept; from each bucket in between the
+  point forming the largest triangle with its neighbours is kept.
+  """
+  size = len(x)
+  if threshold >= size or threshold < 3:
+    return x, y
+  edges = np.linspace(1, size - 1, threshold - 1).astype(int)
+  keep = np.empty(threshold, dtype=int)
+  keep[0], keep[-1] = 0, size - 1
+  a = 0
+  for i in range(threshold - 2):
+    start, end = edges[i], edges[i + 1]
+    next_end = edges[i + 2] if i + 2 < len(edges) else size
+    avg_x = x[end:next_end].mean()
+    avg_y = y[end:next_end].mean()
+    areas = np.abs(
+      (x[a] - avg_x) * (y[start:end] - y[a])
+      - (x[a] - x[start:end]) * (avg_y - y[a])
+    )
+    a = start + areas.argmax()
+    keep[i + 1] = a
+  return x[keep], y[keep]
+
+
+def downsample(x, y, width):
+  """Downsample a line for a plot width pixels wide
+
+  Very long lines get a min-max pass first to bound the cost of LTTB.
+  """
+  x, y = minmax_downsample(x, y, width * 2)
+  return lttb_downsample(x, y, width)
+
+
 class LineChartView(tk.Canvas):
   """A generic view for plotting a line chart"""
 
   margin = 20
+  lod_cache_size = 32
   colors = [
     'red', 'orange', 'yellow', 'green',
     'blue', 'purple', 'violet',
@@ -609,69 +933,295 @@ class LineChartView(tk.Canvas):
       height=view_height, background='lightgrey'
     )
     # Draw chart
-    self.origin = (self.margin, view_height - self.margin)
-    self.create_line(
-      self.origin, (self.margin, self.margin), width=2
-    )
-    self.create_line(
-      self.origin,
-      (view_width - self.margin, view_height - self.margin)
-    )
+    # Items are tagged so _layout() can move them on resize
+    self.create_line(0, 0, 0, 0, width=2, tags=('y_axis',))
+    self.create_line(0, 0, 0, 0, tags=('x_axis',))
+    self.create_text(0, 0, text=x_field, anchor='n', tags=('x_label',))
     self.create_text(
-      (view_width // 2, view_height - self.margin),
-      text=x_field, anchor='n'
-    )
-    self.create_text(
-       (self.margin, view_height // 2),
-       text=y_field, angle=90, anchor='s'
+       0, 0, text=y_field, angle=90, anchor='s', tags=('y_label',)
     )
     self.plot_area = tk.Canvas(
       self, background='#555',
       width=self.plot_width, height=self.plot_height
     )
     self.create_window(
-      self.origin, window=self.plot_area, anchor='sw'
+      0, 0, window=self.plot_area, anchor='sw', tags=('plot_area',)
     )
+    self._layout(view_width, view_height)
 
     # Draw legend and lines
-    plot_names = sorted(set([
-        row[self.plot_by_field]
-        for row in self.data
-    ]))
+    # data is a ColumnBatch, with plot_by_field as categorical codes
+    x = data.columns[x_field]
+    y = data.columns[y_field]
+    codes = data.columns[plot_by_field]
+    plot_names = data.categories[plot_by_field]
 
     color_map = list(zip(plot_names, self.colors))
 
-    for plot_name, color in color_map:
-      dataxy = [
-        (row[x_field], row[y_field])
-        for row in data
-        if row[plot_by_field] == plot_name
-      ]
-      self._plot_line(dataxy, color)
+    # new for level-of-detail rendering
+    self.lines = dict()
+    for code, (plot_name, color) in enumerate(color_map):
+      mask = (codes == code) & np.isfinite(x) & np.isfinite(y)
+      order = np.argsort(x[mask], kind='stable')
+      self.lines[plot_name] = (x[mask][order], y[mask][order], color)
+    self._lod_cache = dict()
+    self.max_y = max(
+      [line_y.max() for _, line_y, _ in self.lines.values() if line_y.size]
+      or [1]
+    ) or 1
+    self.x_range = self._data_range()
+    self.viewport = None
+    self.set_viewport(*self.x_range)
 
     self._draw_legend(color_map)
 
+    # new for zoom and pan
+    self._redraw_job = None
+    self._drag_x = None
+    for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+      self.plot_area.bind(sequence, self._on_zoom)
+    self.plot_area.bind('<ButtonPress-1>', self._on_drag_start)
+    self.plot_area.bind('<B1-Motion>', self._on_drag)
+    self.plot_area.bind('<ButtonRelease-1>', self._on_drag_end)
+    self.plot_area.bind('<Double-Button-1>', self.reset_view)
+    self.bind('<Configure>', self._on_configure)
+
+  def _layout(self, view_width, view_height):
+    """Position the axes, labels and plot area for the view size"""
+    self.origin = (self.margin, view_height - self.margin)
+    self.coords('y_axis', *self.origin, self.margin, self.margin)
+    self.coords(
+      'x_axis', *self.origin,
+      view_width - self.margin, view_height - self.margin
+    )
+    self.coords('x_label', view_width // 2, view_height - self.margin)
+    self.coords('y_label', self.margin, view_height // 2)
+    self.coords('plot_area', *self.origin)
+
+  def _data_range(self):
+    """Get the lowest and highest x value of all lines"""
+    xs = [line_x for line_x, _, _ in self.lines.values() if line_x.size]
+    if not xs:
+      return (0, 1)
+    low = min(line_x[0] for line_x in xs)
+    high = max(line_x[-1] for line_x in xs)
+    return (low, high) if high > low else (low, low + 1)
+
+  def set_viewport(self, x0, x1):
+    """Show the data between x0 and x1
+
+    Lines are only recomputed when the viewport actually changes.
+    """
+    viewport = (float(x0), float(x1))
+    if viewport == self.viewport:
+      return
+    self.viewport = viewport
+    self._draw_lines()
+
+  def _draw_lines(self):
+    self.plot_area.delete('line')
+    for plot_name in self.lines:
+      self._draw_line(plot_name)
+
+  def _draw_line(self, plot_name):
+    x, y, color = self.lines[plot_name]
+    coords = self._line_coords(plot_name, x, y)
+    if len(coords) >= 4:
+      self._plot_line(coords, color, plot_name)
 
-  def _plot_line(self, data, color):
-    """Plot a line described by data in the given color"""
+  def _line_coords(self, plot_name, x, y):
+    """Get the canvas coordinates of a line for the current viewport
 
-    max_x = max([row[0] for row in data])
-    max_y = max([row[1] for row in data])
-    x_scale = self.plot_width / max_x
-    y_scale = self.plot_height / max_y
-    coords = [
-      (round(x * x_scale), self.plot_height - round(y * y_scale))
-      for x, y in data
-    ]
+    Visible points are downsampled to the plot width, and the
+    results are cached for each viewport and plot size.
+    """
+    key = (plot_name, self.viewport, self.plot_width, self.plot_height)
+    if key in self._lod_cache:
+      return self._lod_cache[key]
+
+    x0, x1 = self.viewport
+    # Include a point either side so lines run off the edges
+    start = max(np.searchsorted(x, x0, 'left') - 1, 0)
+    end = np.searchsorted(x, x1, 'right') + 1
+    vx, vy = downsample(x[start:end], y[start:end], self.plot_width)
+
+    x_scale = self.plot_width / (x1 - x0)
+    y_scale = self.plot_height / self.max_y
+    coords = np.column_stack((
+      np.rint((vx - x0) * x_scale),
+      self.plot_height - np.rint(vy * y_scale)
+    )).astype(int).ravel().tolist()
+
+    if len(self._lod_cache) >= self.lod_cache_size:
+      self._lod_cache.pop(next(iter(self._lod_cache)))
+    self._lod_cache[key] = coords
+    return coords
+
+  def _plot_line(self, coords, color, plot_name):
+    """Plot a line through canvas coordinates in the given color"""
     self.plot_area.create_line(
-      *coords, width=4, fill=color, smooth=True
+      *coords, width=4, fill=color, smooth=True,
+      tags=('line', f'line-{plot_name}')
     )
 
+  # new for zoom and pan
+  #
+  # While the user is zooming or dragging, the drawn lines are
+  # transformed with scale() and move(), which is cheap.  Once they
+  # pause, the lines are redrawn at full detail for the new viewport.
+
+  redraw_delay = 150
+  zoom_factor = 1.25
+  min_span = 1
+
+  def _schedule_redraw(self, viewport):
+    self._target = viewport
+    if self._redraw_job:
+      self.after_cancel(self._redraw_job)
+    self._redraw_job = self.after(self.redraw_delay, self._redraw)
+
+  def _redraw(self):
+    self._redraw_job = None
+    self.viewport = None
+    self.set_viewport(*self._target)
+
+  def _pending_viewport(self):
+    return self._target if self._redraw_job else self.viewport
+
+  def _on_zoom(self, event):
+    """Zoom the x axis in or out around the mouse pointer"""
+    zoom_in = event.num == 4 or event.delta > 0
+    factor = self.zoom_factor if zoom_in else 1 / self.zoom_factor
+    x0, x1 = self._pending_viewport()
+    low, high = self.x_range
+    span = min(max((x1 - x0) / factor, self.min_span), high - low)
+    factor = (x1 - x0) / span
+    if factor == 1:
+      return 'break'
+    pointer = event.x / self.plot_width
+    center = x0 + pointer * (x1 - x0)
+    x0 = min(max(center - pointer * span, low), high - span)
+    self.plot_area.scale('line', event.x, 0, factor, 1)
+    self._schedule_redraw((x0, x0 + span))
+    return 'break'
+
+  def _pan(self, pixels):
+    """Shift the viewport by pixels, keeping it inside the data"""
+    x0, x1 = self._pending_viewport()
+    low, high = self.x_range
+    span = x1 - x0
+    shift = -pixels * span / self.plot_width
+    shift = min(max(shift, low - x0), high - x1)
+    if shift:
+      self.plot_area.move('line', -shift * self.plot_width / span, 0)
+      self._schedule_redraw((x0 + shift, x1 + shift))
+
+  def _on_drag_start(self, event):
+    self._drag_x = event.x
+
+  def _on_drag(self, event):
+    if self._drag_x is None:
+      return
+    self._pan(event.x - self._drag_x)
+    self._drag_x = event.x
+
+  def _on_drag_end(self, event):
+    self._drag_x = None
+
+  def reset_view(self, *_):
+    """Show the whole data range again"""
+    self._schedule_redraw(self.x_range)
+
+  def destroy(self):
+    if self._redraw_job:
+      self.after_cancel(self._redraw_job)
+    super().destroy()
+
+  def _on_configure(self, event):
+    """Resize the plot area to fill the view"""
+    plot_width = max(event.width - (2 * self.margin), 1)
+    plot_height = max(event.height - (2 * self.margin), 1)
+    if (plot_width, plot_height) == (self.plot_width, self.plot_height):
+      return
+    self.plot_width, self.plot_height = plot_width, plot_height
+    self.plot_area.configure(width=plot_width, height=plot_height)
+    self._layout(event.width, event.height)
+    self._schedule_redraw(self._pending_viewport())
+
+  # new for live updates
+
+  def update_point(self, plot_name, x, y):
+    """Add or replace the point at x on one line
+
+    Only that line is redrawn, unless the new point changes
+    the scale or the visible range of the chart.
+    """
+    x, y = float(x), float(y)
+    if plot_name not in self.lines:
+      color = self.colors[len(self.lines) % len(self.colors)]
+      self.lines[plot_name] = (np.empty(0), np.empty(0), color)
+      self._draw_legend(
+        [(name, line[2]) for name, line in self.lines.items()]
+      )
+    line_x, line_y, color = self.lines[plot_name]
+    index = np.searchsorted(line_x, x)
+    if index < line_x.size and line_x[index] == x:
+      line_y = line_y.copy()
+      line_y[index] = y
+    else:
+      line_x = np.insert(line_x, index, x)
+      line_y = np.insert(line_y, index, y)
+    self.lines[plot_name] = (line_x, line_y, color)
+
+    for key in [key for key in self._lod_cache if key[0] == plot_name]:
+      del self._lod_cache[key]
+    old_high = self.x_range[1]
+    self.x_range = self._data_range()
+    x0, x1 = self._pending_viewport()
+
+    if y > self.max_y:
+      self.max_y = y
+      self._lod_cache.clear()
+      self.viewport = None
+    if x1 >= old_high and self.x_range[1] > old_high:
+      # Keep following the newest data
+      x1 = self.x_range[1]
+    if self._redraw_job:
+      self._target = (x0, x1)
+    elif (x0, x1) != self.viewport:
+      self.set_viewport(x0, x1)
+    else:
+      self.plot_area.delete(f'line-{plot_name}')
+      self._draw_line(plot_name)
+
+  def remove_point(self, plot_name, x):
+    """Remove the point at x from one line, if it is there"""
+    x = float(x)
+    if plot_name not in self.lines:
+      return
+    line_x, line_y, color = self.lines[plot_name]
+    index = np.searchsorted(line_x, x)
+    if index == line_x.size or line_x[index] != x:
+      return
+    line_x = np.delete(line_x, index)
+    line_y = np.delete(line_y, index)
+    self.lines[plot_name] = (line_x, line_y, color)
+
+    for key in [key for key in self._lod_cache if key[0] == plot_name]:
+      del self._lod_cache[key]
+    self.x_range = self._data_range()
+    if not self._redraw_job:
+      self.plot_area.delete(f'line-{plot_name}')
+      self._draw_line(plot_name)
+
   def _draw_legend(self, color_map):
     # determine legend
+    self.plot_area.delete('legend')
     y = 10
     for label, color in color_map:
-      self.plot_area.create_text((10, y), text=label, fill=color, anchor='w')
+      self.plot_area.create_text(
+        (10, y), text=label, fill=color, anchor='w', tags=('legend',)
+      )
       y += 20
 
 
@@ -692,8 +1242,9 @@ class YieldChartView(tk.Frame):
     self.scatter_labels = list()
 
   def draw_scatter(self, data, color, label):
-    x, y, s = zip(*data)
-    s = [(x ** 2)//2 for x in s]
+    """Draw a scatter from data, a tuple of x, y and size arrays"""
+    x, y, s = data
+    s = (s ** 2) // 2
     scatter = self.axes.scatter(
       x, y, s,
       c=color, label=label, alpha=0.5
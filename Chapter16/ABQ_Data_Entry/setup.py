@@ -18,7 +18,7 @@ setup(
     'abq_data_entry.test'
   ],
   install_requires=[
-      'requests', 'paramiko', 'matplotlib', 'psycopg2'
+      'requests', 'paramiko>=3.3', 'matplotlib', 'numpy', 'psycopg2'
   ],
   python_requires='>=3.6',
   package_data={'abq_data_entry.images': ['*.png', '*.xbm']},
@@ -0,0 +1,16 @@
+-- Indexes for the application's access paths
+-- Run after create_db.sql; safe to run again on an existing database.
+-- CONCURRENTLY keeps the tables writable while the indexes build,
+-- so this script must not be run inside a transaction block.
+
+-- The growth summary refresh run on every plot check save filters
+-- plot_checks on date and lab; the primary key has time between them.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS plot_checks_date_lab_plot
+    ON plot_checks(date, lab_id, plot);
+
+-- Single-record lookups (get_record) filter plot_checks on its whole
+-- primary key.  Today's records and keyset paging use the primary
+-- keys of plot_checks and lab_checks, which lead with the date.
+
+ANALYZE plot_checks;
+ANALYZE lab_checks;
@@ -0,0 +1,133 @@
+-- Summary tables for the growth and yield charts
+-- Run after create_db.sql; safe to run again on an existing database.
+-- Triggers on plot_checks keep each summary row current,
+-- so the charts never have to aggregate the whole table.
+
+-- Average median height for each lab on each date
+CREATE TABLE IF NOT EXISTS growth_summary (
+	date DATE NOT NULL,
+	lab_id CHAR(1) NOT NULL,
+	avg_height NUMERIC,
+	PRIMARY KEY(date, lab_id)
+	);
+
+-- Yield and conditions of each plot and seed, without faulted checks
+CREATE TABLE IF NOT EXISTS yield_summary (
+	lab_id CHAR(1) NOT NULL,
+	plot SMALLINT NOT NULL,
+	seed_sample CHAR(6) NOT NULL,
+	yield SMALLINT,
+	avg_humidity NUMERIC,
+	avg_temperature NUMERIC,
+	PRIMARY KEY(lab_id, plot, seed_sample)
+	);
+
+-- Lets refresh_yield_summary find a plot's checks without a scan
+CREATE INDEX IF NOT EXISTS plot_checks_lab_plot_seed
+    ON plot_checks(lab_id, plot, seed_sample);
+
+-- Each refresh first claims its summary row, so concurrent saves
+-- to the same group wait for each other and then recompute the
+-- group with each other's rows in view.
+CREATE OR REPLACE FUNCTION refresh_growth_summary(d DATE, lab CHAR(1))
+RETURNS void AS $$
+    INSERT INTO growth_summary (date, lab_id) VALUES (d, lab)
+	ON CONFLICT (date, lab_id) DO UPDATE
+	SET avg_height = growth_summary.avg_height;
+    UPDATE growth_summary SET avg_height = (
+	SELECT avg(median_height) FROM plot_checks
+	WHERE date = d AND lab_id = lab
+	)
+	WHERE date = d AND lab_id = lab;
+    DELETE FROM growth_summary
+	WHERE date = d AND lab_id = lab AND avg_height IS NULL;
+$$ LANGUAGE SQL;
+
+CREATE OR REPLACE FUNCTION refresh_yield_summary(
+    lab CHAR(1), p SMALLINT, seed CHAR(6)
+)
+RETURNS void AS $$
+    INSERT INTO yield_summary (lab_id, plot, seed_sample)
+	VALUES (lab, p, seed)
+	ON CONFLICT (lab_id, plot, seed_sample) DO UPDATE
+	SET yield = yield_summary.yield;
+    UPDATE yield_summary SET (yield, avg_humidity, avg_temperature) = (
+	SELECT max(fruit), avg(humidity), avg(temperature)
+	FROM plot_checks
+	WHERE lab_id = lab AND plot = p AND seed_sample = seed
+	AND NOT equipment_fault
+	)
+	WHERE lab_id = lab AND plot = p AND seed_sample = seed;
+    DELETE FROM yield_summary
+	WHERE lab_id = lab AND plot = p AND seed_sample = seed
+	AND yield IS NULL;
+$$ LANGUAGE SQL;
+
+-- Statement-level triggers see the changed rows as transition
+-- tables, so a bulk load refreshes each group it touches once.
+-- Groups are refreshed in key order so that concurrent statements
+-- claim summary rows in the same order and can't deadlock.
+CREATE OR REPLACE FUNCTION plot_checks_summarize() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+	PERFORM refresh_growth_summary(g.date, g.lab_id)
+	    FROM (SELECT DISTINCT date, lab_id FROM new_rows) AS g
+	    ORDER BY g.date, g.lab_id;
+	PERFORM refresh_yield_summary(g.lab_id, g.plot, g.seed_sample)
+	    FROM (SELECT DISTINCT lab_id, plot, seed_sample FROM new_rows) AS g
+	    ORDER BY g.lab_id, g.plot, g.seed_sample;
+    ELSIF TG_OP = 'DELETE' THEN
+	PERFORM refresh_growth_summary(g.date, g.lab_id)
+	    FROM (SELECT DISTINCT date, lab_id FROM old_rows) AS g
+	    ORDER BY g.date, g.lab_id;
+	PERFORM refresh_yield_summary(g.lab_id, g.plot, g.seed_sample)
+	    FROM (SELECT DISTINCT lab_id, plot, seed_sample FROM old_rows) AS g
+	    ORDER BY g.lab_id, g.plot, g.seed_sample;
+    ELSE
+	PERFORM refresh_growth_summary(g.date, g.lab_id)
+	    FROM (
+		SELECT date, lab_id FROM old_rows
+		UNION SELECT date, lab_id FROM new_rows
+	    ) AS g
+	    ORDER BY g.date, g.lab_id;
+	PERFORM refresh_yield_summary(g.lab_id, g.plot, g.seed_sample)
+	    FROM (
+		SELECT lab_id, plot, seed_sample FROM old_rows
+		UNION SELECT lab_id, plot, seed_sample FROM new_rows
+	    ) AS g
+	    ORDER BY g.lab_id, g.plot, g.seed_sample;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A trigger with transition tables can only have one event
+DROP TRIGGER IF EXISTS plot_checks_summary ON plot_checks;
+DROP TRIGGER IF EXISTS plot_checks_summary_insert ON plot_checks;
+DROP TRIGGER IF EXISTS plot_checks_summary_update ON plot_checks;
+DROP TRIGGER IF EXISTS plot_checks_summary_delete ON plot_checks;
+CREATE TRIGGER plot_checks_summary_insert
+    AFTER INSERT ON plot_checks REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE plot_checks_summarize();
+CREATE TRIGGER plot_checks_summary_update
+    AFTER UPDATE ON plot_checks
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE plot_checks_summarize();
+CREATE TRIGGER plot_checks_summary_delete
+    AFTER DELETE ON plot_checks REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE plot_checks_summarize();
+
+-- Fill the summaries from any existing data.  Saves wait for the
+-- backfill, so none can land between the TRUNCATE and the INSERTs.
+BEGIN;
+LOCK TABLE plot_checks IN SHARE MODE;
+TRUNCATE growth_summary, yield_summary;
+INSERT INTO growth_summary (date, lab_id, avg_height)
+    SELECT date, lab_id, avg(median_height) FROM plot_checks
+    GROUP BY date, lab_id;
+INSERT INTO yield_summary
+    SELECT lab_id, plot, seed_sample, max(fruit),
+	avg(humidity), avg(temperature)
+    FROM plot_checks WHERE NOT equipment_fault
+    GROUP BY lab_id, plot, seed_sample;
+COMMIT;